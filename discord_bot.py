@@ -10,6 +10,7 @@ import os
 import re
 import random
 import asyncio
+import io
 import tempfile
 import zipfile
 import json
@@ -35,13 +36,18 @@ from utils.state_manager import (
     add_or_update_npc,
     add_quest,
 )
-from utils.prompt_builder import build_system_prompt
-from utils.dice_roller import roll_dice, extract_inline_rolls
+from utils.prompt_builder import build_prompt_sections
+from utils.dice_roller import extract_inline_rolls
+from utils.dice_service import roll as roll_on_stream, roll_bulk, get_rng, get_stream, reseed, replay
+from utils.dice_probability import check_odds, attack_odds, format_percent
 from utils.logger import log_message, get_log_file
+from utils.session_recorder import record_dm_turn
 from utils.character_manager import (
     register_character,
     load_character,
+    load_characters,
     save_character,
+    character_txn,
     set_stat,
     set_class,
     set_race,
@@ -70,9 +76,10 @@ from utils.character_manager import (
 )
 from utils.combat_manager import (
     start_combat, roll_initiative, next_turn, 
-    get_active_combatant, end_combat, attack,
-    get_combat_status, load_combat
+    get_active_combatant, end_combat, attack, resolve_aoe, resolve_spell_aoe, cast_area_spell,
+    get_combat_status, load_combat, get_turn_order_combatants, get_current_combatant, undo_combat
 )
+from utils.combat_log import encounter_summary, iter_events
 from utils.handout_manager import (
     create_handout, get_handout, get_handouts_for_player,
     get_all_handouts, reveal_handout, share_handout_with,
@@ -84,6 +91,9 @@ from utils.map_manager import (
     TacticalMap, Token, load_map, save_map, delete_map,
     create_from_template, TERRAIN_TYPES, TOKEN_SYMBOLS, MAP_TEMPLATES
 )
+from utils.pathfinding import token_path, token_reach
+from utils.visibility import fog_view, token_cover, COVER_BONUS
+from utils.map_image import render_png_async, viewport_around, PIL_AVAILABLE, VIEWPORT_RADIUS
 from utils.xp_manager import (
     award_xp, award_party_xp, calculate_combat_xp, get_xp_summary,
     get_xp_to_next_level, format_xp_bar, milestone_level_up
@@ -103,6 +113,9 @@ from utils.reaction_manager import (
     cast_shield, cast_counterspell, use_uncanny_dodge,
     get_available_reactions, format_reaction_prompt, ReactionType
 )
+from utils.encounter_simulator import (
+    simulate_encounter, expand_monster_names, format_simulation
+)
 from utils.voice_map import get_voice_for_npc, extract_npc_from_tag
 
 load_dotenv()
@@ -254,8 +267,10 @@ async def do_action(interaction: discord.Interaction, action: str):
         action = action.replace(f"[{notation}]", f"**{result}** ({notation})")
 
     # Build system prompt and get AI response
-    system_prompt = build_system_prompt(state)
-    narration, updated_state = get_dm_response(action, state, user_id, system_prompt=system_prompt)
+    system_prompt, dynamic_context = build_prompt_sections(state, channel_id)
+    narration, updated_state = get_dm_response(action, state, user_id, system_prompt=system_prompt,
+                                               dynamic_context=dynamic_context)
+    record_dm_turn(channel_id, action, narration, updated_state, user_id)
     
     # Process loot
     loot_items = updated_state.pop('recent_loot', [])
@@ -291,16 +306,7 @@ async def do_action(interaction: discord.Interaction, action: str):
                 player_list = []
                 for pid in updated_state.get('turn_order', [str(interaction.user.id)]):
                     pchar = load_character(pid)
-                    if pchar:
-                        player_list.append({
-                            'id': pid,
-                            'name': pchar.get('name', f'Player_{pid}'),
-                            'hp': pchar.get('hp', {}).get('current', 10),
-                            'max_hp': pchar.get('hp', {}).get('max', 10),
-                            'ac': pchar.get('ac', 10)
-                        })
-                    else:
-                        player_list.append({'id': pid, 'name': f'Player_{pid}', 'hp': 10, 'max_hp': 10, 'ac': 10})
+                    player_list.append((pid, pchar.get('name', f'Player_{pid}') if pchar else f'Player_{pid}'))
                 
                 # Build enemy list with auto-stats from dnd5e_data if available
                 from utils.dnd5e_data import MONSTERS
@@ -320,11 +326,12 @@ async def do_action(interaction: discord.Interaction, action: str):
                         enemy_list.append({'name': enemy_name.capitalize(), 'hp': 10, 'max_hp': 10, 'ac': 12})
                 
                 if player_list and enemy_list:
-                    combat_state = start_combat(channel_id, player_list, enemy_list)
+                    start_combat(channel_id, player_list, enemy_list)
+                    combat_state = roll_initiative(channel_id)
                     combat_started = True
                     output += f"\n\n⚔️ **COMBAT INITIATED!**\n"
                     output += "📋 **Initiative Order:**\n"
-                    for i, c in enumerate(combat_state.get('combatants', [])):
+                    for i, c in enumerate(get_turn_order_combatants(combat_state)):
                         marker = "➤ " if i == combat_state.get('current_turn', 0) else "  "
                         output += f"{marker}{c['initiative']} - {c['name']} (HP: {c['hp']}/{c['max_hp']}, AC: {c['ac']})\n"
                     output += f"\nUse `/attack <target>` to attack, `/nextturn` to pass."
@@ -683,7 +690,7 @@ async def set_stats(
 # DICE COMMANDS
 # =============================================================================
 
-@bot.tree.command(name="roll", description="Roll dice (e.g., 1d20, 2d6+3, athletics)")
+@bot.tree.command(name="roll", description="Roll dice (e.g., 1d20, 2d6+3, 4d6kh3, athletics)")
 @app_commands.describe(dice="Dice notation or skill name", advantage="Roll with advantage", disadvantage="Roll with disadvantage")
 async def roll_cmd(interaction: discord.Interaction, dice: str, advantage: bool = False, disadvantage: bool = False):
     """Roll dice or make a skill check."""
@@ -720,8 +727,9 @@ async def roll_cmd(interaction: discord.Interaction, dice: str, advantage: bool
             skill_name = skill.upper()
         
         # Roll with advantage/disadvantage
-        roll1 = random.randint(1, 20)
-        roll2 = random.randint(1, 20) if (advantage or disadvantage) else roll1
+        roll1, roll2 = roll_bulk(20, 2, channel_id, label=skill_name)
+        if not (advantage or disadvantage):
+            roll2 = roll1
         
         if advantage:
             result = max(roll1, roll2)
@@ -741,24 +749,24 @@ async def roll_cmd(interaction: discord.Interaction, dice: str, advantage: bool
         
         msg = f"🎲 **{char_name}** rolls {skill_name}: **{total}** {roll_info} {mod_str}{crit}"
         
-        # If there's a DC, show success/failure
+        # If there's a DC, show success/failure and the odds going in
         if dc:
+            odds = format_percent(check_odds(mod, dc, advantage, disadvantage))
             if result == 20:
-                msg += " ✅ **SUCCESS!**"
+                msg += f" ✅ **SUCCESS!** (DC {dc}, {odds} chance)"
             elif result == 1:
-                msg += " ❌ **FAILURE!**"
+                msg += f" ❌ **FAILURE!** (DC {dc}, {odds} chance)"
             elif total >= dc:
-                msg += f" ✅ **SUCCESS!** (DC {dc})"
+                msg += f" ✅ **SUCCESS!** (DC {dc}, {odds} chance)"
             else:
-                msg += f" ❌ **FAILURE!** (DC {dc})"
+                msg += f" ❌ **FAILURE!** (DC {dc}, {odds} chance)"
     else:
         # Regular dice roll
         try:
-            total, rolls, modifier = roll_dice(dice)
-            rolls_str = ', '.join(map(str, rolls))
-            mod_str = f" + {modifier}" if modifier > 0 else f" - {abs(modifier)}" if modifier < 0 else ""
-            msg = f"🎲 **{char_name}** rolls {dice}: **{total}** ({rolls_str}{mod_str})"
-        except:
+            roll = roll_on_stream(dice, channel_id)
+            total = roll.total
+            msg = f"🎲 **{char_name}** rolls {dice}: **{total}** {roll.detail}"
+        except (ValueError, ZeroDivisionError):
             await interaction.response.send_message(f"❌ Invalid dice: {dice}", ephemeral=True)
             return
     
@@ -776,8 +784,10 @@ async def roll_cmd(interaction: discord.Interaction, dice: str, advantage: bool
             result_text += f" against DC {dc}. {'Success!' if success else 'Failure.'}"
         
         # Get AI's response to the roll result
-        system_prompt = build_system_prompt(state)
-        narration, updated_state = get_dm_response(result_text, state, user_id, system_prompt=system_prompt)
+        system_prompt, dynamic_context = build_prompt_sections(state, channel_id)
+        narration, updated_state = get_dm_response(result_text, state, user_id, system_prompt=system_prompt,
+                                                   dynamic_context=dynamic_context)
+        record_dm_turn(channel_id, result_text, narration, updated_state, user_id)
         
         # Clear the pending roll
         updated_state['pending_roll'] = None
@@ -858,11 +868,12 @@ async def fight_start(interaction: discord.Interaction, enemies: str):
     
     # Build initiative display
     order_display = []
-    for c in init_state['turn_order']:
+    turn_order = get_turn_order_combatants(init_state)
+    for c in turn_order:
         hp_str = f"{c['hp']}/{c.get('max_hp', c['hp'])}"
         order_display.append(f"**{c['name']}** (Init: {c['initiative']}, HP: {hp_str}, AC: {c['ac']})")
     
-    first = init_state['turn_order'][0]
+    first = turn_order[0]
     enemy_names = ', '.join(e['name'] for e in enemy_list)
     
     msg = (
@@ -893,6 +904,12 @@ async def attack_cmd(interaction: discord.Interaction, target: str, bonus: int,
         await interaction.response.send_message("No combat or target not found!", ephemeral=True)
         return
     
+    if result.get('blocked'):
+        await interaction.response.send_message(
+            f"🧱 **{char_name}** has no line of sight to **{target}** (total cover).", ephemeral=True
+        )
+        return
+    
     # Build attack message with crit/fumble info
     if result.get('fumble'):
         msg = f"⚔️ **{char_name}** attacks **{target}**... 💀 **Critical Miss!** (Rolled 1)"
@@ -907,10 +924,149 @@ async def attack_cmd(interaction: discord.Interaction, target: str, bonus: int,
     if result['target_hp'] == 0:
         msg += f"\n💀 **{target}** is down!"
     
+    if result.get('cover', 'none') != 'none':
+        msg += f"\n🛡️ {target} has {result['cover']} cover (AC {result['target_ac']})"
+    
+    try:
+        odds = await asyncio.to_thread(attack_odds, bonus, result['target_ac'], damage, double_modifier=True)
+        msg += f"\n📊 {format_percent(odds['hit'])} to hit, {odds['expected_damage']:.1f} average damage"
+    except ValueError:
+        pass
+    
     await interaction.response.send_message(msg)
     log_message(channel_id, char_name, msg)
 
 
+@bot.tree.command(name="aoe", description="Hit several targets with a spell or area effect")
+@app_commands.describe(
+    targets="Comma-separated target names, or 'enemies' for every standing enemy",
+    spell="Area spell (e.g. Fireball) - fills in save, damage and type",
+    damage="Damage dice if not using a spell (e.g. 8d6)",
+    save="Saving throw ability",
+    dc="Save DC (defaults to your spell save DC for spells)",
+    damage_type="Damage type (fire, cold, ...)",
+    slot_level="Spell slot level for upcasting",
+    half_on_save="Successful saves take half damage"
+)
+@app_commands.choices(save=[
+    app_commands.Choice(name=a, value=a) for a in ['STR', 'DEX', 'CON', 'INT', 'WIS', 'CHA']
+])
+async def aoe_cmd(
+    interaction: discord.Interaction,
+    targets: str,
+    spell: Optional[str] = None,
+    damage: Optional[str] = None,
+    save: Optional[str] = None,
+    dc: Optional[int] = None,
+    damage_type: Optional[str] = None,
+    slot_level: Optional[int] = None,
+    half_on_save: bool = True
+):
+    """Resolve an area effect: one damage roll, batched saves, one save of the encounter."""
+    channel_id = str(interaction.channel.id)
+    user_id = str(interaction.user.id)
+    
+    state = load_combat(channel_id)
+    if not state or not state.get('active'):
+        await interaction.response.send_message("No active combat!", ephemeral=True)
+        return
+    
+    if targets.strip().lower() in ('enemies', 'all enemies'):
+        names = [c['name'] for c in state['combatants'] if c.get('type') == 'enemy' and c.get('hp', 0) > 0]
+    else:
+        names = [n.strip() for n in targets.split(',') if n.strip()]
+    
+    try:
+        if spell:
+            result = resolve_spell_aoe(channel_id, spell, names, caster_id=user_id, slot_level=slot_level, dc=dc)
+            if result is None:
+                await interaction.response.send_message(
+                    f"❌ Unknown area spell: {spell}. Use damage/save/dc instead.", ephemeral=True
+                )
+                return
+        elif damage:
+            if save and dc is None:
+                await interaction.response.send_message("❌ A save needs a DC.", ephemeral=True)
+                return
+            result = resolve_aoe(channel_id, names, damage, save=save, dc=dc,
+                                 half_on_save=half_on_save, damage_type=damage_type)
+        else:
+            await interaction.response.send_message("❌ Give a spell or damage dice.", ephemeral=True)
+            return
+    except (ValueError, ZeroDivisionError) as e:
+        await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+        return
+    
+    msg = format_aoe_result(result)
+    await interaction.response.send_message(msg)
+    log_message(channel_id, "AoE", msg)
+
+
+def format_aoe_result(result):
+    """Discord message for a resolve_aoe / resolve_spell_aoe result."""
+    title = result.get('spell', 'Area effect')
+    dtype = f" {result['damage_type']}" if result.get('damage_type') else ""
+    save_text = f", {result['save']} save DC {result['dc']}" if result.get('save') else ""
+    lines = [f"💥 **{title}**: {result['damage_roll']}{dtype} damage {result['detail']}{save_text}"]
+    
+    shown = result['results'][:20]
+    for r in shown:
+        save_part = ""
+        if r['save_roll'] is not None:
+            save_part = f"{'✅' if r['saved'] else '❌'} {r['save_total']} · "
+        mod = f" ({r['modifier']})" if r['modifier'] else ""
+        down = " 💀" if r['down'] else ""
+        lines.append(f"• **{r['target']}**: {save_part}{r['damage']} dmg{mod} → {r['new_hp']} HP{down}")
+    if len(result['results']) > len(shown):
+        lines.append(f"*...and {len(result['results']) - len(shown)} more*")
+    if result['missing']:
+        lines.append(f"⚠️ Not found: {', '.join(map(str, result['missing']))}")
+    return "\n".join(lines)
+
+
+@bot.tree.command(name="castarea", description="Cast an area spell at a map square and hit everyone inside")
+@app_commands.describe(
+    spell="Area spell (e.g. Fireball, Burning Hands, Lightning Bolt)",
+    x="Target square X (center for spheres, aim point for cones and lines)",
+    y="Target square Y",
+    slot_level="Spell slot level for upcasting",
+    dc="Save DC (defaults to your spell save DC)"
+)
+async def castarea_cmd(
+    interaction: discord.Interaction,
+    spell: str,
+    x: int,
+    y: int,
+    slot_level: Optional[int] = None,
+    dc: Optional[int] = None
+):
+    """Pick targets from the spell's template on the map, then resolve it in one batch."""
+    channel_id = str(interaction.channel.id)
+    
+    try:
+        result = cast_area_spell(channel_id, spell, x, y, str(interaction.user.id),
+                                 slot_level=slot_level, dc=dc)
+    except (ValueError, ZeroDivisionError) as e:
+        await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+        return
+    if result is None:
+        await interaction.response.send_message(
+            f"❌ No active combat, or {spell} isn't a known area spell.", ephemeral=True
+        )
+        return
+    
+    msg = format_aoe_result(result)
+    if not result['results']:
+        msg += "\n*No creatures in the area.*"
+    map_obj = load_map(channel_id)
+    if map_obj:
+        area_map = f"\n```\n{map_obj.render(overlay={square: '*' for square in result['area']})}\n```"
+        if len(msg) + len(area_map) <= 2000:
+            msg += area_map
+    await interaction.response.send_message(msg)
+    log_message(channel_id, "AoE", msg)
+
+
 @bot.tree.command(name="combatinfo", description="Show current combat status")
 async def combat_info(interaction: discord.Interaction):
     """Display combat status and turn order."""
@@ -951,7 +1107,7 @@ async def next_turn_cmd(interaction: discord.Interaction):
         await interaction.response.send_message("No active combat.", ephemeral=True)
         return
     
-    current = state['turn_order'][state['current_turn']]
+    current = get_current_combatant(state)
     
     # Reset reactions for the combatant whose turn just started
     reset_reactions(channel_id, current['name'])
@@ -1001,7 +1157,7 @@ async def end_combat_cmd(interaction: discord.Interaction):
             if defeated_enemies:
                 best_enemy = max(defeated_enemies, key=lambda e: e.get('xp', 0))
                 cr = int(str(best_enemy.get('cr', '1')).replace('/', '.').split('.')[0]) if best_enemy.get('cr') else 1
-                loot_generated = generate_enemy_loot(best_enemy['name'], cr)
+                loot_generated = generate_enemy_loot(best_enemy['name'], cr, channel_id=channel_id)
     
     # End the combat
     end_combat(channel_id)
@@ -1024,6 +1180,13 @@ async def end_combat_cmd(interaction: discord.Interaction):
         lines.append("")
         lines.append(format_loot_display(loot_generated))
     
+    summary = encounter_summary(channel_id)
+    if summary and summary['damage_taken']:
+        lines.append("")
+        lines.append(f"📊 **{summary['rounds']} rounds** - damage taken: " + ", ".join(
+            f"{name} {amount}" for name, amount in sorted(summary['damage_taken'].items(), key=lambda kv: -kv[1])
+        ))
+    
     lines.append("")
     lines.append("Back to free-form exploration. Anyone can `/do` actions.")
     
@@ -1031,6 +1194,122 @@ async def end_combat_cmd(interaction: discord.Interaction):
     await play_tts(interaction, "Combat has ended. What do you do now?", "Narrator")
 
 
+@bot.tree.command(name="undo", description="[DM] Undo the last combat changes (attacks, damage, turns...)")
+@app_commands.describe(count="How many changes to undo (default 1)")
+async def undo_cmd(interaction: discord.Interaction, count: int = 1):
+    """Revert recent combat events from the encounter log."""
+    channel_id = str(interaction.channel.id)
+    undone = undo_combat(channel_id, max(1, min(count, 20)))
+    if not undone:
+        await interaction.response.send_message("Nothing to undo.", ephemeral=True)
+        return
+    
+    lines = [f"↩️ Undid {len(undone)} change{'s' if len(undone) != 1 else ''}:"]
+    for event in undone:
+        lines.append(f"`#{event['seq']}` {event['type']} (round {event.get('round', 1)})")
+    status = get_combat_status(channel_id)
+    if status:
+        lines.append(f"Current turn: **{status['current_combatant']['name']}**")
+    await interaction.response.send_message("\n".join(lines))
+
+
+@bot.tree.command(name="combatlog", description="Show recent combat events and totals for this encounter")
+@app_commands.describe(last="Number of recent events to list (default 10)")
+async def combatlog_cmd(interaction: discord.Interaction, last: int = 10):
+    """Summarise the current (or most recent) encounter from its event log."""
+    channel_id = str(interaction.channel.id)
+    summary = encounter_summary(channel_id)
+    if not summary:
+        await interaction.response.send_message("No combat has been logged in this channel.", ephemeral=True)
+        return
+    
+    lines = [f"📜 **Combat Log** - {summary['events']} events over {summary['rounds']} rounds"]
+    recent = list(iter_events(channel_id, since=max(0, summary['events'] - max(1, min(last, 25)))))
+    for event in recent[-max(1, min(last, 25)):]:
+        touched = sorted({c['k'] for c in event['changes'] if c.get('k')})
+        lines.append(f"`#{event['seq']}` R{event.get('round', 1)} **{event['type']}** {', '.join(touched)}")
+    if summary['damage_taken']:
+        lines.append("💥 Damage taken: " + ", ".join(f"{n} {a}" for n, a in summary['damage_taken'].items()))
+    if summary['healing']:
+        lines.append("💚 Healing: " + ", ".join(f"{n} {a}" for n, a in summary['healing'].items()))
+    if summary['downed']:
+        lines.append("💀 Downed: " + ", ".join(summary['downed']))
+    await interaction.response.send_message("\n".join(lines)[:2000])
+
+
+@bot.tree.command(name="simulate", description="[DM] Estimate how a fight would go before running it")
+@app_commands.describe(
+    enemies="Monsters from the database, e.g. goblin*3, orc",
+    simulations="Number of simulated fights (100-50000)"
+)
+async def simulate_cmd(interaction: discord.Interaction, enemies: str, simulations: int = 10000):
+    """Run a Monte Carlo simulation of the party against a group of monsters."""
+    channel_id = str(interaction.channel.id)
+    state = load_state(channel_id)
+    
+    players = state.get('players', []) or [str(interaction.user.id)]
+    party = list(load_characters(players).values())
+    if not party:
+        await interaction.response.send_message("No characters in the party to simulate.", ephemeral=True)
+        return
+    
+    monster_names = expand_monster_names(enemies)
+    if not monster_names:
+        await interaction.response.send_message(
+            "**Format:** `/simulate enemies:goblin*3, orc`", ephemeral=True
+        )
+        return
+    
+    simulations = max(100, min(simulations, 50000))
+    await interaction.response.defer(ephemeral=True)
+    result = await asyncio.to_thread(simulate_encounter, party, monster_names, simulations)
+    await interaction.followup.send(format_simulation(result), ephemeral=True)
+
+
+@bot.tree.command(name="dicelog", description="[DM] Show this channel's dice stream and recent rolls")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.describe(
+    verify="Re-roll a logged roll by its number to check the result",
+    new_seed="Start a new dice stream with this seed"
+)
+async def dicelog_cmd(interaction: discord.Interaction, verify: Optional[int] = None, new_seed: Optional[int] = None):
+    """Audit the channel's seeded dice stream (restricted to server managers)."""
+    channel_id = str(interaction.channel.id)
+    
+    if new_seed is not None:
+        old = get_stream(channel_id)
+        reseed(channel_id, new_seed)
+        save_state(channel_id, load_state(channel_id))
+        # The retired seed can be revealed now: it no longer predicts anything
+        await interaction.response.send_message(
+            f"🎲 Dice stream reseeded.\n"
+            f"Previous stream: seed `{old.seed}` (commitment `{old.commitment}`), {old.counter} rolls.",
+            ephemeral=True
+        )
+        return
+    
+    stream = get_stream(channel_id)
+    if verify is not None:
+        entry = next((e for e in stream.log if e.get('n') == verify), None)
+        if not entry or 'expr' not in entry:
+            await interaction.response.send_message(f"❌ Roll #{verify} isn't in the recent log.", ephemeral=True)
+            return
+        result = replay(channel_id, verify, entry['expr'])
+        match = "✅ matches" if result.total == entry.get('total') else "❌ does not match"
+        await interaction.response.send_message(
+            f"🔁 Roll #{verify} `{entry['expr']}` replays as **{result.total}** {result.detail} - {match} the log.",
+            ephemeral=True
+        )
+        return
+    
+    lines = [f"🎲 **Dice Stream** - seed commitment `{stream.commitment}`, {stream.counter} rolls"]
+    for entry in list(stream.log)[-10:]:
+        what = entry.get('expr') or entry.get('dice') or ''
+        total = f" = **{entry['total']}**" if 'total' in entry else ""
+        lines.append(f"`#{entry['n']}` {entry['label']} {what}{total}")
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+
 # =============================================================================
 # HP & REST COMMANDS
 # =============================================================================
@@ -1094,7 +1373,7 @@ async def death_save_cmd(interaction: discord.Interaction):
         return
     
     char_name = char.get('name', 'Character')
-    roll = random.randint(1, 20)
+    roll = roll_bulk(20, 1, str(interaction.channel.id), label='death save')[0]
     
     if roll == 20:
         # Nat 20 = regain 1 HP
@@ -1150,24 +1429,27 @@ async def rest_cmd(interaction: discord.Interaction, rest_type: str):
     char_name = char.get('name', 'Character')
     old_hp = char['hp']
     
-    if rest_type == "long":
-        long_rest(user_id)
-        char = load_character(user_id)
-        msg = (
-            f"🌙 **{char_name}** takes a long rest...\n"
-            f"💚 HP restored: {old_hp} → {char['hp']}/{char['max_hp']}\n"
-            f"✨ Spell slots and abilities restored!"
-        )
-    else:
-        # For short rest, use half of available hit dice
-        available = char['level'] - char.get('hit_dice_used', 0)
-        dice_to_use = min(1, available)  # Use 1 hit die by default
-        short_rest(user_id, dice_to_use)
-        char = load_character(user_id)
-        msg = (
-            f"☀️ **{char_name}** takes a short rest...\n"
-            f"💚 HP: {old_hp} → {char['hp']}/{char['max_hp']}"
-        )
+    try:
+        with character_txn(user_id) as char:
+            if rest_type == "long":
+                long_rest(user_id)
+                msg = (
+                    f"🌙 **{char_name}** takes a long rest...\n"
+                    f"💚 HP restored: {old_hp} → {char['hp']}/{char['max_hp']}\n"
+                    f"✨ Spell slots and abilities restored!"
+                )
+            else:
+                # For short rest, use half of available hit dice
+                available = char['level'] - char.get('hit_dice_used', 0)
+                dice_to_use = min(1, available)  # Use 1 hit die by default
+                short_rest(user_id, dice_to_use)
+                msg = (
+                    f"☀️ **{char_name}** takes a short rest...\n"
+                    f"💚 HP: {old_hp} → {char['hp']}/{char['max_hp']}"
+                )
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ Rest failed: {e}", ephemeral=True)
+        return
     
     await interaction.response.send_message(msg)
 
@@ -1287,7 +1569,12 @@ async def cast_cmd(
     
     char_name = char.get('name', 'Character')
     
-    success, message, spell_data = cast_spell(user_id, spell, slot_level)
+    try:
+        with character_txn(user_id):
+            success, message, spell_data = cast_spell(user_id, spell, slot_level)
+            slots = get_spell_slots_remaining(user_id) if success else None
+    except ValueError as e:
+        success, message = False, str(e)
     
     if not success:
         await interaction.response.send_message(f"❌ {message}", ephemeral=True)
@@ -1304,7 +1591,6 @@ async def cast_cmd(
             output += "\n⚡ *Concentration required*"
     
     # Show remaining slots
-    slots = get_spell_slots_remaining(user_id)
     if slots and slot_level:
         slot_key = str(slot_level)
         if slot_key in slots:
@@ -1401,7 +1687,13 @@ async def levelup_cmd(
     char_name = char.get('name', 'Character')
     old_level = char.get('level', 1)
     
-    result = level_up(user_id, roll_hp=not average_hp)
+    try:
+        with character_txn(user_id):
+            result = level_up(user_id, roll_hp=not average_hp)
+            slots = get_spell_slots_remaining(user_id) if result else None
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ Could not level up: {e}", ephemeral=True)
+        return
     
     if not result:
         await interaction.response.send_message("❌ Could not level up", ephemeral=True)
@@ -1423,8 +1715,6 @@ async def levelup_cmd(
         output += f"\n**New Features:**\n" + "\n".join(f"• {f}" for f in new_features)
     
     # Check for new spell slots
-    char = load_character(user_id)
-    slots = get_spell_slots_remaining(user_id)
     if slots:
         slot_info = []
         for level, info in sorted(slots.items(), key=lambda x: int(x[0])):
@@ -1807,8 +2097,9 @@ MAP_TEMPLATE_CHOICES = [
 ]
 
 @bot.tree.command(name="map", description="View the current tactical map")
-async def map_cmd(interaction: discord.Interaction):
-    """Display the current tactical map."""
+@app_commands.describe(viewer="Show only what a player token (or 'party') has seen")
+async def map_cmd(interaction: discord.Interaction, viewer: Optional[str] = None):
+    """Display the current tactical map, optionally through fog of war."""
     channel_id = str(interaction.channel.id)
     
     map_obj = load_map(channel_id)
@@ -1820,7 +2111,84 @@ async def map_cmd(interaction: discord.Interaction):
         )
         return
     
-    await interaction.response.send_message(map_obj.render_discord())
+    if viewer:
+        party = viewer.strip().lower() == 'party'
+        fog = fog_view(map_obj, None if party else viewer)
+        if fog is None:
+            await interaction.response.send_message(
+                f"❌ No player token named '{viewer}' on the map.", ephemeral=True
+            )
+            return
+        save_map(channel_id, map_obj)
+        who = "the party" if party else f"**{viewer}**"
+        await interaction.response.send_message(
+            f"**🗺️ {map_obj.name}** - what {who} can see\n"
+            f"```\n{map_obj.render(fog=fog)}\n```"
+        )
+        return
+    
+    text = map_obj.render_discord()
+    if len(text) > 2000 and PIL_AVAILABLE:
+        # Too wide for a code block - send the picture instead
+        png = await render_png_async(map_obj)
+        await interaction.response.send_message(
+            f"**🗺️ {map_obj.name}** ({map_obj.width}x{map_obj.height}, {map_obj.scale}ft/square)",
+            file=discord.File(io.BytesIO(png), filename="map.png")
+        )
+        return
+    await interaction.response.send_message(text[:2000])
+
+
+@bot.tree.command(name="mapimage", description="View the tactical map as an image")
+@app_commands.describe(
+    focus="Token to center on (defaults to whoever's turn it is in combat)",
+    radius="Squares to show around the focus (0 = whole map)",
+    viewer="Show only what a player token (or 'party') has seen"
+)
+async def mapimage_cmd(
+    interaction: discord.Interaction,
+    focus: Optional[str] = None,
+    radius: int = VIEWPORT_RADIUS,
+    viewer: Optional[str] = None
+):
+    """Render the map as a PNG, cropped around the active combatant."""
+    channel_id = str(interaction.channel.id)
+    
+    if not PIL_AVAILABLE:
+        await interaction.response.send_message(
+            "❌ Map images need Pillow installed. Use `/map` instead.", ephemeral=True
+        )
+        return
+    
+    map_obj = load_map(channel_id)
+    if not map_obj:
+        await interaction.response.send_message("No map active. Use `/newmap` first!", ephemeral=True)
+        return
+    
+    current = get_active_combatant(channel_id)
+    token = map_obj.get_token(focus) if focus else (map_obj.get_token(current['name']) if current else None)
+    if focus and not token:
+        await interaction.response.send_message(f"❌ Token '{focus}' not found.", ephemeral=True)
+        return
+    
+    fog = None
+    if viewer:
+        fog = fog_view(map_obj, None if viewer.strip().lower() == 'party' else viewer)
+        if fog is None:
+            await interaction.response.send_message(
+                f"❌ No player token named '{viewer}' on the map.", ephemeral=True
+            )
+            return
+    
+    viewport = viewport_around(map_obj, token, radius) if token and radius > 0 else None
+    png = await render_png_async(map_obj, viewport, fog, token.name if token else None)
+    
+    caption = f"**🗺️ {map_obj.name}**"
+    if token:
+        caption += f" - around **{token.name}** ({token.x},{token.y})"
+    await interaction.response.send_message(
+        caption, file=discord.File(io.BytesIO(png), filename="map.png")
+    )
 
 
 @bot.tree.command(name="newmap", description="Create a new tactical map")
@@ -1928,6 +2296,16 @@ async def movetoken_cmd(
         )
         return
     
+    # Walking cost around walls, creatures and difficult terrain (before the move)
+    path = token_path(map_obj, name, x, y)
+    token = map_obj.get_token(name)
+    threats = []
+    if token:
+        threats = check_opportunity_attack(
+            channel_id, token.name, (token.x, token.y), (x, y),
+            path.squares if path else None, tactical_map=map_obj
+        )
+    
     old_pos = map_obj.move_token(name, x, y)
     if old_pos is None:
         await interaction.response.send_message(
@@ -1938,15 +2316,91 @@ async def movetoken_cmd(
     
     save_map(channel_id, map_obj)
     
-    # Calculate distance moved
-    distance = max(abs(x - old_pos[0]), abs(y - old_pos[1])) * map_obj.scale
+    if path:
+        distance = f"{path.cost}ft"
+    else:
+        distance = f"{max(abs(x - old_pos[0]), abs(y - old_pos[1])) * map_obj.scale}ft, no walkable route"
+    
+    warning = ""
+    if threats:
+        lines = [f"⚔️ **{t['combatant']}** can make an opportunity attack (leaving reach at {t['at'][0]},{t['at'][1]})"
+                 for t in threats]
+        warning = "\n" + "\n".join(lines) + "\n*Use `/reaction opportunity_attack` to strike.*"
     
     await interaction.response.send_message(
-        f"🏃 **{name}** moved from ({old_pos[0]},{old_pos[1]}) to ({x},{y}) [{distance}ft]\n\n"
+        f"🏃 **{name}** moved from ({old_pos[0]},{old_pos[1]}) to ({x},{y}) [{distance}]{warning}\n\n"
         f"{map_obj.render_discord()}"
     )
 
 
+@bot.tree.command(name="path", description="Show the walking route for a token to a square")
+@app_commands.describe(
+    name="Token to move",
+    x="Destination X",
+    y="Destination Y"
+)
+async def path_cmd(interaction: discord.Interaction, name: str, x: int, y: int):
+    """Plot the cheapest route around walls, creatures and difficult terrain."""
+    channel_id = str(interaction.channel.id)
+    
+    map_obj = load_map(channel_id)
+    if not map_obj:
+        await interaction.response.send_message("No map active.", ephemeral=True)
+        return
+    
+    token = map_obj.get_token(name)
+    if not token:
+        await interaction.response.send_message(f"❌ Token '{name}' not found.", ephemeral=True)
+        return
+    
+    path = token_path(map_obj, name, x, y)
+    if not path:
+        await interaction.response.send_message(
+            f"🚫 **{token.name}** can't reach ({x},{y}) - it's blocked, occupied or out of bounds."
+        )
+        return
+    
+    overlay = {square: "•" for square in path.squares[1:]}
+    msg = f"🧭 **{token.name}** ({token.x},{token.y}) → ({x},{y}): **{path.cost} feet** ({path.steps} squares)"
+    route_map = f"\n```\n{map_obj.render(overlay=overlay)}\n```"
+    if len(msg) + len(route_map) <= 2000:
+        msg += route_map
+    else:
+        msg += "\n*Map too wide to draw the route here.*"
+    await interaction.response.send_message(msg)
+
+
+@bot.tree.command(name="reach", description="Show every square a token can move to this turn")
+@app_commands.describe(
+    name="Token to check",
+    speed="Movement available in feet (default 30)"
+)
+async def reach_cmd(interaction: discord.Interaction, name: str, speed: int = 30):
+    """Overlay the squares a token can reach with its movement."""
+    channel_id = str(interaction.channel.id)
+    
+    map_obj = load_map(channel_id)
+    if not map_obj:
+        await interaction.response.send_message("No map active.", ephemeral=True)
+        return
+    
+    token = map_obj.get_token(name)
+    if not token:
+        await interaction.response.send_message(f"❌ Token '{name}' not found.", ephemeral=True)
+        return
+    
+    squares = token_reach(map_obj, name, max(0, min(speed, 300)))
+    squares.pop((token.x, token.y), None)
+    overlay = {square: "·" for square in squares}
+    msg = f"🏃 **{token.name}** can reach **{len(squares)}** squares with {speed}ft of movement (`·`)"
+    reach_map = f"\n```\n{map_obj.render(overlay=overlay)}\n```"
+    if len(msg) + len(reach_map) <= 2000:
+        msg += reach_map
+    else:
+        msg += "\n*Map too wide to draw the reachable squares here.*"
+    await interaction.response.send_message(msg)
+
+
 @bot.tree.command(name="removetoken", description="Remove a token from the map")
 @app_commands.describe(name="Name of the token to remove")
 async def removetoken_cmd(interaction: discord.Interaction, name: str):
@@ -2007,12 +2461,14 @@ async def distance_cmd(
 @bot.tree.command(name="inrange", description="Find all tokens within range of a target")
 @app_commands.describe(
     name="Token to check from",
-    range_feet="Range in feet"
+    range_feet="Range in feet",
+    visible_only="Only list tokens it has line of sight to"
 )
 async def inrange_cmd(
     interaction: discord.Interaction,
     name: str,
-    range_feet: int = 30
+    range_feet: int = 30,
+    visible_only: bool = False
 ):
     """Find all tokens within a certain range."""
     channel_id = str(interaction.channel.id)
@@ -2030,7 +2486,7 @@ async def inrange_cmd(
         )
         return
     
-    in_range = map_obj.get_tokens_in_range(name, range_feet)
+    in_range = map_obj.get_tokens_in_range(name, range_feet, visible_only=visible_only)
     
     if not in_range:
         await interaction.response.send_message(
@@ -2050,11 +2506,44 @@ async def inrange_cmd(
     )
 
 
-@bot.tree.command(name="setterrain", description="Set terrain at a position")
+@bot.tree.command(name="cover", description="Check line of sight and cover between two tokens")
+@app_commands.describe(
+    attacker="Token making the attack",
+    target="Token being targeted"
+)
+async def cover_cmd(interaction: discord.Interaction, attacker: str, target: str):
+    """Report the cover a target has against an attacker."""
+    channel_id = str(interaction.channel.id)
+    
+    map_obj = load_map(channel_id)
+    if not map_obj:
+        await interaction.response.send_message("No map active.", ephemeral=True)
+        return
+    
+    cover = token_cover(map_obj, attacker, target)
+    if cover is None:
+        await interaction.response.send_message(
+            "❌ One or both tokens not found.",
+            ephemeral=True
+        )
+        return
+    
+    if cover == 'total':
+        msg = f"🧱 **{attacker}** has no line of sight to **{target}** (total cover)"
+    elif cover == 'none':
+        msg = f"👁️ **{attacker}** has a clear shot at **{target}** (no cover)"
+    else:
+        msg = f"🛡️ **{target}** has **{cover} cover** from **{attacker}** (+{COVER_BONUS[cover]} AC and DEX saves)"
+    await interaction.response.send_message(msg)
+
+
+@bot.tree.command(name="setterrain", description="Set terrain at a position or over a rectangle")
 @app_commands.describe(
     x="X position",
     y="Y position",
-    terrain="Terrain type"
+    terrain="Terrain type",
+    x2="Opposite corner X (fills the rectangle)",
+    y2="Opposite corner Y (fills the rectangle)"
 )
 @app_commands.choices(terrain=[
     app_commands.Choice(name=". Floor", value="floor"),
@@ -2071,9 +2560,11 @@ async def setterrain_cmd(
     interaction: discord.Interaction,
     x: int,
     y: int,
-    terrain: str
+    terrain: str,
+    x2: Optional[int] = None,
+    y2: Optional[int] = None
 ):
-    """Set the terrain at a specific position."""
+    """Set the terrain at a specific position, or fill a rectangle."""
     channel_id = str(interaction.channel.id)
     
     map_obj = load_map(channel_id)
@@ -2081,6 +2572,20 @@ async def setterrain_cmd(
         await interaction.response.send_message("No map active.", ephemeral=True)
         return
     
+    if x2 is not None or y2 is not None:
+        x2 = x if x2 is None else x2
+        y2 = y if y2 is None else y2
+        changed = map_obj.fill_terrain(x, y, x2, y2, terrain)
+        if not changed:
+            await interaction.response.send_message("❌ That area is outside the map!", ephemeral=True)
+            return
+        save_map(channel_id, map_obj)
+        terrain_name = TERRAIN_TYPES.get(terrain, {}).get("name", terrain)
+        await interaction.response.send_message(
+            f"🗺️ Set {changed} squares ({x},{y})-({x2},{y2}) to **{terrain_name}**\n\n{map_obj.render_discord()}"
+        )
+        return
+    
     if map_obj.set_terrain(x, y, terrain):
         save_map(channel_id, map_obj)
         terrain_name = TERRAIN_TYPES.get(terrain, {}).get("name", terrain)
@@ -2251,11 +2756,17 @@ async def help_cmd(interaction: discord.Interaction):
 **Combat:**
 • `/fight goblin:15:13 orc:25:14` - Start combat (name:hp:ac)
 • `/attack target:Goblin bonus:5 damage:1d8+3` - Attack!
+• `/aoe targets:enemies spell:Fireball` - Area spell with batched saves
+• `/castarea spell:Fireball x:10 y:5` - Area spell that targets everyone in its template on the map
 • `/combatinfo` - View turn order and HP
 • `/nextturn` - Advance to next combatant
 • `/reaction` - Use your reaction (Shield, Counterspell, etc.)
 • `/deathsave` - Roll death saving throw
 • `/endcombat` - End combat (auto-awards XP!)
+• `/undo` - [DM] Undo the last combat change (mistaken attack, wrong turn...)
+• `/combatlog` - Recent combat events, damage taken and healing
+• `/simulate goblin*3, orc` - [DM] Preview win odds and HP loss
+• `/dicelog` - [DM] Dice seed commitment, recent rolls and replay checks
 
 **Loot & Treasure:**
 • `/loot` - Generate random loot by CR
@@ -2264,10 +2775,14 @@ async def help_cmd(interaction: discord.Interaction):
 **Tactical Maps:**
 • `/newmap` - Create a new battle map
 • `/map` - View the current map
+• `/mapimage` - Map as an image, centered on the active turn
 • `/addtoken` - Add character/enemy to map
 • `/movetoken` - Move a token
+• `/path` - Walking route and cost to a square
+• `/reach` - Squares a token can move to
 • `/distance` - Measure distance between tokens
 • `/inrange` - Find tokens in range
+• `/cover` - Line of sight and cover between tokens
 
 **Handouts & Secrets:**
 • `/viewhandouts` - View handouts shared with you
@@ -2328,9 +2843,10 @@ async def party_dashboard(interaction: discord.Interaction):
     
     total_hp = 0
     total_max_hp = 0
+    party_chars = load_characters(players)
     
     for pid in players:
-        char = load_character(pid)
+        char = party_chars.get(str(pid))
         if not char:
             lines.append(f"<@{pid}> - *No character*")
             continue
@@ -2399,7 +2915,7 @@ async def party_dashboard(interaction: discord.Interaction):
     # Combat status
     combat = load_combat(channel_id)
     if combat and combat.get('active'):
-        current = combat['turn_order'][combat['current_turn']]
+        current = get_current_combatant(combat)
         lines.append(f"⚔️ **In Combat** - Round {combat.get('round', 1)} - {current['name']}'s turn")
     
     await interaction.response.send_message("\n".join(lines))
@@ -2511,13 +3027,14 @@ async def loot_cmd(
     loot_type: str = "enemy"
 ):
     """Generate random loot based on CR."""
+    channel_id = str(interaction.channel.id)
     if loot_type == "hoard":
-        loot = generate_treasure_hoard(cr)
+        loot = generate_treasure_hoard(cr, channel_id=channel_id)
         msg = f"💰 **Treasure Hoard (CR {cr})**\n"
         msg += format_loot_display(loot)
     elif loot_type == "magic":
         max_rarity = Rarity.UNCOMMON if cr < 5 else Rarity.RARE if cr < 11 else Rarity.VERY_RARE if cr < 17 else Rarity.LEGENDARY
-        item = roll_magic_item(max_rarity)
+        item = roll_magic_item(max_rarity, rng=get_rng(channel_id, 'loot'))
         if item:
             msg = f"✨ **Magic Item Found!**\n"
             msg += f"{item['rarity_icon']} **{item['name']}** ({item['rarity'].replace('_', ' ').title()})\n"
@@ -2525,7 +3042,7 @@ async def loot_cmd(
         else:
             msg = "No magic item generated."
     else:
-        loot = generate_enemy_loot("Defeated Enemy", cr)
+        loot = generate_enemy_loot("Defeated Enemy", cr, channel_id=channel_id)
         msg = f"🗡️ **Enemy Loot (CR {cr})**\n"
         msg += format_loot_display(loot)
     
@@ -2536,7 +3053,7 @@ async def loot_cmd(
 @app_commands.describe(cr="Challenge Rating of the encounter")
 async def treasure_cmd(interaction: discord.Interaction, cr: int = 5):
     """Generate a full treasure hoard."""
-    loot = generate_treasure_hoard(cr, include_magic=True)
+    loot = generate_treasure_hoard(cr, include_magic=True, channel_id=str(interaction.channel.id))
     
     lines = [f"💎 **Treasure Hoard** (CR {cr})"]
     lines.append("═══════════════════════")
@@ -2800,9 +3317,9 @@ async def reaction_cmd(
 
 @bot.tree.command(name="exportlog", description="Export session log")
 async def export_log(interaction: discord.Interaction):
-    """Export the session log as a file."""
+    """Export the session log as a file (zipped with its older parts once rotated)."""
     session_id = str(interaction.channel.id)
-    log_path = get_log_file(session_id)
+    log_path = await asyncio.to_thread(get_log_file, session_id)
     
     if not log_path or not os.path.exists(log_path):
         await interaction.response.send_message("No log found for this session.", ephemeral=True)
@@ -4,7 +4,16 @@ from openai import OpenAI
 from dotenv import load_dotenv
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+client = None  # built on first use; tests and session replays may swap in a stand-in
+
+
+def get_client():
+    """Return the shared OpenAI client, creating it the first time it's needed."""
+    global client
+    if client is None:
+        client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    return client
+
 
 # Pattern to detect skill check requests from the AI
 SKILL_CHECK_PATTERN = re.compile(
@@ -116,28 +125,34 @@ DEFAULT_SYSTEM_PROMPT = (
     "You: 'You find purchase and haul yourself over the top!'"
 )
 
-def get_dm_response(user_input, state, player_id=None, system_prompt=None):
+def get_dm_response(user_input, state, player_id=None, system_prompt=None, dynamic_context=None):
+    """
+    Ask the DM model for a reply to ``user_input``.
+
+    Messages are ordered most-stable first so the provider can reuse its prompt
+    cache: static system prompt, campaign memory, conversation history, then
+    the per-turn dynamic context and finally the new user input.
+    """
     from utils.state_manager import get_prompt_context_for_ai
     
-    # Get context including campaign summary + recent history
-    messages = get_prompt_context_for_ai(state)
+    # Static system prompt first, then campaign summary + recent history
+    messages = [{"role": "system", "content": system_prompt or DEFAULT_SYSTEM_PROMPT}]
+    messages.extend(get_prompt_context_for_ai(state))
     
-    # Add character and combat state context
-    char_state = state.get('characters', {})
+    # Add scene (party status comes from the cached snapshot) and combat context
+    # (volatile, so it goes last)
     combat_state = state.get('combat', {})
-    context = ''
-    if char_state:
-        context += '\nCharacters:\n' + '\n'.join([f"{c['name']} (Level {c.get('level',1)} {c.get('class','')}, HP: {c.get('hp','?')}/{c.get('max_hp','?')})" for c in char_state.values()])
+    context = dynamic_context or ''
     if combat_state:
         context += '\nCombatants:\n' + '\n'.join([f"{c['name']} (HP: {c['hp']}, AC: {c['ac']})" for c in combat_state.get('combatants',[])])
     if context:
-        messages = [{"role": "system", "content": context}] + messages
+        messages.append({"role": "system", "content": context})
     messages.append({"role": "user", "content": user_input})
     
     try:
-        response = client.chat.completions.create(
+        response = get_client().chat.completions.create(
             model="gpt-4o",
-            messages=[{"role": "system", "content": system_prompt or DEFAULT_SYSTEM_PROMPT}] + messages,
+            messages=messages,
             max_tokens=500,
             temperature=0.9
         )
@@ -215,7 +230,7 @@ Make it vivid, atmospheric, and end with something that invites player action.""
     user_input = prompt if prompt else "Create an original fantasy adventure with an intriguing mystery"
     
     try:
-        response = client.chat.completions.create(
+        response = get_client().chat.completions.create(
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -286,7 +301,7 @@ def summarize_history(state, max_entries=10):
     messages.extend(history)
 
     try:
-        response = client.chat.completions.create(
+        response = get_client().chat.completions.create(
             model="gpt-4o",
             messages=messages,
             max_tokens=150,
@@ -345,7 +360,7 @@ Return ONLY the updated summary text, no other formatting."""
     messages.append({"role": "user", "content": "Generate the updated campaign summary."})
     
     try:
-        response = client.chat.completions.create(
+        response = get_client().chat.completions.create(
             model="gpt-4o",
             messages=messages,
             max_tokens=400,
@@ -378,7 +393,7 @@ Only include explicit quests/missions, not casual conversations.
 Return empty arrays if nothing notable found."""
 
     try:
-        response = client.chat.completions.create(
+        response = get_client().chat.completions.create(
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -0,0 +1,65 @@
+"""The static system prompt must be a byte-stable prefix across turns and channels."""
+
+import os
+
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+
+from services import openai_service
+from utils import character_manager
+from utils.prompt_builder import STATIC_SYSTEM_PROMPT, build_prompt_sections
+from utils.session_recorder import StubLLM
+
+CHARACTERS = {
+    '111': {'name': 'Thorin', 'level': 3, 'class': 'Fighter', 'hp': 20, 'max_hp': 28},
+    '222': {'name': 'Elowen', 'level': 5, 'class': 'Wizard', 'hp': 17, 'max_hp': 22},
+}
+
+STATES = [
+    (9001, {
+        'campaign_title': 'The Sunken Crown',
+        'realm': 'Vaelmoor',
+        'location': 'Drowned Chapel',
+        'plot_hook': 'A bell tolls beneath the waves',
+        'difficulty': 'hard',
+        'players': ['111'],
+        'prompt_history': [{'role': 'user', 'content': 'I light a torch'}],
+    }),
+    (9002, {
+        'campaign_title': 'Ashes of Karsk',
+        'realm': 'Karsk',
+        'location': 'Smoldering Gate',
+        'plot_hook': 'The forge-king has vanished',
+        'difficulty': 'easy',
+        'players': ['222'],
+        'prompt_history': [],
+    }),
+]
+
+
+def _messages(monkeypatch, channel_id, state):
+    llm = StubLLM()
+    monkeypatch.setattr(openai_service, 'client', llm)
+    system_prompt, dynamic_context = build_prompt_sections(state, channel_id)
+    openai_service.get_dm_response('I look around', state, None, system_prompt=system_prompt,
+                                   dynamic_context=dynamic_context)
+    return llm.calls[-1]['messages']
+
+
+def test_static_prefix_is_byte_identical(monkeypatch):
+    monkeypatch.setattr(character_manager, 'load_character', CHARACTERS.get)
+    prefixes = [_messages(monkeypatch, cid, dict(state))[0]['content'] for cid, state in STATES]
+
+    assert prefixes[0].encode() == prefixes[1].encode() == STATIC_SYSTEM_PROMPT.encode()
+
+
+def test_static_prefix_has_no_per_turn_data(monkeypatch):
+    monkeypatch.setattr(character_manager, 'load_character', CHARACTERS.get)
+    for channel_id, state in STATES:
+        messages = _messages(monkeypatch, channel_id, dict(state))
+        prefix = messages[0]['content']
+        for value in ('campaign_title', 'realm', 'location', 'plot_hook'):
+            assert state[value] not in prefix
+            assert any(state[value] in m['content'] for m in messages[1:])
+        for char in CHARACTERS.values():
+            assert char['name'] not in prefix
+        assert str(channel_id) not in prefix
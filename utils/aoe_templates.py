@@ -0,0 +1,236 @@
+"""
+AoE Templates
+Area-of-effect shapes on a TacticalMap: sphere, cube, cone, line and
+emanation.
+
+A template is rasterized into a 0/1 mask over its bounding box of squares
+(a square is inside when its centre is), using NumPy broadcasting over the
+square centres when available. Affected tokens come from the map's spatial
+index: only tokens in the bounding box are checked against the mask, and by
+default squares the template's source square can't see are dropped, since
+walls stop a spell's area from spreading.
+
+Distances are in feet and converted with the map scale. Cone and line
+directions point from the origin toward a target square.
+"""
+
+import math
+from typing import Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from utils.map_manager import TacticalMap, Token
+
+SHAPES = ("sphere", "cube", "cone", "line", "emanation")
+LINE_WIDTH = 5  # feet, for lines like Lightning Bolt
+
+
+class AreaTemplate:
+    """
+    0/1 mask over the squares (x1..x2, y1..y2) an area covers. ``origin`` is
+    the point it spreads from and ``source`` the square used for its line of
+    sight.
+    """
+
+    __slots__ = ('x1', 'y1', 'x2', 'y2', 'mask', 'origin', 'source')
+
+    def __init__(self, box: Tuple[int, int, int, int], mask: bytes, origin: Tuple[float, float],
+                 source: Optional[Tuple[int, int]] = None):
+        self.x1, self.y1, self.x2, self.y2 = box
+        self.mask = mask
+        self.origin = origin
+        self.source = source or (int(origin[0]), int(origin[1]))
+
+    @property
+    def width(self) -> int:
+        return self.x2 - self.x1 + 1
+
+    def contains(self, x: int, y: int) -> bool:
+        if not (self.x1 <= x <= self.x2 and self.y1 <= y <= self.y2):
+            return False
+        return bool(self.mask[(y - self.y1) * self.width + (x - self.x1)])
+
+    def squares(self) -> List[Tuple[int, int]]:
+        w = self.width
+        return [(self.x1 + i % w, self.y1 + i // w) for i, bit in enumerate(self.mask) if bit]
+
+    def __len__(self) -> int:
+        return self.mask.count(1)
+
+
+# ============ RASTERIZATION ============
+
+def _rasterize(box, inside) -> bytes:
+    """
+    Evaluate ``inside(px, py)`` at every square centre in the box, where px/py
+    are NumPy arrays (broadcast row/column) or plain floats without NumPy;
+    shape tests use ``&``/``|`` so they work on either.
+    """
+    x1, y1, x2, y2 = box
+    if x1 > x2 or y1 > y2:
+        return b""
+    if NUMPY_AVAILABLE:
+        px = np.arange(x1, x2 + 1, dtype=float)[None, :] + 0.5
+        py = np.arange(y1, y2 + 1, dtype=float)[:, None] + 0.5
+        hit = np.broadcast_to(inside(px, py), (y2 - y1 + 1, x2 - x1 + 1))
+        return hit.astype(np.uint8).tobytes()
+    return bytes(
+        1 if inside(x + 0.5, y + 0.5) else 0
+        for y in range(y1, y2 + 1) for x in range(x1, x2 + 1)
+    )
+
+
+def _clip(tactical_map: TacticalMap, x1: float, y1: float, x2: float, y2: float):
+    return (max(0, math.floor(x1)), max(0, math.floor(y1)),
+            min(tactical_map.width - 1, math.ceil(x2)), min(tactical_map.height - 1, math.ceil(y2)))
+
+
+def sphere(tactical_map: TacticalMap, origin: Tuple[float, float], radius_feet: int) -> AreaTemplate:
+    """Squares whose centre is within the radius of the origin point."""
+    ox, oy = origin
+    r = radius_feet / tactical_map.scale
+    box = _clip(tactical_map, ox - r, oy - r, ox + r, oy + r)
+    r2 = r * r + 1e-9
+    mask = _rasterize(box, lambda px, py: (px - ox) ** 2 + (py - oy) ** 2 <= r2)
+    return AreaTemplate(box, mask, origin)
+
+
+def cube(tactical_map: TacticalMap, origin: Tuple[float, float], side_feet: int,
+         toward: Optional[Tuple[float, float]] = None) -> AreaTemplate:
+    """
+    A square area centred on the origin, or with the origin in the middle of
+    one face and the cube extending toward ``toward`` (along its main axis).
+    """
+    ox, oy = origin
+    s = side_feet / tactical_map.scale
+    lo_x, hi_x = ox - s / 2, ox + s / 2
+    lo_y, hi_y = oy - s / 2, oy + s / 2
+    if toward is not None:
+        dx, dy = toward[0] - ox, toward[1] - oy
+        if abs(dx) >= abs(dy):
+            lo_x, hi_x = (ox, ox + s) if dx >= 0 else (ox - s, ox)
+        else:
+            lo_y, hi_y = (oy, oy + s) if dy >= 0 else (oy - s, oy)
+    box = _clip(tactical_map, lo_x, lo_y, hi_x - 1, hi_y - 1)
+    # Half-open so a centre exactly on an edge counts once
+    mask = _rasterize(box, lambda px, py: (px >= lo_x) & (px < hi_x) & (py >= lo_y) & (py < hi_y))
+    return AreaTemplate(box, mask, origin)
+
+
+def _directional(tactical_map: TacticalMap, origin, toward, length_feet: int, half_width, source=None):
+    """Shared body for cones and lines: ``half_width(along)`` gives the allowed sideways offset."""
+    ox, oy = origin
+    dx, dy = toward[0] - ox, toward[1] - oy
+    norm = math.hypot(dx, dy) or 1.0
+    ux, uy = dx / norm, dy / norm
+    length = length_feet / tactical_map.scale
+    reach = length + half_width(length)
+    box = _clip(tactical_map, ox - reach, oy - reach, ox + reach, oy + reach)
+
+    def inside(px, py):
+        rx, ry = px - ox, py - oy
+        along = rx * ux + ry * uy
+        across = abs(rx * uy - ry * ux)
+        return (along > 0) & (along <= length + 1e-9) & (across <= half_width(along) + 1e-9)
+
+    return AreaTemplate(box, _rasterize(box, inside), origin, source)
+
+
+def cone(tactical_map: TacticalMap, origin: Tuple[float, float], length_feet: int,
+         toward: Tuple[float, float], source: Optional[Tuple[int, int]] = None) -> AreaTemplate:
+    """A cone whose width at any point equals its distance from the origin."""
+    return _directional(tactical_map, origin, toward, length_feet, lambda along: along / 2, source)
+
+
+def line(tactical_map: TacticalMap, origin: Tuple[float, float], length_feet: int,
+         toward: Tuple[float, float], width_feet: int = LINE_WIDTH,
+         source: Optional[Tuple[int, int]] = None) -> AreaTemplate:
+    """A straight line ``width_feet`` wide running from the origin toward ``toward``."""
+    half = width_feet / tactical_map.scale / 2
+    return _directional(tactical_map, origin, toward, length_feet, lambda along: half, source)
+
+
+def emanation(tactical_map: TacticalMap, token: Token, distance_feet: int) -> AreaTemplate:
+    """Every square within ``distance_feet`` of a creature's space (not the space itself)."""
+    r = distance_feet // tactical_map.scale
+    size = max(1, token.size)
+    x1, y1 = token.x, token.y
+    x2, y2 = x1 + size - 1, y1 + size - 1
+    box = _clip(tactical_map, x1 - r, y1 - r, x2 + r, y2 + r)
+
+    def inside(px, py):
+        # Everything in the box except the creature's own space
+        return (px < x1) | (px > x2 + 1) | (py < y1) | (py > y2 + 1)
+
+    return AreaTemplate(box, _rasterize(box, inside), (x1 + size / 2, y1 + size / 2), (x1, y1))
+
+
+# ============ PLACING TEMPLATES ============
+
+def _edge_point(token: Token, toward: Tuple[float, float]) -> Tuple[float, float]:
+    """Where a ray from the token's centre toward a point leaves its space."""
+    size = max(1, token.size)
+    cx, cy = token.x + size / 2, token.y + size / 2
+    dx, dy = toward[0] - cx, toward[1] - cy
+    scale = max(abs(dx), abs(dy))
+    if not scale:
+        return cx, cy
+    return cx + dx / scale * size / 2, cy + dy / scale * size / 2
+
+
+def spell_template(tactical_map: TacticalMap, shape: str, size_feet: int,
+                   caster: Optional[Token], target: Tuple[int, int]) -> Optional[AreaTemplate]:
+    """
+    Place a template the way a spell of this shape is aimed.
+
+    Spheres are centred on the target square. Cubes, cones and lines start
+    at the edge of the caster's space and point at the target square (a cube
+    with no caster is centred on it). Emanations surround the caster.
+    """
+    centre = (target[0] + 0.5, target[1] + 0.5)
+    if shape == "sphere":
+        return sphere(tactical_map, centre, size_feet)
+    if shape == "cube":
+        if caster is None:
+            return cube(tactical_map, centre, size_feet)
+        template = cube(tactical_map, _edge_point(caster, centre), size_feet, centre)
+        template.source = (caster.x, caster.y)
+        return template
+    if shape in ("cone", "line"):
+        if caster is None:
+            return None
+        origin = _edge_point(caster, centre)
+        build = cone if shape == "cone" else line
+        return build(tactical_map, origin, size_feet, centre, source=(caster.x, caster.y))
+    if shape == "emanation":
+        return emanation(tactical_map, caster, size_feet) if caster else None
+    return None
+
+
+def tokens_in_template(tactical_map: TacticalMap, template: AreaTemplate,
+                       exclude: Iterable[str] = (), through_walls: bool = False) -> List[Token]:
+    """
+    Tokens with any square of their space inside the template. Unless
+    ``through_walls``, squares the template's origin can't see are ignored.
+    """
+    visible = None
+    if not through_walls:
+        from utils.visibility import visible_from
+        visible = visible_from(tactical_map, *template.source)
+    skip = {name.lower() for name in exclude}
+    w = tactical_map.width
+    hits = []
+    for token in tactical_map.get_tokens_in_rect(template.x1, template.y1, template.x2, template.y2):
+        if token.name.lower() in skip:
+            continue
+        size = max(1, token.size)
+        for y in range(token.y, token.y + size):
+            if any(template.contains(x, y) and (visible is None or visible[y * w + x])
+                   for x in range(token.x, token.x + size)):
+                hits.append(token)
+                break
+    return hits
@@ -0,0 +1,67 @@
+"""
+Background Writer
+A queue that a daemon thread writes out in batches.
+
+``put`` only appends to an in-memory queue. The writer thread hands
+everything queued to a ``write_batch`` callback every ``flush_interval``
+seconds, or as soon as ``flush_count`` items are waiting. ``flush`` does the
+same in the caller's thread. Batches are written one at a time and in queue
+order. Used by utils.logger and utils.session_recorder.
+"""
+
+import threading
+from collections import deque
+from typing import Callable, List
+
+
+class BackgroundWriter:
+    """Batched, ordered writes off the caller's thread."""
+
+    def __init__(self, write_batch: Callable[[List], None], name: str,
+                 flush_interval: float = 1.0, flush_count: int = 50):
+        """
+        Args:
+            write_batch: Called with the list of queued items, oldest first
+            name: Name for the writer thread
+            flush_interval: Seconds between background writes
+            flush_count: Queued items that trigger an early write
+        """
+        self.write_batch = write_batch
+        self.name = name
+        self.flush_interval = flush_interval
+        self.flush_count = flush_count
+        self._queue = deque()
+        self._wakeup = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+
+    def put(self, item):
+        """Queue an item; the writer thread picks it up shortly."""
+        self._queue.append(item)
+        self._ensure_thread()
+        if len(self._queue) >= self.flush_count:
+            with self._wakeup:
+                self._wakeup.notify()
+
+    def flush(self):
+        """Write everything queued so far (in the caller's thread)."""
+        with self._write_lock:
+            items = []
+            while self._queue:
+                items.append(self._queue.popleft())
+            if items:
+                self.write_batch(items)
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                self._wakeup.wait_for(lambda: len(self._queue) >= self.flush_count,
+                                      timeout=self.flush_interval)
+            self.flush()
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._wakeup:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
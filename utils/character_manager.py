@@ -1,6 +1,5 @@
 import os
-import json
-from threading import Lock
+import copy
 
 # Import D&D 5e data
 try:
@@ -15,9 +14,11 @@ try:
 except ImportError:
     DND_DATA_AVAILABLE = False
 
+from .character_model import Character
+from .character_repository import CharacterRepository
+
 CHAR_DIR = os.path.join(os.path.dirname(__file__), '..', 'characters')
 os.makedirs(CHAR_DIR, exist_ok=True)
-_char_locks = {}
 
 # D&D 5e skill list with associated ability
 SKILLS = {
@@ -88,9 +89,6 @@ DEFAULT_STATS = {
     'subclass': '',  # e.g., "Champion" Fighter
 }
 
-def _get_char_path(user_id):
-    return os.path.join(CHAR_DIR, f'{user_id}.json')
-
 def get_proficiency_bonus(level):
     """Calculate proficiency bonus based on level"""
     if level < 5:
@@ -115,6 +113,8 @@ def calculate_skill_bonus(char_data, skill):
         return 0
     
     ability = SKILLS[skill]
+    if isinstance(char_data, Character):
+        return char_data.skill_bonus(skill, ability)
     base_mod = get_ability_modifier(char_data.get(ability, 10))
     
     if char_data.get('skills', {}).get(skill, False):
@@ -127,27 +127,78 @@ def calculate_skill_bonus(char_data, skill):
     else:
         return base_mod
 
+_repository = CharacterRepository(CHAR_DIR, DEFAULT_STATS, factory=Character.from_dict)
+
+def get_repository():
+    """Return the process-wide character repository."""
+    return _repository
+
 def load_character(user_id):
-    path = _get_char_path(user_id)
-    if not os.path.exists(path):
-        return None
-    with open(path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        # Ensure all default fields exist
-        for key, value in DEFAULT_STATS.items():
-            if key not in data:
-                data[key] = value
-        return data
+    """
+    Load a character.
+
+    The returned dict is the repository's shared copy: every later
+    load_character in this process returns the same object. Only mutate it
+    on the way to save_character (or inside character_batch/character_txn).
+    A change made before bailing out without saving stays visible to every
+    reader until the file changes on disk. Work on copy.deepcopy(data) for
+    scratch edits, or drop them with get_repository().invalidate(user_id).
+    """
+    return _repository.get(user_id)
+
+def load_characters(user_ids):
+    """Load several characters at once. Returns {user_id: data} for those that exist."""
+    return _repository.load_many(user_ids)
 
 def save_character(user_id, data):
-    path = _get_char_path(user_id)
-    lock = _char_locks.setdefault(user_id, Lock())
-    with lock:
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+    _repository.save(user_id, data)
+
+def character_batch():
+    """Context manager that coalesces all character writes inside it into one flush."""
+    return _repository.batch()
+
+def validate_character(data):
+    """Raise ValueError if a character dict is in an impossible state."""
+    level = data.get('level', 1)
+    if not isinstance(level, int) or not 1 <= level <= 20:
+        raise ValueError(f"Invalid level: {level}")
+    if data.get('max_hp', 1) < 1:
+        raise ValueError(f"Invalid max HP: {data.get('max_hp')}")
+    if data.get('hp', 0) < 0 or data.get('temp_hp', 0) < 0:
+        raise ValueError("HP cannot be negative")
+    for ability in ('STR', 'DEX', 'CON', 'INT', 'WIS', 'CHA'):
+        score = data.get(ability, 10)
+        if not isinstance(score, int) or not 1 <= score <= 30:
+            raise ValueError(f"Invalid {ability} score: {score}")
+    for key in ('spell_slots', 'spell_slots_used'):
+        for level_str, count in data.get(key, {}).items():
+            if not isinstance(count, int) or count < 0:
+                raise ValueError(f"Invalid {key} for level {level_str}: {count}")
+
+def character_txn(user_id):
+    """
+    Apply several character updates atomically.
+
+        with character_txn(user_id) as char:
+            level_up(user_id)
+            set_spell_slots(user_id, ...)
+
+    Helpers called inside the block share one loaded copy and the character is
+    validated and written once on exit. Any exception rolls every change back.
+    Raises KeyError if the character does not exist.
+    """
+    return _repository.transaction(user_id, validate=validate_character)
+
+def get_character_version(user_id):
+    """
+    Return a cheap token that changes whenever the character file changes.
+    Combines the in-process write counter with the file mtime so edits made by
+    another process (e.g. the web portal) are also noticed. No file read.
+    """
+    return _repository.version(user_id)
 
 def register_character(user_id, name, class_name='Fighter', race='Human', subrace=None):
-    data = dict(DEFAULT_STATS)
+    data = copy.deepcopy(DEFAULT_STATS)
     data['name'] = name
     data['class'] = class_name
     data['race'] = race
@@ -1172,20 +1223,63 @@ def unequip_shield(user_id):
     return data, f"Unequipped shield (AC: {data['ac']})"
 
 
-def _recalculate_ac(data):
-    """Internal function to recalculate AC based on equipped armor."""
+def _compute_ac(data):
     dex_mod = get_ability_modifier(data.get('DEX', 10))
     armor_name = data.get('equipment', {}).get('armor')
     has_shield = data.get('equipment', {}).get('shield') is not None
     
     if EQUIPMENT_DATA_AVAILABLE:
-        data['ac'] = dnd_calculate_ac(armor_name, dex_mod, has_shield)
-    else:
-        # Fallback calculation
-        base_ac = 10 + dex_mod
-        if has_shield:
-            base_ac += 2
-        data['ac'] = base_ac
+        return dnd_calculate_ac(armor_name, dex_mod, has_shield)
+    # Fallback calculation
+    base_ac = 10 + dex_mod
+    if has_shield:
+        base_ac += 2
+    return base_ac
+
+
+def _recalculate_ac(data):
+    """Internal function to recalculate AC based on equipped armor."""
+    data['ac'] = _compute_ac(data)
+
+
+def get_spell_save_dc(char_data):
+    """Spell save DC: 8 + proficiency + spellcasting ability modifier. None for non-casters."""
+    def compute(data):
+        if not DND_DATA_AVAILABLE:
+            return None
+        class_data = get_class_data(data.get('class', ''))
+        casting = class_data.get('spellcasting') if class_data else None
+        if not casting:
+            return None
+        ability = casting.get('ability', 'INT')
+        return 8 + data.get('proficiency', 2) + get_ability_modifier(data.get(ability, 10))
+    
+    if isinstance(char_data, Character):
+        return char_data.derived('spell_save_dc', compute)
+    return compute(char_data)
+
+
+def get_saving_throw_bonus(char_data, ability):
+    """Saving throw bonus for an ability, adding proficiency for the class's save proficiencies."""
+    ability = ability.upper()
+    
+    def compute(data):
+        bonus = get_ability_modifier(data.get(ability, 10))
+        if DND_DATA_AVAILABLE:
+            class_data = get_class_data(data.get('class', '')) or {}
+            if ability in class_data.get('saving_throws', []):
+                bonus += data.get('proficiency', 2)
+        return bonus
+    
+    if isinstance(char_data, Character):
+        return char_data.derived(('save', ability), compute)
+    return compute(char_data)
+
+
+def get_spell_attack_bonus(char_data):
+    """Spell attack bonus (save DC - 8). None for non-casters."""
+    dc = get_spell_save_dc(char_data)
+    return dc - 8 if dc is not None else None
 
 
 def get_weapon_damage(user_id):
@@ -1404,6 +1498,10 @@ def get_attack_roll_modifiers(user_id):
     if not data:
         return None
     
+    return _compute_attack_modifiers(data)
+
+
+def _compute_attack_modifiers(data):
     conditions = data.get('conditions', [])
     
     if EQUIPMENT_DATA_AVAILABLE:
@@ -0,0 +1,147 @@
+"""
+Character Model
+Compact slotted character record that behaves like the plain dicts the rest of
+the code base already uses.
+
+Known fields live in ``__slots__``; anything else (homebrew keys, portal-only
+fields) is kept in an extras dict so ``Character.from_dict(d).to_dict() == d``.
+
+Derived stats that depend only on scalar fields (ability modifiers, saving
+throws, spell save DC) are memoised per instance and dropped whenever one of
+those fields is assigned. Stats that read mutable containers (skills,
+expertise, equipment, conditions) are always computed fresh, since a caller
+holding a reference to the container can edit it without the model noticing.
+"""
+
+from collections.abc import MutableMapping
+
+# Every key in character_manager.DEFAULT_STATS plus 'name'
+FIELDS = (
+    'name',
+    'STR', 'DEX', 'CON', 'INT', 'WIS', 'CHA',
+    'proficiency', 'skills', 'expertise',
+    'hp', 'max_hp', 'temp_hp', 'hit_dice', 'hit_dice_used',
+    'class', 'race', 'background', 'alignment', 'speed', 'ac', 'initiative_bonus',
+    'spell_slots', 'spell_slots_used', 'spells_known',
+    'xp', 'level', 'inventory', 'equipment', 'conditions', 'death_saves',
+    'inspiration', 'features', 'cantrips_known', 'prepared_spells',
+    'subrace', 'subclass',
+)
+_SLOT = {key: f'_{key}' for key in FIELDS}
+
+# Scalar fields that feed memoised stats; assigning them clears the cache.
+# Only stats computed from these fields may go through derived().
+DERIVED_INPUTS = frozenset((
+    'STR', 'DEX', 'CON', 'INT', 'WIS', 'CHA', 'proficiency', 'class', 'level',
+))
+
+_MISSING = object()
+
+
+class Character(MutableMapping):
+    """A character sheet with dict-style access and cached derived stats."""
+
+    __slots__ = tuple(_SLOT.values()) + ('_extras', '_derived')
+
+    def __init__(self, data=None):
+        self._extras = {}
+        self._derived = {}
+        if data:
+            for key, value in data.items():
+                self[key] = value
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data)
+
+    def to_dict(self):
+        """Return a plain dict suitable for json.dump."""
+        return {key: self._raw(key) for key in self}
+
+    def copy(self):
+        return Character(self.to_dict())
+
+    # Mapping protocol
+
+    def _raw(self, key):
+        """Return a value without triggering cache invalidation."""
+        slot = _SLOT.get(key)
+        if slot is None:
+            return self._extras[key]
+        value = getattr(self, slot, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __getitem__(self, key):
+        return self._raw(key)
+
+    def __setitem__(self, key, value):
+        slot = _SLOT.get(key)
+        if slot is None:
+            self._extras[key] = value
+        else:
+            setattr(self, slot, value)
+        if key in DERIVED_INPUTS:
+            self._derived = {}
+
+    def __delitem__(self, key):
+        slot = _SLOT.get(key)
+        if slot is None:
+            del self._extras[key]
+        else:
+            if getattr(self, slot, _MISSING) is _MISSING:
+                raise KeyError(key)
+            delattr(self, slot)
+        if key in DERIVED_INPUTS:
+            self._derived = {}
+
+    def __contains__(self, key):
+        slot = _SLOT.get(key)
+        if slot is None:
+            return key in self._extras
+        return getattr(self, slot, _MISSING) is not _MISSING
+
+    def __iter__(self):
+        for key in FIELDS:
+            if getattr(self, _SLOT[key], _MISSING) is not _MISSING:
+                yield key
+        yield from self._extras
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"Character({self.to_dict()!r})"
+
+    # Derived stats
+
+    def derived(self, key, compute):
+        """
+        Return ``compute(self)`` memoised under ``key`` until a field in
+        DERIVED_INPUTS is assigned. ``compute`` must not read other fields.
+        """
+        try:
+            return self._derived[key]
+        except KeyError:
+            value = self._derived[key] = compute(self)
+            return value
+
+    def _get(self, key, default=None):
+        try:
+            return self._raw(key)
+        except KeyError:
+            return default
+
+    def ability_modifier(self, ability):
+        return self.derived(('mod', ability), lambda c: (c._get(ability, 10) - 10) // 2)
+
+    def skill_bonus(self, skill, ability):
+        """Skill bonus including proficiency and expertise (not memoised: reads skills/expertise)."""
+        base_mod = self.ability_modifier(ability)
+        if self._get('skills', {}).get(skill, False):
+            prof_bonus = self._get('proficiency', 2)
+            if skill in self._get('expertise', []):
+                prof_bonus *= 2
+            return base_mod + prof_bonus
+        return base_mod
@@ -0,0 +1,249 @@
+"""
+Character Repository
+In-memory identity map in front of the per-character JSON files.
+
+Each character file is parsed at most once per process and the same dict is
+handed back on later loads. Entries are revalidated with a cheap ``stat`` so
+edits made by another process (the web portal) are still picked up.
+
+Because the dict is shared, every caller in the process sees in-place edits
+as soon as they are made. Code that changes a loaded character must either
+save it or drop the edit with ``invalidate``.
+
+Writes go through ``save``. Inside a ``batch()`` block they are only marked
+dirty and flushed once when the outermost block exits, so a burst of mutations
+to one character costs a single write. Batches are tracked per thread: each
+thread's outermost block flushes only the characters saved inside it, and a
+character inside another thread's open ``transaction()`` is never written
+until that transaction finishes. ``transaction()`` builds on that to give
+all-or-nothing updates for a single character.
+"""
+
+import os
+import json
+import copy
+from contextlib import contextmanager
+from threading import Lock, RLock, get_ident, local
+
+
+class CharacterRepository:
+    """Identity-mapped cache of character dicts keyed by user ID."""
+
+    def __init__(self, char_dir, defaults=None, factory=None):
+        self.char_dir = char_dir
+        self.defaults = defaults or {}
+        self.factory = factory  # optional callable wrapping loaded dicts (e.g. Character.from_dict)
+        self._cache = {}      # user_id -> character dict
+        self._mtimes = {}     # user_id -> st_mtime_ns of the file we last read/wrote
+        self._versions = {}   # user_id -> in-process write counter
+        self._dirty = set()
+        self._locks = {}
+        self._lock = RLock()
+        self._local = local()   # per-thread batch depth and pending IDs
+        self._txn_owner = {}    # user_id -> thread ident of its open transaction
+
+    @property
+    def _batch_depth(self):
+        return getattr(self._local, 'depth', 0)
+
+    @_batch_depth.setter
+    def _batch_depth(self, value):
+        self._local.depth = value
+
+    @property
+    def _pending(self):
+        """Characters saved inside this thread's open batch."""
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = set()
+        return pending
+
+    def _path(self, user_id):
+        return os.path.join(self.char_dir, f'{user_id}.json')
+
+    def _file_mtime(self, user_id):
+        try:
+            return os.stat(self._path(user_id)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read(self, user_id):
+        path = self._path(user_id)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        # Ensure all default fields exist (copied so characters never share lists)
+        for key, value in self.defaults.items():
+            if key not in data:
+                data[key] = copy.deepcopy(value)
+        return self._wrap(data)
+
+    def _wrap(self, data):
+        if self.factory is None or not type(data) is dict:
+            return data
+        return self.factory(data)
+
+    def _write(self, user_id, data):
+        path = self._path(user_id)
+        lock = self._locks.setdefault(user_id, Lock())
+        with lock:
+            with open(path, 'w', encoding='utf-8') as f:
+                payload = data.to_dict() if hasattr(data, 'to_dict') else data
+                json.dump(payload, f, indent=2, ensure_ascii=False)
+        self._mtimes[user_id] = self._file_mtime(user_id)
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def get(self, user_id):
+        """Return the character dict for ``user_id`` or None if it doesn't exist."""
+        user_id = str(user_id)
+        with self._lock:
+            if user_id in self._dirty:
+                return self._cache[user_id]
+            mtime = self._file_mtime(user_id)
+            if mtime is None:
+                self._cache.pop(user_id, None)
+                self._mtimes.pop(user_id, None)
+                return None
+            if user_id in self._cache and self._mtimes.get(user_id) == mtime:
+                return self._cache[user_id]
+            data = self._read(user_id)
+            if data is None:
+                return None
+            self._cache[user_id] = data
+            self._mtimes[user_id] = mtime
+            return data
+
+    def load_many(self, user_ids):
+        """Return ``{user_id: data}`` for every existing character in ``user_ids``."""
+        result = {}
+        with self._lock:
+            for uid in user_ids:
+                data = self.get(uid)
+                if data is not None:
+                    result[str(uid)] = data
+        return result
+
+    def save(self, user_id, data):
+        """Store ``data`` for ``user_id``; written now, or at the end of the current batch."""
+        user_id = str(user_id)
+        with self._lock:
+            self._cache[user_id] = self._wrap(data)
+            self._dirty.add(user_id)
+            if self._batch_depth == 0:
+                self.flush([user_id])
+            else:
+                self._pending.add(user_id)
+
+    def mark_dirty(self, user_id):
+        """Flag a cached character as modified in place."""
+        user_id = str(user_id)
+        with self._lock:
+            if user_id in self._cache:
+                self._dirty.add(user_id)
+                if self._batch_depth:
+                    self._pending.add(user_id)
+
+    def flush(self, user_ids=None):
+        """
+        Write dirty characters to disk (all of them when ``user_ids`` is None).
+        Characters inside another thread's open transaction are left dirty;
+        that transaction writes them when it finishes.
+        """
+        me = get_ident()
+        with self._lock:
+            targets = list(self._dirty) if user_ids is None else [str(u) for u in user_ids]
+            for uid in targets:
+                if self._txn_owner.get(uid, me) != me:
+                    continue
+                if uid in self._dirty:
+                    self._write(uid, self._cache[uid])
+                    self._dirty.discard(uid)
+
+    @contextmanager
+    def batch(self):
+        """Defer writes until the outermost batch exits, then flush once."""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._end_batch()
+
+    def _end_batch(self, skip=()):
+        """Leave one batch level; the outermost flushes what this thread saved."""
+        with self._lock:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                pending = self._pending - set(skip)
+                self._pending.clear()
+                self.flush(pending)
+
+    @contextmanager
+    def transaction(self, user_id, validate=None):
+        """
+        Yield the cached character for a group of mutations applied as one unit.
+
+        Existing helpers that load/save the same character inside the block see
+        the same dict and only mark it dirty. On normal exit ``validate(data)``
+        runs and the character is written once. If the block or the validator
+        raises, the dict is restored in place and nothing is written.
+        """
+        user_id = str(user_id)
+        data = self.get(user_id)
+        if data is None:
+            raise KeyError(f"No character found for {user_id}")
+
+        with self._lock:
+            snapshot = copy.deepcopy(data)
+            was_dirty = user_id in self._dirty
+            outer_owner = self._txn_owner.get(user_id)
+            self._txn_owner[user_id] = get_ident()
+            self._batch_depth += 1
+        try:
+            yield data
+            if validate:
+                validate(data)
+        except BaseException:
+            with self._lock:
+                data.clear()
+                data.update(snapshot)
+                self._cache[user_id] = data
+                if not was_dirty:
+                    self._dirty.discard(user_id)
+                self._release_txn(user_id, outer_owner)
+                # Nothing of the rolled-back character is written; other
+                # characters saved in the block were independent saves
+                self._end_batch(skip=(user_id,))
+            raise
+        with self._lock:
+            # Written even if the block edited the dict without calling save
+            self._dirty.add(user_id)
+            self._pending.add(user_id)
+            self._release_txn(user_id, outer_owner)
+            self._end_batch()
+
+    def _release_txn(self, user_id, outer_owner):
+        if outer_owner is None:
+            self._txn_owner.pop(user_id, None)
+        else:
+            self._txn_owner[user_id] = outer_owner
+
+    def invalidate(self, user_id=None):
+        """Forget cached data for one character, or for all when ``user_id`` is None."""
+        with self._lock:
+            if user_id is None:
+                self._cache.clear()
+                self._mtimes.clear()
+                self._dirty.clear()
+            else:
+                uid = str(user_id)
+                self._cache.pop(uid, None)
+                self._mtimes.pop(uid, None)
+                self._dirty.discard(uid)
+
+    def version(self, user_id):
+        """Return a token that changes whenever the character is written."""
+        user_id = str(user_id)
+        return (self._versions.get(user_id, 0), self._file_mtime(user_id))
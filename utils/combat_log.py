@@ -0,0 +1,419 @@
+"""
+Combat Log
+Append-only event history for combat encounters, with undo and replay.
+
+Every time an encounter is saved, the fields that changed since the last save
+are appended to ``combat/log/<channel>/<encounter>.jsonl`` as one event, with
+the value before and after each change. The event type (attack, damage, heal,
+status, turn, reaction, ...) comes from the ``combat_event`` decorator on the
+combat function that made the change. Finding the changes compares every
+combatant's fields with the previous save, so that part grows with the size
+of the fight. Only the values that changed are copied and written, so the
+log itself stays small.
+
+A full snapshot is written when the encounter starts, every
+SNAPSHOT_INTERVAL events and when it ends, so replay starts from the nearest
+snapshot and applies the tail. The last UNDO_DEPTH events stay in memory and
+undoing one just writes its "before" values back (logged as an ``undo``
+event, so the file itself is never rewritten). The log outlives the
+encounter, so fights can be summarised after ``/endcombat``.
+"""
+
+import copy
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, Iterator, List, Optional
+
+LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'combat', 'log')
+UNDO_DEPTH = 20          # events that can be undone
+SNAPSHOT_INTERVAL = 50   # events between full snapshots
+
+_logs = {}  # channel_id -> EncounterLog
+_logs_lock = threading.RLock()
+# Held while a labelled combat function runs, so other threads (the
+# write-behind flush) never read an encounter halfway through a change
+state_lock = threading.RLock()
+_context = threading.local()
+
+_SCALARS = (str, int, float, bool, type(None))
+
+
+def _copy(value):
+    return value if isinstance(value, _SCALARS) else copy.deepcopy(value)
+
+
+def _cid(combatant):
+    return combatant.get('cid', combatant.get('name'))
+
+
+def new_encounter_id() -> str:
+    return time.strftime('%Y%m%d-%H%M%S') + f"-{time.time_ns() % 1000000:06d}"
+
+
+# =============================================================================
+# EVENT LABELS
+# =============================================================================
+
+def combat_event(kind: str):
+    """
+    Label the changes saved while the decorated function runs as ``kind``
+    events. Only the outermost labelled call counts, so an attack that
+    applies damage is logged as one ``attack``. The call holds ``state_lock``.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(channel_id, *args, **kwargs):
+            with state_lock:
+                if getattr(_context, 'kind', None):
+                    return func(channel_id, *args, **kwargs)
+                _context.kind = kind
+                _context.details = {
+                    'call': func.__name__,
+                    'args': [a for a in args if isinstance(a, _SCALARS)],
+                }
+                try:
+                    return func(channel_id, *args, **kwargs)
+                finally:
+                    _context.kind = None
+                    _context.details = None
+        return wrapper
+    return decorate
+
+
+# =============================================================================
+# ENCOUNTER LOG
+# =============================================================================
+
+class EncounterLog:
+    """
+    The open log for one channel's encounter: the state as of the last event
+    (``top`` fields and ``combatants`` by combat ID), the next event number
+    and the undo stack.
+    """
+
+    __slots__ = ('channel_id', 'encounter_id', 'path', 'seq', 'since_snapshot',
+                 'undo_stack', 'top', 'combatants')
+
+    def __init__(self, channel_id: str, encounter_id: str, state: Dict):
+        self.channel_id = channel_id
+        self.encounter_id = encounter_id
+        self.path = _log_path(channel_id, encounter_id)
+        self.undo_stack = deque(maxlen=UNDO_DEPTH)
+        self.seq, self.since_snapshot = _resume_position(self.path)
+        self._baseline(state)
+        if self.seq == 0:
+            self.snapshot(state)
+
+    def _baseline(self, state: Dict):
+        self.top = {k: _copy(v) for k, v in state.items() if k != 'combatants'}
+        self.combatants = {_cid(c): copy.deepcopy(c) for c in state.get('combatants', [])}
+
+    def _append(self, entry: Dict):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def snapshot(self, state: Dict):
+        self._append({'snapshot': self.seq, 'state': dict(state)})
+        self.since_snapshot = 0
+
+    def diff(self, state: Dict) -> List[Dict]:
+        """
+        Changes since the last event, as ``{'c': cid, 'k': key, 'b': before,
+        'a': after}`` (``c`` is None for encounter-level fields; a missing
+        ``b``/``a`` means the key didn't exist; no ``k`` means the whole
+        combatant was added or removed). Updates the baseline as it goes.
+        """
+        changes = []
+        top = self.top
+        for key, value in state.items():
+            if key == 'combatants':
+                continue
+            if key not in top:
+                changes.append({'c': None, 'k': key, 'a': _copy(value)})
+                top[key] = _copy(value)
+            elif top[key] != value:
+                changes.append({'c': None, 'k': key, 'b': top[key], 'a': _copy(value)})
+                top[key] = _copy(value)
+        for key in [k for k in top if k not in state]:
+            changes.append({'c': None, 'k': key, 'b': top.pop(key)})
+
+        seen = set()
+        known = self.combatants
+        for combatant in state.get('combatants', []):
+            cid = _cid(combatant)
+            seen.add(cid)
+            old = known.get(cid)
+            if old is None:
+                known[cid] = copy.deepcopy(combatant)
+                changes.append({'c': cid, 'a': copy.deepcopy(combatant)})
+                continue
+            for key, value in combatant.items():
+                if key not in old:
+                    changes.append({'c': cid, 'k': key, 'a': _copy(value)})
+                    old[key] = _copy(value)
+                elif old[key] != value:
+                    changes.append({'c': cid, 'k': key, 'b': old[key], 'a': _copy(value)})
+                    old[key] = _copy(value)
+            for key in [k for k in old if k not in combatant]:
+                changes.append({'c': cid, 'k': key, 'b': old.pop(key)})
+        for cid in [c for c in known if c not in seen]:
+            changes.append({'c': cid, 'b': known.pop(cid)})
+        return changes
+
+    def record(self, state: Dict, kind: str, details: Optional[Dict] = None,
+               undoable: bool = True) -> Optional[Dict]:
+        """Append an event for whatever changed since the last one (None if nothing did)."""
+        changes = self.diff(state)
+        if not changes:
+            return None
+        self.seq += 1
+        event = {'seq': self.seq, 't': round(time.time(), 3), 'type': kind,
+                 'round': state.get('round', 1), 'changes': changes}
+        if details:
+            event.update(details)
+        self._append(event)
+        if undoable:
+            self.undo_stack.append(event)
+        self.since_snapshot += 1
+        if self.since_snapshot >= SNAPSHOT_INTERVAL:
+            self.snapshot(state)
+        return event
+
+
+def _log_path(channel_id: str, encounter_id: str) -> str:
+    return os.path.join(LOG_DIR, str(channel_id), f'{encounter_id}.jsonl')
+
+
+def _resume_position(path: str):
+    """(last event number, events since the last snapshot) for an existing log file."""
+    seq = since = 0
+    if not os.path.exists(path):
+        return seq, since
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('{"snapshot"'):
+                since = 0
+            elif line.startswith('{"seq"'):
+                seq = json.loads(line)['seq']
+                since += 1
+    return seq, since
+
+
+def open_log(channel_id, state: Dict) -> EncounterLog:
+    """The channel's log for this encounter, opening (or starting) it if needed."""
+    channel_id = str(channel_id)
+    with _logs_lock:
+        encounter_id = state.setdefault('encounter_id', new_encounter_id())
+        log = _logs.get(channel_id)
+        if log is None or log.encounter_id != encounter_id:
+            log = _logs[channel_id] = EncounterLog(channel_id, encounter_id, state)
+        return log
+
+
+def record_changes(channel_id, state: Dict) -> Optional[Dict]:
+    """Log the changes in a just-saved encounter, labelled by the running ``combat_event``."""
+    with _logs_lock:
+        log = open_log(channel_id, state)
+        kind = getattr(_context, 'kind', None) or 'update'
+        return log.record(state, kind, getattr(_context, 'details', None))
+
+
+def close_log(channel_id, state: Optional[Dict] = None):
+    """Log the final changes and a closing snapshot, then forget the open log."""
+    channel_id = str(channel_id)
+    with _logs_lock:
+        log = _logs.pop(channel_id, None)
+        if log is not None and state is not None:
+            log.record(state, 'end', undoable=False)
+            log.snapshot(state)
+
+
+# =============================================================================
+# UNDO & REPLAY
+# =============================================================================
+
+def apply_changes(state: Dict, changes: List[Dict], forward: bool = True):
+    """Apply an event's changes to a state (or revert them with ``forward=False``)."""
+    new = 'a' if forward else 'b'
+    combatants = state.setdefault('combatants', [])
+    by_cid = {_cid(c): c for c in combatants}
+    for change in (changes if forward else reversed(changes)):
+        cid = change['c']
+        if 'k' not in change:
+            current = by_cid.pop(cid, None)
+            if current is not None:
+                combatants.remove(current)
+            if new in change:
+                added = copy.deepcopy(change[new])
+                combatants.append(added)
+                by_cid[cid] = added
+            continue
+        target = state if cid is None else by_cid.get(cid)
+        if target is None:
+            continue
+        if new in change:
+            target[change['k']] = _copy(change[new])
+        else:
+            target.pop(change['k'], None)
+    if hasattr(state, 'reindex'):
+        state.reindex()
+
+
+def undo(channel_id, state: Dict, count: int = 1) -> List[Dict]:
+    """
+    Revert the last ``count`` events on the live state (newest first) and
+    log each reversal. Returns the events that were undone.
+    """
+    undone = []
+    with _logs_lock:
+        log = open_log(channel_id, state)
+        # Anything saved since the last event belongs to the current state
+        log.record(state, getattr(_context, 'kind', None) or 'update')
+        for _ in range(max(0, count)):
+            if not log.undo_stack:
+                break
+            event = log.undo_stack.pop()
+            apply_changes(state, event['changes'], forward=False)
+            log.record(state, 'undo', {'undoes': event['seq']}, undoable=False)
+            undone.append(event)
+    return undone
+
+
+def undo_available(channel_id) -> int:
+    with _logs_lock:
+        log = _logs.get(str(channel_id))
+        return len(log.undo_stack) if log else 0
+
+
+def list_encounters(channel_id) -> List[str]:
+    """Encounter IDs with a log for this channel, oldest first."""
+    folder = os.path.join(LOG_DIR, str(channel_id))
+    if not os.path.isdir(folder):
+        return []
+    return sorted(name[:-6] for name in os.listdir(folder) if name.endswith('.jsonl'))
+
+
+def _resolve_encounter(channel_id, encounter_id: Optional[str]) -> Optional[str]:
+    if encounter_id:
+        return encounter_id
+    log = _logs.get(str(channel_id))
+    if log is not None:
+        return log.encounter_id
+    encounters = list_encounters(channel_id)
+    return encounters[-1] if encounters else None
+
+
+def iter_events(channel_id, encounter_id: Optional[str] = None, since: int = 0) -> Iterator[Dict]:
+    """Events after number ``since`` for an encounter (the current or latest one by default)."""
+    encounter_id = _resolve_encounter(channel_id, encounter_id)
+    if not encounter_id:
+        return
+    path = _log_path(str(channel_id), encounter_id)
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('{"seq"'):
+                event = json.loads(line)
+                if event['seq'] > since:
+                    yield event
+
+
+def replay(channel_id, encounter_id: Optional[str] = None, upto: Optional[int] = None) -> Optional[Dict]:
+    """
+    Rebuild an encounter's state as of event ``upto`` (the end of the log if
+    None) from the nearest earlier snapshot plus the events after it.
+    """
+    encounter_id = _resolve_encounter(channel_id, encounter_id)
+    if not encounter_id:
+        return None
+    path = _log_path(str(channel_id), encounter_id)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+
+    # Only snapshot lines are parsed while looking for the starting point
+    start, state = 0, None
+    for i in range(len(lines) - 1, -1, -1):
+        if lines[i].startswith('{"snapshot"'):
+            snap = json.loads(lines[i])
+            if upto is None or snap['snapshot'] <= upto:
+                start, state = i + 1, snap['state']
+                break
+    if state is None:
+        return None
+    for line in lines[start:]:
+        if not line.startswith('{"seq"'):
+            continue
+        event = json.loads(line)
+        if upto is not None and event['seq'] > upto:
+            break
+        apply_changes(state, event['changes'])
+    return state
+
+
+# =============================================================================
+# SUMMARIES
+# =============================================================================
+
+def encounter_summary(channel_id, encounter_id: Optional[str] = None) -> Optional[Dict]:
+    """
+    Totals for an encounter from its log: events by type, rounds, damage
+    taken and healing received per combatant, and who went down.
+    """
+    encounter_id = _resolve_encounter(channel_id, encounter_id)
+    first = replay(channel_id, encounter_id, upto=0)
+    if first is None:
+        return None
+    names = {_cid(c): c['name'] for c in first.get('combatants', [])}
+    by_type = Counter()
+    damage = Counter()
+    healing = Counter()
+    downed = []
+    rounds = first.get('round', 1)
+    events = 0
+    for event in iter_events(channel_id, encounter_id):
+        events += 1
+        by_type[event['type']] += 1
+        rounds = max(rounds, event.get('round', 1))
+        for change in event['changes']:
+            if 'k' not in change:
+                if 'a' in change:
+                    names[change['c']] = change['a'].get('name', names.get(change['c']))
+                continue
+            if change['c'] is None or change['k'] != 'hp':
+                continue
+            if not isinstance(change.get('b'), (int, float)) or not isinstance(change.get('a'), (int, float)):
+                continue
+            name = names.get(change['c'], str(change['c']))
+            delta = change['a'] - change['b']
+            if event['type'] == 'undo':
+                # Take back what the undone event counted
+                if delta > 0:
+                    damage[name] -= delta
+                else:
+                    healing[name] += delta
+                if change['b'] <= 0 < change['a'] and name in downed:
+                    downed.remove(name)
+                continue
+            if delta < 0:
+                damage[name] -= delta
+            else:
+                healing[name] += delta
+            if change['a'] <= 0 < change['b'] and name not in downed:
+                downed.append(name)
+    return {
+        'encounter_id': encounter_id,
+        'events': events,
+        'rounds': rounds,
+        'by_type': dict(by_type),
+        'damage_taken': {k: v for k, v in damage.items() if v},
+        'healing': {k: v for k, v in healing.items() if v},
+        'downed': downed,
+    }
@@ -1,13 +1,24 @@
 import os
 import json
 import random
-from threading import Lock
-from utils.character_manager import load_character
+import atexit
+import bisect
+from itertools import count
+from threading import Lock, Timer
+from utils.character_manager import load_characters, get_saving_throw_bonus, get_spell_save_dc
 from utils.dice_roller import roll_dice
+from utils.dice_service import roll as roll_on_stream, roll_initiative_bulk, roll_saves
+from utils.map_manager import load_map
+from utils.visibility import token_cover, COVER_BONUS, COVER_NONE, COVER_TOTAL
+from utils.aoe_templates import spell_template, tokens_in_template
+from utils.combat_log import (
+    combat_event, open_log, record_changes, close_log, new_encounter_id, undo as undo_events,
+    state_lock
+)
 
 # Try to import monster data
 try:
-    from utils.dnd5e_data import get_monster, MONSTERS
+    from utils.dnd5e_data import get_monster, get_aoe_spell, MONSTERS
     MONSTER_DATA_AVAILABLE = True
 except ImportError:
     MONSTER_DATA_AVAILABLE = False
@@ -68,6 +79,11 @@ def _expand_enemy(enemy):
             # Add reactions if present
             if monster_data.get('reactions'):
                 enemy_data['monster_reactions'] = monster_data['reactions']
+            
+            # Damage defenses and save proficiencies used by damage/AoE resolution
+            for key in ('resistances', 'immunities', 'vulnerabilities', 'saving_throws'):
+                if monster_data.get(key):
+                    enemy_data[key] = monster_data[key]
         else:
             # Use provided stats
             enemy_data = {
@@ -90,22 +106,244 @@ COMBAT_DIR = os.path.join(os.path.dirname(__file__), '..', 'combat')
 os.makedirs(COMBAT_DIR, exist_ok=True)
 _combat_locks = {}
 
+# Resident encounters, one per channel. Writes are deferred and coalesced.
+_encounters = {}
+_flush_timers = {}
+# The same lock combat_event holds, so a flush never sees a half-done change
+_encounters_lock = state_lock
+_write_seq = count(1)   # orders snapshots so an older one never overwrites a newer
+_written_seq = {}       # channel_id -> seq of the snapshot on disk
+COMBAT_FLUSH_DELAY = 2.0  # seconds to wait before writing a dirty encounter
+
+
+class CombatEncounter(dict):
+    """
+    Combat state for one channel, kept in memory between commands.
+
+    Still a plain dict as far as callers and json.dump are concerned, plus a
+    case-folded name index over ``combatants`` and a dirty flag used by the
+    write-behind persistence in ``save_combat``.
+    """
+
+    def __init__(self, channel_id, data=None):
+        super().__init__(data or {})
+        self.channel_id = str(channel_id)
+        self.dirty = False
+        self._index = {}
+        self._id_index = {}
+        self._cid_index = {}
+        self._indexed = None  # (list identity, length) the index was built from
+
+    def _ensure_index(self):
+        combatants = self.get('combatants', [])
+        key = (id(combatants), len(combatants))
+        if self._indexed != key:
+            self._index = {}
+            self._id_index = {}
+            self._cid_index = {}
+            for c in combatants:
+                self._index.setdefault(c['name'].casefold(), c)
+                if c.get('id') is not None:
+                    self._id_index.setdefault(str(c['id']), c)
+                self._cid_index[c.get('cid')] = c
+            self._indexed = key
+
+    def reindex(self):
+        """Force the name index to be rebuilt (e.g. after a rename)."""
+        self._indexed = None
+
+    def find(self, name):
+        """Return the combatant called ``name`` (case-insensitive) or None."""
+        if not name:
+            return None
+        self._ensure_index()
+        combatant = self._index.get(name.casefold())
+        if combatant is not None and combatant['name'].casefold() != name.casefold():
+            # Renamed in place since the index was built
+            self.reindex()
+            self._ensure_index()
+            combatant = self._index.get(name.casefold())
+        return combatant
+
+    def find_by_id(self, user_id):
+        """Return the combatant controlled by ``user_id`` or None."""
+        self._ensure_index()
+        return self._id_index.get(str(user_id))
+
+    def by_cid(self, cid):
+        """Return the combatant with combat ID ``cid`` or None."""
+        self._ensure_index()
+        return self._cid_index.get(cid)
+
+
+def find_combatant(state, name):
+    """Look a combatant up by name, using the encounter index when available."""
+    if isinstance(state, CombatEncounter):
+        return state.find(name)
+    return next((c for c in state.get('combatants', []) if c['name'].lower() == name.lower()), None)
+
+
+def find_combatant_by_id(state, user_id):
+    """Look a combatant up by player ID, using the encounter index when available."""
+    if isinstance(state, CombatEncounter):
+        return state.find_by_id(user_id)
+    return next((c for c in state.get('combatants', []) if str(c.get('id')) == str(user_id)), None)
+
+
+def combatant_by_cid(state, cid):
+    """Resolve a ``turn_order`` entry to its combatant dict."""
+    if isinstance(state, CombatEncounter):
+        return state.by_cid(cid)
+    return next((c for c in state.get('combatants', []) if c.get('cid') == cid), None)
+
+
+# turn_order holds combatant IDs ('cid') into the single combatants table.
+# These helpers return the combatant dicts for display.
+
+def get_turn_order_combatants(state):
+    """Return combatants in initiative order."""
+    order = (combatant_by_cid(state, cid) for cid in state.get('turn_order', []))
+    return [c for c in order if c is not None]
+
+
+def get_current_combatant(state):
+    """Return the combatant whose turn it is, or None."""
+    order = state.get('turn_order', [])
+    if not order:
+        return None
+    return combatant_by_cid(state, order[state.get('current_turn', 0) % len(order)])
+
+
+def _assign_cids(state):
+    """Give every combatant a stable combat ID."""
+    next_cid = state.get('next_cid', 0)
+    used = {c['cid'] for c in state.get('combatants', []) if 'cid' in c}
+    if used:
+        next_cid = max(next_cid, max(used) + 1)
+    for c in state.get('combatants', []):
+        if 'cid' not in c:
+            c['cid'] = next_cid
+            next_cid += 1
+    state['next_cid'] = next_cid
+
+
+def _migrate_turn_order(state):
+    """Convert files that stored full combatant copies in turn_order to IDs."""
+    _assign_cids(state)
+    order = state.get('turn_order', [])
+    if order and isinstance(order[0], dict):
+        by_name = {c['name'].lower(): c['cid'] for c in state.get('combatants', [])}
+        state['turn_order'] = [by_name[c['name'].lower()] for c in order if c['name'].lower() in by_name]
+
+
+def _insert_in_order(state, cid):
+    """Insert ``cid`` into turn_order by descending initiative; keeps current turn pointing at the same combatant."""
+    order = state['turn_order']
+    def neg_initiative(x):
+        c = combatant_by_cid(state, x)
+        return -(c.get('initiative', 0) if c else 0)
+    pos = bisect.bisect_right(order, neg_initiative(cid), key=neg_initiative)
+    order.insert(pos, cid)
+    if state.get('active') and pos <= state.get('current_turn', 0) and len(order) > 1:
+        state['current_turn'] += 1
+    return pos
+
+
+def _remove_from_order(state, cid):
+    """Remove ``cid`` from turn_order, keeping the current turn pointer valid."""
+    order = state['turn_order']
+    if cid not in order:
+        return
+    pos = order.index(cid)
+    order.pop(pos)
+    if pos < state.get('current_turn', 0):
+        state['current_turn'] -= 1
+    if state.get('current_turn', 0) >= len(order):
+        state['current_turn'] = 0
+
+
 def _get_combat_path(channel_id):
     return os.path.join(COMBAT_DIR, f'{channel_id}.json')
 
 def load_combat(channel_id):
-    path = _get_combat_path(channel_id)
-    if not os.path.exists(path):
-        return None
-    with open(path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """Return the resident encounter for a channel, reading the file on first use."""
+    channel_id = str(channel_id)
+    with _encounters_lock:
+        encounter = _encounters.get(channel_id)
+        if encounter is not None:
+            return encounter
+        path = _get_combat_path(channel_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            encounter = CombatEncounter(channel_id, json.load(f))
+        _migrate_turn_order(encounter)
+        _encounters[channel_id] = encounter
+        open_log(channel_id, encounter)
+        return encounter
 
-def save_combat(channel_id, data):
+def _write_combat(channel_id, text, seq):
     path = _get_combat_path(channel_id)
+    tmp = path + '.tmp'
     lock = _combat_locks.setdefault(channel_id, Lock())
     with lock:
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        if seq <= _written_seq.get(channel_id, 0):
+            return  # a newer snapshot got here first
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+        _written_seq[channel_id] = seq
+
+def flush_combat(channel_id=None):
+    """
+    Write dirty encounters to disk now (one channel, or all when None).
+
+    Encounters are serialised under the encounter lock, so never mid-change;
+    the file writes happen after it is released.
+    """
+    snapshots = []
+    with _encounters_lock:
+        channels = [str(channel_id)] if channel_id is not None else list(_encounters)
+        for cid in channels:
+            timer = _flush_timers.pop(cid, None)
+            if timer:
+                timer.cancel()
+            encounter = _encounters.get(cid)
+            if encounter is not None and encounter.dirty:
+                snapshots.append((cid, json.dumps(encounter, ensure_ascii=False), next(_write_seq)))
+                encounter.dirty = False
+    for cid, text, seq in snapshots:
+        _write_combat(cid, text, seq)
+
+def save_combat(channel_id, data, immediate=False):
+    """
+    Mark combat state as changed. The file is written COMBAT_FLUSH_DELAY
+    seconds after the first unsaved change, so a burst of changes costs one
+    write, or straight away when ``immediate`` is set (used at round
+    boundaries and when combat starts).
+    """
+    channel_id = str(channel_id)
+    with _encounters_lock:
+        encounter = _encounters.get(channel_id)
+        if encounter is not data:
+            if isinstance(data, CombatEncounter):
+                encounter = data
+            else:
+                encounter = CombatEncounter(channel_id, data)
+                _migrate_turn_order(encounter)
+            _encounters[channel_id] = encounter
+        encounter.dirty = True
+        record_changes(channel_id, encounter)
+        if immediate or COMBAT_FLUSH_DELAY <= 0:
+            flush_combat(channel_id)
+        elif channel_id not in _flush_timers:
+            timer = Timer(COMBAT_FLUSH_DELAY, flush_combat, args=(channel_id,))
+            timer.daemon = True
+            _flush_timers[channel_id] = timer
+            timer.start()
+    return encounter
+
+atexit.register(flush_combat)
 
 def start_combat(channel_id, players, enemies):
     """
@@ -114,8 +352,9 @@ def start_combat(channel_id, players, enemies):
     enemies: list of dicts {name, hp, ac}
     """
     combatants = []
+    chars = load_characters([user_id for user_id, _ in players])
     for user_id, name in players:
-        char = load_character(user_id)
+        char = chars.get(str(user_id))
         if char:
             hp = char.get('hp', 10)
             max_hp = char.get('max_hp', 10)
@@ -140,64 +379,91 @@ def start_combat(channel_id, players, enemies):
     for enemy in enemies:
         combatants.extend(_expand_enemy(enemy))
     state = {
+        'encounter_id': new_encounter_id(),
         'combatants': combatants,
         'turn_order': [],
         'active': False,
         'current_turn': 0,
         'round': 1
     }
-    save_combat(channel_id, state)
-    return state
+    _assign_cids(state)
+    return save_combat(channel_id, state, immediate=True)
 
+@combat_event('initiative')
 def roll_initiative(channel_id):
     """Roll initiative for all combatants and sort turn order."""
     state = load_combat(channel_id)
     if not state:
         return None
-    for c in state['combatants']:
-        roll = roll_dice('1d20')[0]
-        bonus = c.get('init_bonus', 0)
-        c['initiative'] = roll + bonus
-        c['init_roll'] = roll  # Store the raw roll for display
-    state['turn_order'] = sorted(state['combatants'], key=lambda x: x['initiative'], reverse=True)
+    # One batched draw for the whole field
+    rolls = roll_initiative_bulk([c.get('init_bonus', 0) for c in state['combatants']], channel_id)
+    for c, result in zip(state['combatants'], rolls):
+        c['initiative'] = result['total']
+        c['init_roll'] = result['roll']  # Store the raw roll for display
+    order = sorted(state['combatants'], key=lambda x: x['initiative'], reverse=True)
+    state['turn_order'] = [c['cid'] for c in order]
     state['active'] = True
     state['current_turn'] = 0
-    save_combat(channel_id, state)
+    save_combat(channel_id, state, immediate=True)
     return state
 
+@combat_event('turn')
 def next_turn(channel_id):
     state = load_combat(channel_id)
     if not state or not state['active']:
         return None
     n = len(state['turn_order'])
+    start = state['current_turn']
     for _ in range(n):
         state['current_turn'] = (state['current_turn'] + 1) % n
-        active = state['turn_order'][state['current_turn']]
+        active = combatant_by_cid(state, state['turn_order'][state['current_turn']]) or {}
         if active.get('hp', 1) > 0 and 'unconscious' not in active.get('status', []) and 'dead' not in active.get('status', []):
             break
-    save_combat(channel_id, state)
+    # Persist right away when the order wraps (round boundary)
+    save_combat(channel_id, state, immediate=state['current_turn'] <= start)
     return state
 
+def _map_cover(channel_id, attacker, target):
+    """Cover between two combatants from their tokens on the channel's map (none if not placed)."""
+    map_obj = load_map(channel_id)
+    if not map_obj:
+        return COVER_NONE
+    return token_cover(map_obj, attacker['name'], target['name']) or COVER_NONE
+
+
+@combat_event('attack')
 def attack(channel_id, attacker_id, target_name, attack_bonus, damage_dice):
-    """Resolve an attack roll and apply damage."""
+    """Resolve an attack roll and apply damage (cover from the map raises the target's AC)."""
     state = load_combat(channel_id)
     if not state or not state.get('active'):
         return None
-    attacker = next((c for c in state['combatants'] if str(c.get('id')) == str(attacker_id)), None)
-    target = next((c for c in state['combatants'] if c['name'].lower() == target_name.lower()), None)
+    attacker = find_combatant_by_id(state, attacker_id)
+    target = find_combatant(state, target_name)
     if not attacker or not target:
         return None
     
+    cover = _map_cover(channel_id, attacker, target)
+    if cover == COVER_TOTAL:
+        return {
+            'blocked': True,
+            'cover': cover,
+            'hit': False,
+            'target': target['name'],
+            'target_hp': target['hp'],
+            'target_max_hp': target.get('max_hp', target['hp'])
+        }
+    target_ac = target.get('ac', 10) + COVER_BONUS[cover]
+    
     # Roll attack
-    attack_roll = roll_dice('1d20')[0]
+    attack_roll = roll_dice('1d20', channel_id)[0]
     is_crit = attack_roll == 20
     is_fumble = attack_roll == 1
     total_attack = attack_roll + attack_bonus
-    hit = (total_attack >= target.get('ac', 10) or is_crit) and not is_fumble
+    hit = (total_attack >= target_ac or is_crit) and not is_fumble
     
     damage = 0
     if hit:
-        damage_result = roll_dice(damage_dice)[0]
+        damage_result = roll_dice(damage_dice, channel_id)[0]
         if is_crit:
             # Critical hit - double the dice (simplified: double damage)
             damage = damage_result * 2
@@ -217,6 +483,8 @@ def attack(channel_id, attacker_id, target_name, attack_bonus, damage_dice):
         'fumble': is_fumble,
         'damage': damage,
         'target': target['name'],
+        'target_ac': target_ac,
+        'cover': cover,
         'target_hp': target['hp'],
         'target_max_hp': target.get('max_hp', target['hp'])
     }
@@ -228,15 +496,14 @@ def get_combat_status(channel_id):
     if not state or not state.get('active'):
         return None
     
-    current = state['turn_order'][state['current_turn']]
-    
     return {
         'round': state.get('round', 1),
-        'current_combatant': current,
-        'turn_order': state['turn_order'],
+        'current_combatant': get_current_combatant(state),
+        'turn_order': get_turn_order_combatants(state),
         'current_index': state['current_turn']
     }
 
+@combat_event('reaction')
 def add_reaction(channel_id, user_id, reaction):
     state = load_combat(channel_id)
     if not state:
@@ -251,30 +518,190 @@ def get_active_combatant(channel_id):
     state = load_combat(channel_id)
     if not state or not state['active']:
         return None
-    return state['turn_order'][state['current_turn']]
+    return get_current_combatant(state)
 
 
-def apply_aoe_damage(channel_id, targets, damage):
-    """Placeholder for area-of-effect damage."""
+def _save_bonus(combatant, ability, characters):
+    """Saving throw bonus for a combatant: statblock save, character sheet, or raw ability."""
+    saves = combatant.get('saving_throws')
+    if isinstance(saves, dict) and ability in saves:
+        return saves[ability]
+    char = characters.get(str(combatant.get('id'))) if combatant.get('type') == 'player' else None
+    if char:
+        return get_saving_throw_bonus(char, ability)
+    score = (combatant.get('stats') or {}).get(ability, 10)
+    return (score - 10) // 2
+
+
+@combat_event('aoe')
+def resolve_aoe(channel_id, targets, damage, save=None, dc=None, half_on_save=True,
+                damage_type=None, advantage=None):
+    """
+    Resolve an area effect against many combatants in one pass.
+    
+    Damage is rolled once for the whole area, every target's saving throw is
+    drawn in one batch, resistances/immunities/vulnerabilities are applied per
+    target, and the encounter is saved once at the end.
+    
+    Args:
+        channel_id: The channel ID
+        targets: Combatant names (or cids)
+        damage: Dice expression ('8d6') or a flat amount
+        save: Save ability ('DEX', ...), or None for no save
+        dc: Save DC (required with ``save``)
+        half_on_save: Successful saves take half damage instead of none
+        damage_type: e.g. 'fire', checked against each target's defenses
+        advantage: Optional set of target names that save with advantage
+    
+    Returns:
+        Dict with the damage roll, per-target results and any names not found
+    """
     state = load_combat(channel_id)
     if not state or not state.get('active'):
         return None
-    for name in targets:
-        target = next((c for c in state['combatants'] if c['name'].lower() == name.lower()), None)
-        if target:
-            target['hp'] = max(0, target.get('hp', 0) - damage)
-            if target['hp'] == 0:
-                target.setdefault('status', []).append('unconscious')
+    
+    hit, missing, seen = [], [], set()
+    for ref in targets:
+        target = combatant_by_cid(state, ref) if isinstance(ref, int) else find_combatant(state, ref)
+        if target is None:
+            missing.append(ref)
+        elif id(target) not in seen:
+            seen.add(id(target))
+            hit.append(target)
+    
+    if isinstance(damage, int):
+        total, detail = damage, str(damage)
+    else:
+        rolled = roll_on_stream(damage, channel_id, label='aoe damage')
+        total, detail = rolled.total, rolled.detail
+    
+    saves = [None] * len(hit)
+    if save and dc is not None and hit:
+        save = save.upper()
+        player_ids = [c['id'] for c in hit if c.get('type') == 'player' and c.get('id')]
+        characters = load_characters(player_ids) if player_ids else {}
+        bonuses = [_save_bonus(c, save, characters) for c in hit]
+        adv = [c['name'] in advantage for c in hit] if advantage else None
+        saves = roll_saves(bonuses, dc, channel_id, advantage=adv)
+    
+    results = []
+    for target, throw in zip(hit, saves):
+        saved = bool(throw and throw['success'])
+        amount = (total // 2 if half_on_save else 0) if saved else total
+        actual, modifier = _apply_damage_defenses(target, amount, damage_type)
+        old_hp = target.get('hp', 0)
+        target['hp'] = max(0, old_hp - actual)
+        _mark_damage_taken(target, damage_type)
+        results.append({
+            'target': target['name'],
+            'save_roll': throw['roll'] if throw else None,
+            'save_total': throw['total'] if throw else None,
+            'saved': saved,
+            'damage': actual,
+            'modifier': modifier,
+            'old_hp': old_hp,
+            'new_hp': target['hp'],
+            'down': target['hp'] == 0 and old_hp > 0,
+        })
+    
     save_combat(channel_id, state)
-    return state
+    return {
+        'damage_roll': total,
+        'detail': detail,
+        'damage_type': damage_type,
+        'save': save,
+        'dc': dc,
+        'results': results,
+        'missing': missing,
+    }
+
+
+def spell_aoe_damage(spell, slot_level=None):
+    """Damage expression for an area spell cast at ``slot_level`` (upcast dice added)."""
+    damage = spell['damage']
+    if slot_level and spell.get('upcast') and slot_level > spell.get('level', 0):
+        num, die = spell['upcast'].split('d')
+        damage += f"+{int(num) * (slot_level - spell['level'])}d{die}"
+    return damage
+
+
+@combat_event('spell')
+def resolve_spell_aoe(channel_id, spell_name, targets, caster_id=None, slot_level=None, dc=None):
+    """
+    Resolve a saving-throw damage spell from AOE_SPELLS against ``targets``.
+    The DC defaults to the caster's spell save DC. Returns None for an unknown
+    spell or no active combat, otherwise the ``resolve_aoe`` result plus 'spell'.
+    """
+    spell = get_aoe_spell(spell_name) if MONSTER_DATA_AVAILABLE else None
+    if not spell:
+        return None
+    if dc is None and caster_id is not None:
+        caster = load_characters([caster_id]).get(str(caster_id))
+        dc = get_spell_save_dc(caster) if caster else None
+    result = resolve_aoe(
+        channel_id, targets, spell_aoe_damage(spell, slot_level),
+        save=spell['save'], dc=dc if dc is not None else 13,
+        half_on_save=spell['half_on_save'], damage_type=spell['damage_type'],
+    )
+    if result is not None:
+        result['spell'] = spell['name']
+    return result
+
+
+@combat_event('spell')
+def cast_area_spell(channel_id, spell_name, x, y, caster_id, slot_level=None, dc=None):
+    """
+    Cast an AOE_SPELLS spell at square (x, y) on the channel's map and resolve
+    it against every creature token its template covers.
+    
+    Spheres land on the target square; cones, lines and cubes start from the
+    caster's token and aim at it; emanations surround the caster.
+    
+    Returns None for an unknown spell or no active combat, otherwise the
+    resolve_spell_aoe result plus 'area' (squares covered). Raises ValueError
+    when the map, the caster's token or the target square is missing.
+    """
+    spell = get_aoe_spell(spell_name) if MONSTER_DATA_AVAILABLE else None
+    state = load_combat(channel_id)
+    if not spell or not state or not state.get('active'):
+        return None
+    map_obj = load_map(channel_id)
+    if not map_obj:
+        raise ValueError("No map active - place tokens with /newmap and /addtoken first")
+    if not map_obj._in_bounds(x, y):
+        raise ValueError(f"({x},{y}) is off the map")
+    
+    caster = find_combatant_by_id(state, caster_id)
+    caster_token = map_obj.get_token(caster['name']) if caster else None
+    
+    template = spell_template(map_obj, spell['shape'], spell['size'], caster_token, (x, y))
+    if template is None:
+        raise ValueError(f"{spell['name']} starts from the caster - put your token on the map")
+    tokens = tokens_in_template(map_obj, template)
+    area = template.squares()
+    
+    names = [t.name for t in tokens if t.token_type != 'object']
+    result = resolve_spell_aoe(channel_id, spell['name'], names, caster_id=caster_id,
+                               slot_level=slot_level, dc=dc)
+    if result is not None:
+        result['area'] = area
+    return result
+
+
+@combat_event('damage')
+def apply_aoe_damage(channel_id, targets, damage, damage_type=None):
+    """Apply a flat amount of damage to several combatants (no saves)."""
+    result = resolve_aoe(channel_id, targets, damage, damage_type=damage_type)
+    return load_combat(channel_id) if result is not None else None
 
 
+@combat_event('status')
 def apply_status(channel_id, target_name, status):
     """Placeholder for applying a status condition to a target."""
     state = load_combat(channel_id)
     if not state or not state.get('active'):
         return None
-    target = next((c for c in state['combatants'] if c['name'].lower() == target_name.lower()), None)
+    target = find_combatant(state, target_name)
     if not target:
         return None
     target.setdefault('status', []).append(status)
@@ -282,15 +709,42 @@ def apply_status(channel_id, target_name, status):
     return state
 
 def end_combat(channel_id):
+    """Drop the encounter and its file; its event log is closed and kept for summaries."""
+    channel_id = str(channel_id)
+    with _encounters_lock:
+        timer = _flush_timers.pop(channel_id, None)
+        if timer:
+            timer.cancel()
+        close_log(channel_id, _encounters.pop(channel_id, None))
+        fence = next(_write_seq)
     path = _get_combat_path(channel_id)
-    if os.path.exists(path):
-        os.remove(path)
+    with _combat_locks.setdefault(channel_id, Lock()):
+        # Any flush already in flight is older than the fence and is dropped
+        _written_seq[channel_id] = fence
+        if os.path.exists(path):
+            os.remove(path)
+
+def undo_combat(channel_id, count=1):
+    """
+    Undo the last ``count`` logged combat changes (attacks, damage, turns...).
+    Returns the undone events, newest first (empty if there is nothing to undo).
+    """
+    channel_id = str(channel_id)
+    with _encounters_lock:
+        state = load_combat(channel_id)
+        if not state:
+            return []
+        undone = undo_events(channel_id, state, count)
+        if undone:
+            save_combat(channel_id, state)
+    return undone
 
 
 # =============================================================================
 # LEGENDARY ACTIONS & RESISTANCES
 # =============================================================================
 
+@combat_event('legendary')
 def use_legendary_action(channel_id, enemy_name, action_index=0):
     """Use a legendary action for an enemy.
     
@@ -306,7 +760,7 @@ def use_legendary_action(channel_id, enemy_name, action_index=0):
     if not state or not state.get('active'):
         return None
     
-    enemy = next((c for c in state['combatants'] if c['name'].lower() == enemy_name.lower()), None)
+    enemy = find_combatant(state, enemy_name)
     if not enemy:
         return None
     
@@ -337,6 +791,7 @@ def use_legendary_action(channel_id, enemy_name, action_index=0):
     }
 
 
+@combat_event('legendary')
 def use_legendary_resistance(channel_id, enemy_name):
     """Use a legendary resistance to auto-succeed a saving throw.
     
@@ -347,7 +802,7 @@ def use_legendary_resistance(channel_id, enemy_name):
     if not state or not state.get('active'):
         return None
     
-    enemy = next((c for c in state['combatants'] if c['name'].lower() == enemy_name.lower()), None)
+    enemy = find_combatant(state, enemy_name)
     if not enemy:
         return None
     
@@ -366,13 +821,14 @@ def use_legendary_resistance(channel_id, enemy_name):
     }
 
 
+@combat_event('legendary')
 def reset_legendary_actions(channel_id, enemy_name):
     """Reset legendary actions at the start of the enemy's turn."""
     state = load_combat(channel_id)
     if not state or not state.get('active'):
         return None
     
-    enemy = next((c for c in state['combatants'] if c['name'].lower() == enemy_name.lower()), None)
+    enemy = find_combatant(state, enemy_name)
     if not enemy:
         return None
     
@@ -387,6 +843,7 @@ def reset_legendary_actions(channel_id, enemy_name):
 # LAIR ACTIONS
 # =============================================================================
 
+@combat_event('lair')
 def set_lair_actions(channel_id, lair_actions):
     """Set lair actions for the current combat.
     
@@ -404,6 +861,7 @@ def set_lair_actions(channel_id, lair_actions):
     return state
 
 
+@combat_event('lair')
 def use_lair_action(channel_id, action_index=0):
     """Use a lair action (typically at initiative count 20).
     
@@ -447,6 +905,7 @@ def get_lair_actions(channel_id):
 # ENHANCED INITIATIVE TRACKING
 # =============================================================================
 
+@combat_event('combatant')
 def add_combatant_mid_combat(channel_id, combatant_data, initiative_roll=None):
     """Add a new combatant to ongoing combat.
     
@@ -462,9 +921,10 @@ def add_combatant_mid_combat(channel_id, combatant_data, initiative_roll=None):
     # Set up the combatant
     init_bonus = combatant_data.get('init_bonus', 0)
     if initiative_roll is None:
-        initiative_roll = roll_dice('1d20')[0] + init_bonus
+        initiative_roll = roll_dice('1d20', channel_id)[0] + init_bonus
     
     new_combatant = {
+        'cid': state.get('next_cid', len(state['combatants'])),
         'type': combatant_data.get('type', 'enemy'),
         'id': combatant_data.get('id'),
         'name': combatant_data['name'],
@@ -478,18 +938,16 @@ def add_combatant_mid_combat(channel_id, combatant_data, initiative_roll=None):
     }
     
     state['combatants'].append(new_combatant)
+    state['next_cid'] = new_combatant['cid'] + 1
     
-    # Re-sort turn order
-    state['turn_order'] = sorted(
-        [c for c in state['combatants'] if c.get('hp', 1) > 0],
-        key=lambda x: x['initiative'],
-        reverse=True
-    )
+    # Slot into the existing turn order
+    _insert_in_order(state, new_combatant['cid'])
     
     save_combat(channel_id, state)
     return state
 
 
+@combat_event('combatant')
 def remove_combatant(channel_id, combatant_name):
     """Remove a combatant from combat entirely."""
     state = load_combat(channel_id)
@@ -497,48 +955,45 @@ def remove_combatant(channel_id, combatant_name):
         return None
     
     # Find and remove
-    state['combatants'] = [c for c in state['combatants'] if c['name'].lower() != combatant_name.lower()]
-    state['turn_order'] = [c for c in state['turn_order'] if c['name'].lower() != combatant_name.lower()]
-    
-    # Adjust current turn if needed
-    if state['current_turn'] >= len(state['turn_order']):
-        state['current_turn'] = 0
+    combatant = find_combatant(state, combatant_name)
+    if combatant:
+        _remove_from_order(state, combatant.get('cid'))
+        state['combatants'] = [c for c in state['combatants'] if c is not combatant]
     
     save_combat(channel_id, state)
     return state
 
 
+@combat_event('turn')
 def delay_turn(channel_id, combatant_name, new_initiative):
     """Delay a combatant's turn to a new initiative count."""
     state = load_combat(channel_id)
     if not state or not state.get('active'):
         return None
     
-    combatant = next((c for c in state['combatants'] if c['name'].lower() == combatant_name.lower()), None)
+    combatant = find_combatant(state, combatant_name)
     if not combatant:
         return None
     
     combatant['initiative'] = new_initiative
     combatant['delayed'] = True
     
-    # Re-sort turn order
-    state['turn_order'] = sorted(
-        [c for c in state['combatants'] if c.get('hp', 1) > 0 and 'dead' not in c.get('status', [])],
-        key=lambda x: x['initiative'],
-        reverse=True
-    )
+    # Move within the turn order
+    _remove_from_order(state, combatant['cid'])
+    _insert_in_order(state, combatant['cid'])
     
     save_combat(channel_id, state)
     return state
 
 
+@combat_event('action')
 def ready_action(channel_id, combatant_name, trigger, action):
     """Set a readied action with a trigger condition."""
     state = load_combat(channel_id)
     if not state or not state.get('active'):
         return None
     
-    combatant = next((c for c in state['combatants'] if c['name'].lower() == combatant_name.lower()), None)
+    combatant = find_combatant(state, combatant_name)
     if not combatant:
         return None
     
@@ -551,13 +1006,14 @@ def ready_action(channel_id, combatant_name, trigger, action):
     return state
 
 
+@combat_event('action')
 def trigger_readied_action(channel_id, combatant_name):
     """Trigger a combatant's readied action."""
     state = load_combat(channel_id)
     if not state or not state.get('active'):
         return None
     
-    combatant = next((c for c in state['combatants'] if c['name'].lower() == combatant_name.lower()), None)
+    combatant = find_combatant(state, combatant_name)
     if not combatant or 'readied_action' not in combatant:
         return None
     
@@ -575,6 +1031,7 @@ def trigger_readied_action(channel_id, combatant_name):
 # ROUND TRACKING ENHANCEMENTS
 # =============================================================================
 
+@combat_event('turn')
 def advance_round(channel_id):
     """Advance to the next round, resetting round-based effects."""
     state = load_combat(channel_id)
@@ -616,7 +1073,7 @@ def advance_round(channel_id):
                 del combatant['status_durations'][status]
                 effects_triggered.append(f"{combatant['name']}: {status} expired")
     
-    save_combat(channel_id, state)
+    save_combat(channel_id, state, immediate=True)
     
     return {
         'round': state['round'],
@@ -640,8 +1097,8 @@ def get_combat_summary(channel_id):
         'lair_actions': state.get('lair_actions'),
     }
     
-    if state.get('turn_order'):
-        current = state['turn_order'][state['current_turn']]
+    current = get_current_combatant(state)
+    if current:
         summary['current_combatant'] = current['name']
     
     for combatant in state.get('combatants', []):
@@ -675,13 +1132,14 @@ def get_combat_summary(channel_id):
     return summary
 
 
+@combat_event('heal')
 def heal_combatant(channel_id, target_name, amount):
     """Heal a combatant by a specified amount."""
     state = load_combat(channel_id)
     if not state:
         return None
     
-    target = next((c for c in state['combatants'] if c['name'].lower() == target_name.lower()), None)
+    target = find_combatant(state, target_name)
     if not target:
         return None
     
@@ -705,45 +1163,49 @@ def heal_combatant(channel_id, target_name, amount):
     }
 
 
+def _apply_damage_defenses(target, amount, damage_type):
+    """Return (damage after immunity/vulnerability/resistance, modifier name or None)."""
+    if not damage_type:
+        return amount, None
+    dtype = damage_type.lower()
+    if dtype in [i.lower() for i in target.get('immunities', [])]:
+        return 0, 'immune'
+    if dtype in [v.lower() for v in target.get('vulnerabilities', [])]:
+        return amount * 2, 'vulnerable'
+    if dtype in [r.lower() for r in target.get('resistances', [])]:
+        return amount // 2, 'resistant'
+    return amount, None
+
+
+def _mark_damage_taken(target, damage_type):
+    """Status bookkeeping after damage: regeneration block and unconscious at 0 HP."""
+    # Track if regeneration should be blocked (acid/fire for trolls)
+    if damage_type and damage_type.lower() in ['acid', 'fire']:
+        target['regeneration_blocked'] = True
+    
+    # Apply unconscious if at 0 HP
+    status = target.setdefault('status', [])
+    if target.get('hp', 0) <= 0 and 'unconscious' not in status:
+        status.append('unconscious')
+
+
+@combat_event('damage')
 def damage_combatant(channel_id, target_name, amount, damage_type=None):
     """Apply damage to a combatant with optional damage type tracking."""
     state = load_combat(channel_id)
     if not state:
         return None
     
-    target = next((c for c in state['combatants'] if c['name'].lower() == target_name.lower()), None)
+    target = find_combatant(state, target_name)
     if not target:
         return None
     
     # Check for resistances/immunities/vulnerabilities
-    actual_damage = amount
-    modifier = None
-    
-    if damage_type:
-        immunities = target.get('immunities', [])
-        resistances = target.get('resistances', [])
-        vulnerabilities = target.get('vulnerabilities', [])
-        
-        if damage_type.lower() in [i.lower() for i in immunities]:
-            actual_damage = 0
-            modifier = 'immune'
-        elif damage_type.lower() in [v.lower() for v in vulnerabilities]:
-            actual_damage = amount * 2
-            modifier = 'vulnerable'
-        elif damage_type.lower() in [r.lower() for r in resistances]:
-            actual_damage = amount // 2
-            modifier = 'resistant'
+    actual_damage, modifier = _apply_damage_defenses(target, amount, damage_type)
     
     old_hp = target.get('hp', 0)
     target['hp'] = max(0, old_hp - actual_damage)
-    
-    # Track if regeneration should be blocked (acid/fire for trolls)
-    if damage_type and damage_type.lower() in ['acid', 'fire']:
-        target['regeneration_blocked'] = True
-    
-    # Apply unconscious if at 0 HP
-    if target['hp'] <= 0 and 'unconscious' not in target.get('status', []):
-        target['status'].append('unconscious')
+    _mark_damage_taken(target, damage_type)
     
     save_combat(channel_id, state)
     
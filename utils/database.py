@@ -523,6 +523,18 @@ def db_log_message(channel_id: str, speaker: str, message: str):
             )
 
 
+def db_log_messages(entries: List[tuple]):
+    """Log a batch of (channel_id, speaker, message, created_at) rows in one transaction."""
+    if not entries:
+        return
+    with _db_lock:
+        with get_db() as conn:
+            conn.executemany(
+                'INSERT INTO session_logs (channel_id, speaker, message, created_at) VALUES (?, ?, ?, ?)',
+                entries
+            )
+
+
 def db_get_session_log(channel_id: str, limit: int = 100) -> List[dict]:
     """Get recent session log entries."""
     with get_db() as conn:
@@ -0,0 +1,454 @@
+"""
+Dice Expressions
+Parser and evaluator for full dice notation.
+
+Supported syntax (case-insensitive, spaces ignored):
+
+- ``NdM`` / ``dM`` / ``d%``       - N dice with M sides
+- ``kh`` / ``k`` / ``kl`` N       - keep the highest / lowest N dice (``4d6kh3``)
+- ``dh`` / ``dl`` N               - drop the highest / lowest N dice
+- ``!`` / ``!>=N``                - exploding dice (max face, or faces matching the comparison)
+- ``r1`` / ``r<3`` / ``ro<3``     - reroll matching faces (``ro`` rerolls only once)
+- ``min N`` / ``max N``           - clamp each die to at least / at most N
+- ``+ - * /`` and parentheses     - integer arithmetic (``/`` rounds down)
+
+Expressions are compiled once into a small tree of nodes and cached by string,
+so repeated rolls of the same notation (monster attacks, inline rolls) skip
+parsing entirely. ``roll_many`` evaluates a batch of rolls in one pass.
+"""
+
+import re
+import random
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Tuple
+
+MAX_DICE = 1000
+MAX_SIDES = 1000
+MAX_EXPLOSIONS = 100
+
+
+class DiceSyntaxError(ValueError):
+    """Raised when a dice expression can't be parsed."""
+
+
+class RollResult(NamedTuple):
+    total: int
+    rolls: List[int]     # kept die faces, in roll order
+    modifier: int        # total minus the kept faces (flat bonuses)
+    detail: str          # e.g. "[6, 5, 4, ~~2~~] + 3"
+
+
+# =============================================================================
+# NODES
+# =============================================================================
+
+def _compare(op, target):
+    if op == '<':
+        return lambda v: v < target
+    if op == '<=':
+        return lambda v: v <= target
+    if op == '>':
+        return lambda v: v > target
+    if op == '>=':
+        return lambda v: v >= target
+    return lambda v: v == target
+
+
+class Const:
+    __slots__ = ('value',)
+
+    def __init__(self, value: int):
+        self.value = value
+
+    def evaluate(self, rng, kept, parts):
+        parts.append(str(self.value))
+        return self.value
+
+    def sample(self, n, rng):
+        return [self.value] * n
+
+    def __str__(self):
+        return str(self.value)
+
+
+class Dice:
+    """``count`` dice with ``sides`` faces plus per-die and keep/drop modifiers."""
+
+    __slots__ = ('count', 'sides', 'keep', 'keep_highest', 'explode', 'reroll', 'reroll_once',
+                 'minimum', 'maximum', '_explodes', '_rerolls')
+
+    def __init__(self, count, sides, keep=None, keep_highest=True, explode=None,
+                 reroll=None, reroll_once=False, minimum=None, maximum=None):
+        self.count = count
+        self.sides = sides
+        self.keep = keep
+        self.keep_highest = keep_highest
+        self.explode = explode          # (op, value) or None
+        self.reroll = reroll            # (op, value) or None
+        self.reroll_once = reroll_once
+        self.minimum = minimum
+        self.maximum = maximum
+        self._explodes = _compare(*explode) if explode else None
+        self._rerolls = _compare(*reroll) if reroll else None
+
+    @property
+    def plain(self) -> bool:
+        """True for bare NdM with no modifiers."""
+        return (self.keep is None and self.explode is None and self.reroll is None
+                and self.minimum is None and self.maximum is None)
+
+    def with_count(self, count) -> 'Dice':
+        return Dice(count, self.sides, self.keep, self.keep_highest, self.explode,
+                    self.reroll, self.reroll_once, self.minimum, self.maximum)
+
+    def roll_die(self, rng) -> int:
+        """Roll one die, applying reroll, explode and clamp rules."""
+        face = rng.randint(1, self.sides)
+        if self._rerolls:
+            if self.reroll_once:
+                if self._rerolls(face):
+                    face = rng.randint(1, self.sides)
+            else:
+                while self._rerolls(face):
+                    face = rng.randint(1, self.sides)
+        if self._explodes:
+            value = face
+            for _ in range(MAX_EXPLOSIONS):
+                if not self._explodes(face):
+                    break
+                face = rng.randint(1, self.sides)
+                value += face
+            face = value
+        if self.minimum is not None and face < self.minimum:
+            face = self.minimum
+        if self.maximum is not None and face > self.maximum:
+            face = self.maximum
+        return face
+
+    def _kept_indices(self, faces):
+        if self.keep is None or self.keep >= len(faces):
+            return range(len(faces))
+        order = sorted(range(len(faces)), key=faces.__getitem__, reverse=self.keep_highest)
+        return sorted(order[:self.keep])
+
+    def evaluate(self, rng, kept, parts):
+        faces = [self.roll_die(rng) for _ in range(self.count)]
+        keep = set(self._kept_indices(faces))
+        shown = []
+        total = 0
+        for i, face in enumerate(faces):
+            if i in keep:
+                kept.append(face)
+                total += face
+                shown.append(str(face))
+            else:
+                shown.append(f"~~{face}~~")
+        parts.append(f"[{', '.join(shown)}]")
+        return total
+
+    def sample(self, n, rng):
+        if self.plain:
+            faces = rng.choices(range(1, self.sides + 1), k=n * self.count)
+            c = self.count
+            return [sum(faces[i * c:(i + 1) * c]) for i in range(n)]
+        results = []
+        for _ in range(n):
+            faces = [self.roll_die(rng) for _ in range(self.count)]
+            if self.keep is not None and self.keep < self.count:
+                faces.sort(reverse=self.keep_highest)
+                faces = faces[:self.keep]
+            results.append(sum(faces))
+        return results
+
+    def __str__(self):
+        text = f"{self.count}d{self.sides}"
+        if self.reroll:
+            op, value = self.reroll
+            text += f"{'ro' if self.reroll_once else 'r'}{'' if op == '=' else op}{value}"
+        if self.explode:
+            op, value = self.explode
+            text += '!' if (op, value) == ('>=', self.sides) else f"!{op}{value}"
+        if self.minimum is not None:
+            text += f"min{self.minimum}"
+        if self.maximum is not None:
+            text += f"max{self.maximum}"
+        if self.keep is not None:
+            text += f"{'kh' if self.keep_highest else 'kl'}{self.keep}"
+        return text
+
+
+class Neg:
+    __slots__ = ('operand',)
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def evaluate(self, rng, kept, parts):
+        parts.append('-')
+        return -self.operand.evaluate(rng, kept, parts)
+
+    def sample(self, n, rng):
+        return [-v for v in self.operand.sample(n, rng)]
+
+    def __str__(self):
+        return f"-{self.operand}"
+
+
+def _apply(op, a, b):
+    if op == '+':
+        return a + b
+    if op == '-':
+        return a - b
+    if op == '*':
+        return a * b
+    if b == 0:
+        raise ZeroDivisionError("Division by zero in dice expression")
+    return a // b
+
+
+class BinOp:
+    __slots__ = ('op', 'left', 'right')
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def _wrap(self, child, right):
+        """True if ``child`` needs parentheses when shown under this operator."""
+        if not isinstance(child, BinOp):
+            return False
+        if self.op in '*/':
+            return child.op in '+-' or right
+        return right and self.op == '-' and child.op in '+-'
+
+    def _evaluate_child(self, child, right, rng, kept, parts):
+        if not self._wrap(child, right):
+            return child.evaluate(rng, kept, parts)
+        parts.append('(')
+        value = child.evaluate(rng, kept, parts)
+        parts.append(')')
+        return value
+
+    def evaluate(self, rng, kept, parts):
+        a = self._evaluate_child(self.left, False, rng, kept, parts)
+        parts.append(f" {self.op} ")
+        b = self._evaluate_child(self.right, True, rng, kept, parts)
+        return _apply(self.op, a, b)
+
+    def sample(self, n, rng):
+        op = self.op
+        return [_apply(op, a, b) for a, b in zip(self.left.sample(n, rng), self.right.sample(n, rng))]
+
+    def __str__(self):
+        left = f"({self.left})" if self._wrap(self.left, False) else str(self.left)
+        right = f"({self.right})" if self._wrap(self.right, True) else str(self.right)
+        return f"{left}{self.op}{right}"
+
+
+# =============================================================================
+# PARSER
+# =============================================================================
+
+_TOKEN_RE = re.compile(r'\d*d(?:\d+|%)(?:[a-z!<>=]+\d*)*|\d+|[-+*/()]')
+_DICE_RE = re.compile(r'(\d*)d(\d+|%)(.*)')
+_MODIFIER_RE = re.compile(r'(kh|kl|k|dh|dl|ro|r|min|max|!)(<=|>=|<|>|=)?(\d*)')
+
+
+def _parse_dice(token: str) -> Dice:
+    match = _DICE_RE.fullmatch(token)
+    count = int(match.group(1)) if match.group(1) else 1
+    sides = 100 if match.group(2) == '%' else int(match.group(2))
+    if not 1 <= count <= MAX_DICE:
+        raise DiceSyntaxError(f"Dice count must be 1-{MAX_DICE}: {token}")
+    if not 1 <= sides <= MAX_SIDES:
+        raise DiceSyntaxError(f"Dice sides must be 1-{MAX_SIDES}: {token}")
+
+    options = {}
+    rest = match.group(3)
+    pos = 0
+    while pos < len(rest):
+        mod = _MODIFIER_RE.match(rest, pos)
+        if not mod or mod.end() == pos:
+            raise DiceSyntaxError(f"Unknown dice modifier '{rest[pos:]}' in {token}")
+        name, op, number = mod.group(1), mod.group(2), mod.group(3)
+        pos = mod.end()
+        value = int(number) if number else None
+        if name in ('kh', 'k', 'kl', 'dh', 'dl'):
+            if value is None or op:
+                raise DiceSyntaxError(f"'{name}' needs a number in {token}")
+            if name in ('dh', 'dl'):
+                options['keep'] = max(count - value, 0)
+                options['keep_highest'] = name == 'dl'
+            else:
+                options['keep'] = value
+                options['keep_highest'] = name != 'kl'
+        elif name == '!':
+            options['explode'] = (op or ('=' if value is not None else '>='), value if value is not None else sides)
+        elif name in ('r', 'ro'):
+            if value is None:
+                raise DiceSyntaxError(f"'{name}' needs a number in {token}")
+            options['reroll'] = (op or '=', value)
+            options['reroll_once'] = name == 'ro'
+        else:
+            if value is None or op:
+                raise DiceSyntaxError(f"'{name}' needs a number in {token}")
+            options['minimum' if name == 'min' else 'maximum'] = value
+
+    node = Dice(count, sides, **options)
+    faces = range(1, sides + 1)
+    if node._explodes and all(node._explodes(f) for f in faces):
+        raise DiceSyntaxError(f"Every face explodes in {token}")
+    if node._rerolls and not node.reroll_once and all(node._rerolls(f) for f in faces):
+        raise DiceSyntaxError(f"Every face is rerolled in {token}")
+    return node
+
+
+class _Parser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = []
+        pos = 0
+        for match in _TOKEN_RE.finditer(text):
+            if match.start() != pos:
+                break
+            self.tokens.append(match.group())
+            pos = match.end()
+        if pos != len(text) or not self.tokens:
+            raise DiceSyntaxError(f"Invalid dice format: {text}")
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        node = self.expr()
+        if self.peek() is not None:
+            raise DiceSyntaxError(f"Unexpected '{self.peek()}' in {self.text}")
+        return node
+
+    def expr(self):
+        node = self.term()
+        while self.peek() in ('+', '-'):
+            node = BinOp(self.take(), node, self.term())
+        return node
+
+    def term(self):
+        node = self.unary()
+        while self.peek() in ('*', '/'):
+            node = BinOp(self.take(), node, self.unary())
+        return node
+
+    def unary(self):
+        if self.peek() == '-':
+            self.take()
+            operand = self.unary()
+            if isinstance(operand, Const):
+                return Const(-operand.value)
+            return Neg(operand)
+        if self.peek() == '+':
+            self.take()
+            return self.unary()
+        return self.atom()
+
+    def atom(self):
+        token = self.take()
+        if token is None:
+            raise DiceSyntaxError(f"Unexpected end of {self.text}")
+        if token == '(':
+            node = self.expr()
+            if self.take() != ')':
+                raise DiceSyntaxError(f"Missing ')' in {self.text}")
+            return node
+        if token.isdigit():
+            return Const(int(token))
+        if 'd' in token:
+            return _parse_dice(token)
+        raise DiceSyntaxError(f"Unexpected '{token}' in {self.text}")
+
+
+# =============================================================================
+# COMPILED EXPRESSIONS
+# =============================================================================
+
+class DiceExpression:
+    """A compiled dice expression. Instances are shared via ``compile_dice``."""
+
+    __slots__ = ('source', 'root')
+
+    def __init__(self, source: str, root):
+        self.source = source
+        self.root = root
+
+    def roll(self, rng=None) -> RollResult:
+        """Roll once and return the total with a per-die breakdown."""
+        kept, parts = [], []
+        total = self.root.evaluate(rng or random, kept, parts)
+        return RollResult(total, kept, total - sum(kept), ''.join(parts))
+
+    def roll_many(self, n: int, rng=None) -> List[int]:
+        """Roll ``n`` times and return only the totals."""
+        if n <= 0:
+            return []
+        return self.root.sample(n, rng or random)
+
+    def simple(self) -> Optional[Tuple[int, int, int]]:
+        """``(num, sides, modifier)`` if this is a single plain NdM+/-K term, else None."""
+        root, modifier = self.root, 0
+        if isinstance(root, BinOp) and root.op in '+-' and isinstance(root.right, Const):
+            modifier = root.right.value if root.op == '+' else -root.right.value
+            root = root.left
+        if isinstance(root, Dice) and root.plain:
+            return root.count, root.sides, modifier
+        return None
+
+    def dice_terms(self) -> Optional[Tuple[List[Tuple[int, int]], int]]:
+        """
+        ``([(num, sides), ...], modifier)`` for sums of plain dice and constants
+        (e.g. '2d6+1d8+3'), or None when the expression uses anything else.
+        """
+        terms, modifier = [], 0
+
+        def walk(node, sign):
+            nonlocal modifier
+            if isinstance(node, Const):
+                modifier += sign * node.value
+                return True
+            if isinstance(node, Dice) and node.plain and sign > 0:
+                terms.append((node.count, node.sides))
+                return True
+            if isinstance(node, BinOp) and node.op in '+-':
+                return walk(node.left, sign) and walk(node.right, sign if node.op == '+' else -sign)
+            return False
+
+        return (terms, modifier) if walk(self.root, 1) else None
+
+    def __str__(self):
+        return str(self.root)
+
+    def __repr__(self):
+        return f"DiceExpression({self.source!r})"
+
+
+def normalize(expr: str) -> str:
+    return re.sub(r'\s+', '', str(expr)).lower()
+
+
+@lru_cache(maxsize=1024)
+def _compile(text: str) -> DiceExpression:
+    return DiceExpression(text, _Parser(text).parse())
+
+
+def compile_dice(expr: str) -> DiceExpression:
+    """Compile (or fetch from cache) a dice expression. Raises DiceSyntaxError."""
+    return _compile(normalize(expr))
+
+
+def roll_expression(expr: str, rng=None) -> RollResult:
+    """Compile and roll ``expr`` once."""
+    return compile_dice(expr).roll(rng)
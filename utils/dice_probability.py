@@ -0,0 +1,442 @@
+"""
+Dice Probability
+Exact probability distributions for dice rolls, so odds can be shown without
+sampling.
+
+A ``Distribution`` is a probability mass function over consecutive integer
+totals. Sums of dice are built by convolution and every building block is
+memoised, so asking for "2d6+3 vs DC 12" or "+5 to hit AC 15 for 1d8+3" after
+the first call is a cache lookup plus a short sum.
+"""
+
+from functools import lru_cache
+from math import comb
+from typing import Dict
+
+
+class Distribution:
+    """Probability mass function over the integers ``offset .. offset+len(probs)-1``."""
+
+    __slots__ = ('offset', 'probs', '_cdf')
+
+    def __init__(self, offset: int, probs):
+        self.offset = offset
+        self.probs = tuple(probs)
+        self._cdf = None
+
+    @classmethod
+    def constant(cls, value: int) -> 'Distribution':
+        return cls(value, (1.0,))
+
+    @property
+    def min(self) -> int:
+        return self.offset
+
+    @property
+    def max(self) -> int:
+        return self.offset + len(self.probs) - 1
+
+    def items(self):
+        """Yield (total, probability) pairs."""
+        for i, p in enumerate(self.probs):
+            if p:
+                yield self.offset + i, p
+
+    def as_dict(self) -> Dict[int, float]:
+        return dict(self.items())
+
+    def mean(self) -> float:
+        return sum(v * p for v, p in self.items())
+
+    def _cumulative(self):
+        if self._cdf is None:
+            total = 0.0
+            cdf = []
+            for p in self.probs:
+                total += p
+                cdf.append(total)
+            self._cdf = cdf
+        return self._cdf
+
+    def prob_at_most(self, value: int) -> float:
+        """P(total <= value)."""
+        if value < self.min:
+            return 0.0
+        if value >= self.max:
+            return 1.0
+        return min(1.0, self._cumulative()[value - self.offset])
+
+    def prob_at_least(self, value: int) -> float:
+        """P(total >= value)."""
+        return max(0.0, 1.0 - self.prob_at_most(value - 1))
+
+    def prob_equal(self, value: int) -> float:
+        if self.min <= value <= self.max:
+            return self.probs[value - self.offset]
+        return 0.0
+
+    def percentile(self, q: float) -> int:
+        """Smallest total t with P(total <= t) >= q (q between 0 and 1)."""
+        cdf = self._cumulative()
+        for i, c in enumerate(cdf):
+            if c >= q - 1e-12:
+                return self.offset + i
+        return self.max
+
+    def shift(self, amount: int) -> 'Distribution':
+        return Distribution(self.offset + amount, self.probs)
+
+    def __add__(self, other):
+        if isinstance(other, int):
+            return self.shift(other)
+        return convolve(self, other)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, int):
+            return self.shift(-other)
+        return convolve(self, other.negate())
+
+    def negate(self) -> 'Distribution':
+        return Distribution(-self.max, reversed(self.probs))
+
+    def map(self, fn) -> 'Distribution':
+        """Distribution of fn(total) for an integer-valued fn."""
+        out = {}
+        for v, p in self.items():
+            key = fn(v)
+            out[key] = out.get(key, 0.0) + p
+        return from_dict(out)
+
+    def __repr__(self):
+        return f"Distribution(min={self.min}, max={self.max}, mean={self.mean():.3f})"
+
+
+def from_dict(pmf: Dict[int, float]) -> Distribution:
+    """Build a Distribution from {total: probability}."""
+    if not pmf:
+        return Distribution.constant(0)
+    lo, hi = min(pmf), max(pmf)
+    return Distribution(lo, [pmf.get(v, 0.0) for v in range(lo, hi + 1)])
+
+
+def mixture(parts) -> Distribution:
+    """Distribution that takes each of ``parts`` ((Distribution, weight) pairs) with its weight."""
+    out = {}
+    for dist, weight in parts:
+        if weight <= 0:
+            continue
+        for v, p in dist.items():
+            out[v] = out.get(v, 0.0) + p * weight
+    return from_dict(out)
+
+
+def convolve(a: Distribution, b: Distribution) -> Distribution:
+    """Distribution of the sum of two independent totals."""
+    if len(a.probs) < len(b.probs):
+        a, b = b, a
+    out = [0.0] * (len(a.probs) + len(b.probs) - 1)
+    for j, pb in enumerate(b.probs):
+        if pb:
+            for i, pa in enumerate(a.probs):
+                out[i + j] += pa * pb
+    return Distribution(a.offset + b.offset, out)
+
+
+# =============================================================================
+# DICE BUILDING BLOCKS
+# =============================================================================
+
+@lru_cache(maxsize=None)
+def die(sides: int) -> Distribution:
+    """A single fair die."""
+    if sides < 1:
+        raise ValueError(f"Invalid die: d{sides}")
+    return Distribution(1, [1.0 / sides] * sides)
+
+
+@lru_cache(maxsize=1024)
+def dice(num: int, sides: int) -> Distribution:
+    """Sum of ``num`` dice with ``sides`` faces."""
+    if num == 1:
+        return die(sides)
+    return repeat(die(sides), num)
+
+
+def _keep_highest(face: Distribution, num: int, keep: int) -> Distribution:
+    """
+    Sum of the ``keep`` highest of ``num`` independent dice that each follow
+    ``face``. Works down from the top face: choose how many dice show it, keep
+    as many as still needed, and recurse on the rest (which are all lower).
+    """
+    values = [v for v, _ in face.items()]
+    probs = [p for _, p in face.items()]
+    cumulative = []
+    running = 0.0
+    for p in probs:
+        running += p
+        cumulative.append(running)
+    memo = {}
+
+    def rec(index, remaining, needed):
+        if needed == 0 or remaining == 0:
+            return {0: 1.0}
+        if index == 0:
+            return {min(needed, remaining) * values[0]: 1.0}
+        key = (index, remaining, needed)
+        if key in memo:
+            return memo[key]
+        p_top = probs[index] / cumulative[index] if cumulative[index] else 0.0
+        out = {}
+        for count in range(remaining + 1):
+            p = comb(remaining, count) * p_top ** count * (1 - p_top) ** (remaining - count)
+            if not p:
+                continue
+            kept = min(count, needed)
+            for total, q in rec(index - 1, remaining - count, needed - kept).items():
+                t = total + kept * values[index]
+                out[t] = out.get(t, 0.0) + p * q
+        memo[key] = out
+        return out
+
+    return from_dict(rec(len(values) - 1, num, keep))
+
+
+def keep_faces(face: Distribution, num: int, keep: int, highest: bool = True) -> Distribution:
+    """Sum of the ``keep`` highest (or lowest) of ``num`` dice distributed like ``face``."""
+    keep = max(0, min(keep, num))
+    if keep == num:
+        return repeat(face, num)
+    if highest:
+        return _keep_highest(face, num, keep)
+    # Lowest k of X is minus the highest k of -X
+    return _keep_highest(face.negate(), num, keep).negate()
+
+
+@lru_cache(maxsize=1024)
+def keep_dice(num: int, sides: int, keep: int, highest: bool = True) -> Distribution:
+    """Sum of the ``keep`` highest (or lowest) of ``num`` dice with ``sides`` faces."""
+    return keep_faces(die(sides), num, keep, highest)
+
+
+def repeat(face: Distribution, num: int) -> Distribution:
+    """Sum of ``num`` independent copies of ``face``."""
+    if num <= 0:
+        return Distribution.constant(0)
+    if num == 1:
+        return face
+    half = repeat(face, num // 2)
+    result = convolve(half, half)
+    if num % 2:
+        result = convolve(result, face)
+    return result
+
+
+# =============================================================================
+# EXPRESSIONS
+# =============================================================================
+
+EXPLODE_DEPTH = 8       # explosion chains longer than this are treated as stopping
+MAX_PRODUCT_SUPPORT = 250000
+MAX_SUPPORT = 1000      # outcomes one dice term may have (exact sums cost ~support^2)
+MAX_KEEP_WORK = 30000   # dice x kept x faces for keep/drop terms
+
+
+@lru_cache(maxsize=1024)
+def _face(sides, explode, reroll, reroll_once, minimum, maximum) -> Distribution:
+    """Distribution of one die after reroll, explode and clamp rules."""
+    from utils.dice_expression import _compare
+    base = die(sides)
+    if reroll:
+        rerolls = _compare(*reroll)
+        p_reroll = sum(p for v, p in base.items() if rerolls(v))
+        if reroll_once:
+            base = from_dict({v: (0.0 if rerolls(v) else p) + p_reroll * p for v, p in base.items()})
+        else:
+            base = from_dict({v: p / (1 - p_reroll) for v, p in base.items() if not rerolls(v)})
+    if explode:
+        explodes = _compare(*explode)
+        stop = base
+        for _ in range(EXPLODE_DEPTH):
+            out = {}
+            for v, p in base.items():
+                if explodes(v):
+                    for w, q in stop.items():
+                        out[v + w] = out.get(v + w, 0.0) + p * q
+                else:
+                    out[v] = out.get(v, 0.0) + p
+            stop = from_dict(out)
+        base = stop
+    if minimum is not None or maximum is not None:
+        lo = minimum if minimum is not None else float('-inf')
+        hi = maximum if maximum is not None else float('inf')
+        base = base.map(lambda v: int(min(max(v, lo), hi)))
+    return base
+
+
+def _check_size(count: int, faces: int):
+    """Refuse dice terms whose exact distribution would take too long to build."""
+    if count * (faces - 1) + 1 > MAX_SUPPORT:
+        raise ValueError("Dice expression too large to analyse exactly")
+
+
+def node_distribution(node) -> Distribution:
+    """Exact distribution of a compiled dice expression node."""
+    from utils.dice_expression import Const, Dice, Neg, BinOp
+    if isinstance(node, Const):
+        return Distribution.constant(node.value)
+    if isinstance(node, Dice):
+        if node.plain:
+            _check_size(node.count, node.sides)
+            return dice(node.count, node.sides)
+        face = _face(node.sides, node.explode, node.reroll, node.reroll_once, node.minimum, node.maximum)
+        if node.keep is not None:
+            _check_size(min(node.keep, node.count), len(face.probs))
+            if node.count * node.keep * len(face.probs) > MAX_KEEP_WORK:
+                raise ValueError("Dice expression too large to analyse exactly")
+            return keep_faces(face, node.count, node.keep, node.keep_highest)
+        _check_size(node.count, len(face.probs))
+        return repeat(face, node.count)
+    if isinstance(node, Neg):
+        return node_distribution(node.operand).negate()
+    if isinstance(node, BinOp):
+        left, right = node_distribution(node.left), node_distribution(node.right)
+        if node.op in '+-' and len(left.probs) * len(right.probs) > MAX_SUPPORT ** 2:
+            raise ValueError("Dice expression too large to analyse exactly")
+        if node.op == '+':
+            return left + right
+        if node.op == '-':
+            return left - right
+        if len(left.probs) * len(right.probs) > MAX_PRODUCT_SUPPORT:
+            raise ValueError("Dice expression too large to analyse exactly")
+        out = {}
+        for a, p in left.items():
+            for b, q in right.items():
+                if node.op == '/' and b == 0:
+                    raise ValueError("Division by zero in dice expression")
+                v = a * b if node.op == '*' else a // b
+                out[v] = out.get(v, 0.0) + p * q
+        return from_dict(out)
+    raise TypeError(f"Unknown dice node: {node!r}")
+
+
+def _advantage_node(root, highest):
+    """Turn a single NdM (+/-K) roll into its roll-twice-keep-one version."""
+    from utils.dice_expression import BinOp, Const, Dice
+    if isinstance(root, Dice) and root.plain:
+        return Dice(root.count * 2, root.sides, keep=root.count, keep_highest=highest)
+    if isinstance(root, BinOp) and root.op in '+-' and isinstance(root.right, Const):
+        return BinOp(root.op, _advantage_node(root.left, highest), root.right)
+    return root
+
+
+@lru_cache(maxsize=1024)
+def distribution(dice_str: str, advantage: bool = False, disadvantage: bool = False) -> Distribution:
+    """
+    Exact distribution of any dice expression ('2d6+3', '4d6kh3', '1d6!+1d4').
+    Advantage/disadvantage turn a single NdM+/-K roll into "roll twice, keep one".
+    """
+    from utils.dice_expression import compile_dice
+    root = compile_dice(dice_str).root
+    if advantage != disadvantage:
+        root = _advantage_node(root, advantage)
+    return node_distribution(root)
+
+
+# =============================================================================
+# ODDS
+# =============================================================================
+
+def d20(advantage: bool = False, disadvantage: bool = False) -> Distribution:
+    """The natural d20 roll, with advantage/disadvantage cancelling out."""
+    if advantage and not disadvantage:
+        return keep_dice(2, 20, 1, True)
+    if disadvantage and not advantage:
+        return keep_dice(2, 20, 1, False)
+    return die(20)
+
+
+def check_odds(modifier: int, dc: int, advantage: bool = False, disadvantage: bool = False,
+               natural_rules: bool = True) -> float:
+    """
+    Probability that d20 + modifier meets ``dc``. With ``natural_rules`` a natural
+    20 always succeeds and a natural 1 always fails, as the /roll command rules it.
+    """
+    roll = d20(advantage, disadvantage)
+    if not natural_rules:
+        return roll.shift(modifier).prob_at_least(dc)
+    need = min(max(dc - modifier, 2), 20)
+    return roll.prob_at_least(need)
+
+
+def _double_dice(node):
+    """Copy of an expression tree with every dice term rolling twice as many dice."""
+    from utils.dice_expression import Dice, Neg, BinOp
+    if isinstance(node, Dice):
+        return node.with_count(node.count * 2)
+    if isinstance(node, Neg):
+        return Neg(_double_dice(node.operand))
+    if isinstance(node, BinOp):
+        return BinOp(node.op, _double_dice(node.left), _double_dice(node.right))
+    return node
+
+
+def _damage_on_hit(damage_dice: str, crit: bool, double_modifier: bool) -> Distribution:
+    """Damage dealt by one hit, never below zero."""
+    from utils.dice_expression import compile_dice
+    root = compile_dice(damage_dice).root
+    if not crit:
+        base = node_distribution(root)
+    elif double_modifier:
+        base = node_distribution(root).map(lambda v: 2 * v)
+    else:
+        base = node_distribution(_double_dice(root))
+    return base.map(lambda v: max(v, 0))
+
+
+@lru_cache(maxsize=4096)
+def _attack_distribution(attack_bonus, ac, damage_dice, advantage, disadvantage, double_modifier):
+    roll = d20(advantage, disadvantage)
+    p_crit = roll.prob_equal(20)
+    p_hit = roll.prob_at_least(min(max(ac - attack_bonus, 2), 20))
+    damage = mixture([
+        (Distribution.constant(0), 1.0 - p_hit),
+        (_damage_on_hit(damage_dice, False, double_modifier), p_hit - p_crit),
+        (_damage_on_hit(damage_dice, True, double_modifier), p_crit),
+    ])
+    return p_hit, p_crit, damage
+
+
+def attack_odds(attack_bonus: int, ac: int, damage_dice: str,
+                advantage: bool = False, disadvantage: bool = False,
+                double_modifier: bool = False) -> Dict:
+    """
+    Exact odds for one attack roll against ``ac``.
+
+    A natural 20 always hits and crits, a natural 1 always misses. Crits roll
+    the damage dice twice; with ``double_modifier`` the whole damage roll is
+    doubled instead, matching combat_manager.attack.
+
+    Returns hit, crit, expected_damage and the full damage Distribution
+    (misses count as 0).
+    """
+    p_hit, p_crit, damage = _attack_distribution(
+        attack_bonus, ac, damage_dice.replace(' ', '').lower(),
+        bool(advantage), bool(disadvantage), bool(double_modifier)
+    )
+    return {
+        'hit': p_hit,
+        'crit': p_crit,
+        'expected_damage': damage.mean(),
+        'damage': damage,
+    }
+
+
+def format_percent(p: float) -> str:
+    """Format a probability for display ('55%', '<1%', '>99%')."""
+    if 0 < p < 0.005:
+        return "<1%"
+    if 0.995 < p < 1:
+        return ">99%"
+    return f"{p * 100:.0f}%"
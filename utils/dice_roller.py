@@ -1,5 +1,6 @@
 import re
-import random
+
+from utils.dice_expression import compile_dice, DiceSyntaxError
 
 def parse_dice(dice_str):
     """
@@ -18,25 +19,47 @@ def parse_dice(dice_str):
         return 1, int(dice_str), 0
     raise ValueError(f"Invalid dice format: {dice_str}")
 
-def roll_dice(dice_str):
-    num, sides, modifier = parse_dice(dice_str)
-    rolls = [random.randint(1, sides) for _ in range(num)]
-    total = sum(rolls) + modifier
-    return total, rolls, modifier
+def _expression(dice_str):
+    text = str(dice_str).replace(' ', '')
+    # A bare number is shorthand for a single die ('6' -> 1d6)
+    return compile_dice(f"1d{text}" if text.isdigit() else text)
+
+
+def roll_dice(dice_str, channel_id=None):
+    """
+    Roll any dice expression ('2d6+3', '4d6kh3', '1d8+1d6+2', ...).
+    With ``channel_id`` the roll comes from that channel's seeded stream.
+    Returns (total, kept die faces, flat modifier).
+    """
+    expression = _expression(dice_str)
+    if channel_id is None:
+        result = expression.roll()
+    else:
+        from utils.dice_service import roll
+        result = roll(str(expression), channel_id)
+    return result.total, result.rolls, result.modifier
+
+
+def roll_many(dice_str, n, channel_id=None):
+    """Roll ``dice_str`` ``n`` times in one batch and return the list of totals."""
+    from utils.dice_service import get_block_rng
+    return _expression(dice_str).roll_many(n, get_block_rng(channel_id, max(n, 16), 'roll_many'))
 
-def roll_check(dice_str, user_id=None, stat=None, advantage=False, disadvantage=False, proficiency=False):
+def roll_check(dice_str, user_id=None, stat=None, advantage=False, disadvantage=False, proficiency=False,
+               channel_id=None):
     from utils.character_manager import load_character
+    from utils.dice_service import roll_bulk
     num, sides, modifier = parse_dice(dice_str)
     rolls = []
     if advantage or disadvantage:
-        roll1 = [random.randint(1, sides) for _ in range(num)]
-        roll2 = [random.randint(1, sides) for _ in range(num)]
+        raw = roll_bulk(sides, num * 2, channel_id, label='check')
+        roll1, roll2 = raw[:num], raw[num:]
         if advantage:
             rolls = [max(a, b) for a, b in zip(roll1, roll2)]
         else:
             rolls = [min(a, b) for a, b in zip(roll1, roll2)]
     else:
-        rolls = [random.randint(1, sides) for _ in range(num)]
+        rolls = roll_bulk(sides, num, channel_id, label='check')
     total = sum(rolls) + modifier
     if user_id and stat:
         char = load_character(user_id)
@@ -54,16 +77,15 @@ def get_modifier_string(stat_value):
     return f"+{mod}" if mod >= 0 else str(mod)
 
 
-INLINE_ROLL_RE = re.compile(r'\[(\d*d\d+(?:[+-]\d+)?)\]')
+INLINE_ROLL_RE = re.compile(r'\[([^\[\]]*\d*d[\d%][^\[\]]*)\]', re.IGNORECASE)
 
 
 def extract_inline_rolls(text: str):
-    """Return a dict of inline dice notation to results."""
+    """Return a dict of inline dice notation (e.g. [1d20+5], [4d6kh3]) to results."""
     rolls = {}
     for notation in INLINE_ROLL_RE.findall(text):
         try:
-            total, _rolls, _ = roll_dice(notation)
-            rolls[notation] = total
-        except Exception:
+            rolls[notation] = compile_dice(notation).roll().total
+        except (DiceSyntaxError, ZeroDivisionError):
             continue
     return rolls
@@ -0,0 +1,307 @@
+"""
+Dice Service
+Seeded, per-channel random number streams and bulk dice rolling.
+
+Every channel gets a ``DiceStream``: a base seed plus a counter. Each roll
+request takes the next counter value and derives its own generator from
+``(seed, counter)``, so any roll can be reproduced later from the two numbers
+stored in the channel state (``state['rng']``) without replaying the rest of
+the session. A short audit trail of recent requests is kept alongside.
+
+Counter values are reserved in blocks of RESERVE_BLOCK: before the counter
+passes the saved ``reserved`` mark, the new mark is written to the channel
+state (when the channel has one). A stream resumed after a crash starts from that mark, so it never hands
+out a ``(seed, counter)`` pair that may already have been rolled.
+
+Bulk helpers draw whole batches in one NumPy call (initiative for a horde,
+saving throws for every creature in an area, treasure hoards) and fall back
+to the standard ``random`` module when NumPy isn't installed.
+"""
+
+import atexit
+import hashlib
+import os
+import random
+import secrets
+from collections import deque
+from threading import Lock
+from typing import Dict, List, Optional, Sequence
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from utils.dice_expression import compile_dice, RollResult
+
+AUDIT_LENGTH = 50
+RESERVE_BLOCK = 64   # counter values reserved per state write
+
+_streams = {}       # channel_id -> DiceStream
+_streams_lock = Lock()
+
+
+class BlockRandom:
+    """
+    ``random.Random``-compatible source that serves values from a block of
+    uniforms drawn in one NumPy call, drawing another block when it runs out.
+    """
+
+    __slots__ = ('_generator', '_block', '_pos', '_size')
+
+    def __init__(self, generator, size=256):
+        self._generator = generator
+        self._size = max(1, size)
+        self._block = generator.random(self._size)
+        self._pos = 0
+
+    def random(self) -> float:
+        if self._pos >= len(self._block):
+            self._block = self._generator.random(self._size)
+            self._pos = 0
+        value = self._block[self._pos]
+        self._pos += 1
+        return float(value)
+
+    def randint(self, a: int, b: int) -> int:
+        return a + int(self.random() * (b - a + 1))
+
+    def choice(self, seq):
+        if not seq:
+            raise IndexError("Cannot choose from an empty sequence")
+        return seq[int(self.random() * len(seq))]
+
+    def choices(self, population, k=1):
+        n = len(population)
+        picks = (self._generator.random(k) * n).astype(int)
+        return [population[i] for i in picks]
+
+
+class DiceStream:
+    """Seed + counter for one channel, with a bounded log of recent requests."""
+
+    __slots__ = ('seed', 'counter', 'reserved', 'log', 'dirty', 'channel_id')
+
+    def __init__(self, seed: Optional[int] = None, counter: int = 0, log=None,
+                 reserved: int = 0, channel_id=None):
+        self.seed = seed if seed is not None else secrets.randbits(63)
+        self.counter = counter
+        self.reserved = max(reserved, counter)
+        self.log = deque(log or [], maxlen=AUDIT_LENGTH)
+        self.dirty = False
+        self.channel_id = channel_id
+
+    @classmethod
+    def from_dict(cls, data: Dict, channel_id=None) -> 'DiceStream':
+        """
+        Resume a saved stream. The counter restarts at the saved reservation,
+        since any value up to it may have been used after the last full save
+        (older saves without one skip ahead a whole block instead).
+        """
+        counter = data.get('counter', 0)
+        reserved = data.get('reserved', counter + RESERVE_BLOCK)
+        return cls(data.get('seed'), reserved, data.get('log'), reserved, channel_id)
+
+    def to_dict(self) -> Dict:
+        return {'seed': self.seed, 'counter': self.counter, 'reserved': self.reserved,
+                'log': list(self.log)}
+
+    def _next(self, label: str, **details) -> int:
+        if self.counter >= self.reserved:
+            self.reserved = self.counter + RESERVE_BLOCK
+            if self.channel_id is not None:
+                _persist(self.channel_id)
+        self.counter += 1
+        self.log.append({'n': self.counter, 'label': label, **details})
+        self.dirty = True
+        return self.counter
+
+    @property
+    def commitment(self) -> str:
+        """
+        SHA-256 of the seed, safe to show while the stream is live (the seed
+        itself would let anyone predict every later roll). Once the stream is
+        replaced, revealing the seed lets players check it against this.
+        """
+        return hashlib.sha256(str(self.seed).encode()).hexdigest()[:16]
+
+    def rng_at(self, n: int) -> random.Random:
+        """The Python generator used for request ``n`` (for replaying a roll)."""
+        return random.Random(f"{self.seed}:{n}")
+
+    def numpy_at(self, n: int):
+        """The NumPy generator used for request ``n``."""
+        return np.random.default_rng([self.seed, n])
+
+    def rng(self, label: str = 'roll', **details) -> random.Random:
+        return self.rng_at(self._next(label, **details))
+
+    def numpy(self, label: str = 'bulk', **details):
+        """Next NumPy generator, or None when NumPy isn't installed."""
+        if not NUMPY_AVAILABLE:
+            return None
+        return self.numpy_at(self._next(label, **details))
+
+    def block(self, size: int = 256, label: str = 'block'):
+        """A BlockRandom over one NumPy draw (a plain Random without NumPy)."""
+        if not NUMPY_AVAILABLE:
+            return self.rng(label)
+        return BlockRandom(self.numpy(label), size)
+
+
+# =============================================================================
+# STREAM REGISTRY
+# =============================================================================
+
+def get_stream(channel_id) -> DiceStream:
+    """Return the stream for a channel, resuming from its saved state if any."""
+    channel_id = str(channel_id)
+    with _streams_lock:
+        stream = _streams.get(channel_id)
+        if stream is None:
+            from utils.state_manager import load_state
+            saved = load_state(channel_id).get('rng')
+            if saved:
+                stream = DiceStream.from_dict(saved, channel_id)
+            else:
+                stream = DiceStream(channel_id=channel_id)
+            stream.dirty = not saved
+            _streams[channel_id] = stream
+        return stream
+
+
+def reseed(channel_id, seed: Optional[int] = None) -> DiceStream:
+    """Start a fresh stream for a channel (random seed unless one is given)."""
+    stream = DiceStream(seed, channel_id=str(channel_id))
+    stream.dirty = True
+    with _streams_lock:
+        _streams[str(channel_id)] = stream
+    return stream
+
+
+def get_rng(channel_id=None, label: str = 'roll', **details):
+    """A generator for one roll: the channel's next stream value, or the global ``random``."""
+    if channel_id is None:
+        return random
+    return get_stream(channel_id).rng(label, **details)
+
+
+def get_block_rng(channel_id=None, size: int = 256, label: str = 'block'):
+    """A bulk-drawn generator for a burst of related rolls (loot, AoE)."""
+    if channel_id is None:
+        if NUMPY_AVAILABLE:
+            return BlockRandom(np.random.default_rng(), size)
+        return random
+    return get_stream(channel_id).block(size, label)
+
+
+def stream_state(channel_id) -> Optional[Dict]:
+    """Serializable stream info for a channel if one is active (marks it clean)."""
+    with _streams_lock:
+        stream = _streams.get(str(channel_id))
+        if stream is None:
+            return None
+        stream.dirty = False
+        return stream.to_dict()
+
+
+def _persist(channel_id):
+    """
+    Write a channel's stream position into its saved state. Channels without
+    a state file (no campaign) are skipped rather than given one full of
+    defaults; their stream gets a fresh seed on restart, so nothing repeats.
+    """
+    from utils.state_manager import _get_state_path, load_state, save_state
+    if not os.path.exists(_get_state_path(channel_id)):
+        return
+    try:
+        save_state(channel_id, load_state(channel_id))
+    except Exception:
+        pass
+
+
+def flush_streams():
+    """Write every stream that moved since its last save into its channel state."""
+    with _streams_lock:
+        dirty = [cid for cid, s in _streams.items() if s.dirty]
+    for channel_id in dirty:
+        _persist(channel_id)
+
+
+atexit.register(flush_streams)
+
+
+# =============================================================================
+# ROLLING
+# =============================================================================
+
+def roll(expr: str, channel_id=None, label: str = 'roll') -> RollResult:
+    """Roll a dice expression on the channel's stream and record the total."""
+    compiled = compile_dice(expr)
+    if channel_id is None:
+        return compiled.roll()
+    stream = get_stream(channel_id)
+    n = stream._next(label, expr=str(compiled))
+    result = compiled.roll(stream.rng_at(n))
+    stream.log[-1]['total'] = result.total
+    return result
+
+
+def replay(channel_id, n: int, expr: str) -> RollResult:
+    """Re-roll request ``n`` of a channel's stream, e.g. to audit a disputed roll."""
+    return compile_dice(expr).roll(get_stream(channel_id).rng_at(n))
+
+
+def roll_many(expr: str, n: int, channel_id=None, label: str = 'roll_many') -> List[int]:
+    """Totals of ``n`` independent rolls of ``expr`` drawn as one batch."""
+    return compile_dice(expr).roll_many(n, get_block_rng(channel_id, max(n, 16), label))
+
+
+def roll_bulk(sides: int, count: int, channel_id=None, label: str = 'bulk') -> List[int]:
+    """``count`` dice with ``sides`` faces in a single draw."""
+    if count <= 0:
+        return []
+    if NUMPY_AVAILABLE:
+        gen = get_stream(channel_id).numpy(label, dice=f"{count}d{sides}") if channel_id is not None \
+            else np.random.default_rng()
+        return gen.integers(1, sides + 1, size=count).tolist()
+    rng = get_rng(channel_id, label, dice=f"{count}d{sides}")
+    return [rng.randint(1, sides) for _ in range(count)]
+
+
+def roll_d20s(count: int, channel_id=None, advantage: bool = False, disadvantage: bool = False,
+              label: str = 'd20') -> List[int]:
+    """Natural d20 results for ``count`` rolls, with advantage/disadvantage cancelling out."""
+    if advantage == disadvantage:
+        return roll_bulk(20, count, channel_id, label)
+    raw = roll_bulk(20, count * 2, channel_id, label)
+    pick = max if advantage else min
+    return [pick(raw[i], raw[i + count]) for i in range(count)]
+
+
+def roll_initiative_bulk(bonuses: Sequence[int], channel_id=None) -> List[Dict]:
+    """Roll initiative for every combatant at once: ``[{'roll', 'total'}]``."""
+    rolls = roll_d20s(len(bonuses), channel_id, label='initiative')
+    return [{'roll': r, 'total': r + b} for r, b in zip(rolls, bonuses)]
+
+
+def roll_saves(bonuses: Sequence[int], dc: int, channel_id=None,
+               advantage: Optional[Sequence[bool]] = None,
+               disadvantage: Optional[Sequence[bool]] = None) -> List[Dict]:
+    """
+    Saving throws for a group of creatures against one DC in a single draw.
+    ``advantage``/``disadvantage`` are optional per-creature flags.
+    Returns ``[{'roll', 'total', 'success'}]`` in the order of ``bonuses``.
+    """
+    n = len(bonuses)
+    raw = roll_bulk(20, n * 2, channel_id, label='saves')
+    results = []
+    for i, bonus in enumerate(bonuses):
+        first, second = raw[i], raw[i + n]
+        adv = bool(advantage[i]) if advantage else False
+        dis = bool(disadvantage[i]) if disadvantage else False
+        natural = max(first, second) if adv and not dis else min(first, second) if dis and not adv else first
+        total = natural + bonus
+        results.append({'roll': natural, 'total': total, 'success': total >= dc})
+    return results
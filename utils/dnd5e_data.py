@@ -835,6 +835,28 @@ def get_spell(spell_name: str) -> dict:
     return SPELLS.get(spell_name, None)
 
 
+# Saving-throw damage spells: save ability, base damage, extra dice per slot
+# level above the spell's level, and the area template (size in feet)
+AOE_SPELLS = {
+    "Burning Hands": {"save": "DEX", "damage": "3d6", "damage_type": "fire", "half_on_save": True, "upcast": "1d6", "shape": "cone", "size": 15},
+    "Thunderwave": {"save": "CON", "damage": "2d8", "damage_type": "thunder", "half_on_save": True, "upcast": "1d8", "shape": "cube", "size": 15},
+    "Flaming Sphere": {"save": "DEX", "damage": "2d6", "damage_type": "fire", "half_on_save": True, "upcast": "1d6", "shape": "sphere", "size": 5},
+    "Shatter": {"save": "CON", "damage": "3d8", "damage_type": "thunder", "half_on_save": True, "upcast": "1d8", "shape": "sphere", "size": 10},
+    "Fireball": {"save": "DEX", "damage": "8d6", "damage_type": "fire", "half_on_save": True, "upcast": "1d6", "shape": "sphere", "size": 20},
+    "Lightning Bolt": {"save": "DEX", "damage": "8d6", "damage_type": "lightning", "half_on_save": True, "upcast": "1d6", "shape": "line", "size": 100},
+    "Spirit Guardians": {"save": "WIS", "damage": "3d8", "damage_type": "radiant", "half_on_save": True, "upcast": "1d8", "shape": "emanation", "size": 15},
+    "Cone of Cold": {"save": "CON", "damage": "8d8", "damage_type": "cold", "half_on_save": True, "upcast": "1d8", "shape": "cone", "size": 60},
+}
+
+
+def get_aoe_spell(spell_name: str) -> dict:
+    """Get saving-throw/area data for a damage spell (case-insensitive), with its level."""
+    for name, data in AOE_SPELLS.items():
+        if name.lower() == spell_name.lower():
+            return {"name": name, "level": SPELLS.get(name, {}).get("level", 0), **data}
+    return None
+
+
 def get_cantrips_for_class(class_name: str) -> list:
     """Get all cantrips available to a class."""
     return [name for name, data in SPELLS.items() 
@@ -0,0 +1,404 @@
+"""
+Encounter Simulator
+Monte Carlo estimate of how a fight between the party and a group of monsters
+is likely to go: win probability, expected length and expected HP loss.
+
+Thousands of encounters are run side by side with NumPy arrays (one row per
+simulated fight), so each attack in a round is a single batched dice draw.
+Without NumPy a plain Python loop runs the same model, only slower.
+
+The model is deliberately simple: both sides focus fire on the first standing
+enemy, every combatant uses its best attack each round, downed characters roll
+death saves, and the fight ends when one side is down or MAX_ROUNDS passes.
+"""
+
+import re
+import time
+import random
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from utils.dice_expression import compile_dice
+
+try:
+    from utils.dnd5e_data import MONSTERS, get_weapon
+    DND_DATA_AVAILABLE = True
+except ImportError:
+    DND_DATA_AVAILABLE = False
+
+MAX_ROUNDS = 20
+DEFAULT_SIMULATIONS = 10000
+
+# Dice expression at the start of a damage string such as '1d8+1d6+2 fire'
+_DAMAGE_EXPR_RE = re.compile(r'[\dd+\s-]*\dd\d+(?:\s*[+-]\s*\d+(?!\s*d))*')
+_COUNT_WORDS = {'two': 2, 'three': 3, 'four': 4, 'five': 5}
+_EXTRA_ATTACK_CLASSES = {'Barbarian', 'Fighter', 'Monk', 'Paladin', 'Ranger'}
+
+
+# =============================================================================
+# COMBATANT PROFILES
+# =============================================================================
+
+def _dice_profile(damage):
+    """Turn '2d6+4' (optionally followed by text) into ([(num, sides)], modifier)."""
+    terms = []
+    modifier = 0
+    for part in _DAMAGE_EXPR_RE.findall(damage or ''):
+        profile = compile_dice(part.strip(' +-')).dice_terms()
+        if profile:
+            terms += profile[0]
+            modifier += profile[1]
+    if not terms:
+        # Flat damage such as "1"
+        match = re.match(r'\s*(\d+)', damage or '')
+        modifier = int(match.group(1)) if match else 1
+    return terms, modifier
+
+
+def _average(terms, modifier):
+    return sum(n * (s + 1) / 2 for n, s in terms) + modifier
+
+
+def _find_monster(name):
+    if not DND_DATA_AVAILABLE:
+        return None
+    if name in MONSTERS:
+        return MONSTERS[name]
+    lowered = name.lower()
+    return next((m for key, m in MONSTERS.items() if key.lower() == lowered), None)
+
+
+def monster_profile(name: str) -> Optional[Dict]:
+    """Build a simulator profile from a MONSTERS statblock, or None if unknown."""
+    monster = _find_monster(name)
+    if not monster:
+        return None
+
+    best = None
+    attacks = 1
+    for action in monster.get('actions', []):
+        if action.get('name') == 'Multiattack':
+            words = action.get('description', '').lower().split()
+            if words:
+                attacks = _COUNT_WORDS.get(words[0], attacks)
+            continue
+        if 'attack_bonus' not in action or not action.get('damage'):
+            continue
+        terms, modifier = _dice_profile(action['damage'])
+        extra_terms, extra_mod = _dice_profile(action.get('extra_damage', '')) if action.get('extra_damage') else ([], 0)
+        terms, modifier = terms + extra_terms, modifier + extra_mod
+        if best is None or _average(terms, modifier) > _average(best['dice'], best['modifier']):
+            best = {'attack_bonus': action['attack_bonus'], 'dice': terms, 'modifier': modifier}
+
+    if best is None:
+        best = {'attack_bonus': 2, 'dice': [(1, 4)], 'modifier': 0}
+
+    return {
+        'name': monster.get('name', name),
+        'hp': monster.get('hp', 10),
+        'ac': monster.get('ac', 10),
+        'attacks': attacks,
+        **best,
+    }
+
+
+def character_profile(char: Dict) -> Dict:
+    """Build a simulator profile from a character sheet."""
+    def mod(stat):
+        return (char.get(stat, 10) - 10) // 2
+
+    weapon_name = (char.get('equipment') or {}).get('weapon')
+    weapon = get_weapon(weapon_name) if DND_DATA_AVAILABLE and weapon_name else None
+    if weapon:
+        terms, _ = _dice_profile(weapon.get('damage', '1d8'))
+        finesse = 'finesse' in weapon.get('properties', [])
+        ranged = not weapon.get('melee', True)
+    else:
+        terms, finesse, ranged = [(1, 8)], False, False
+
+    ability_mod = mod('DEX') if ranged else max(mod('STR'), mod('DEX')) if finesse else mod('STR')
+    # Characters without a weapon still use their best physical stat
+    if not weapon:
+        ability_mod = max(mod('STR'), mod('DEX'))
+
+    attacks = 1
+    if char.get('class') in _EXTRA_ATTACK_CLASSES and char.get('level', 1) >= 5:
+        attacks = 2
+        if char.get('class') == 'Fighter':
+            level = char.get('level', 1)
+            attacks = 4 if level >= 20 else 3 if level >= 11 else 2
+
+    return {
+        'name': char.get('name', 'Adventurer'),
+        'hp': max(0, char.get('hp', char.get('max_hp', 10))),
+        'ac': char.get('ac', 10),
+        'attacks': attacks,
+        'attack_bonus': ability_mod + char.get('proficiency', 2),
+        'dice': terms,
+        'modifier': ability_mod,
+    }
+
+
+# =============================================================================
+# VECTORIZED ENGINE
+# =============================================================================
+
+def _roll_damage_np(rng, dice, modifier, crit, n):
+    """Roll damage for n attacks at once; crits roll the dice twice."""
+    total = np.full(n, modifier, dtype=np.int32)
+    for num, sides in dice:
+        total += rng.integers(1, sides + 1, size=(n, num)).sum(axis=1, dtype=np.int32)
+        extra = rng.integers(1, sides + 1, size=(n, num)).sum(axis=1, dtype=np.int32)
+        total += np.where(crit, extra, 0)
+    return np.maximum(total, 0)
+
+
+def _attack_side_np(rng, attackers, att_hp, defenders, def_hp, def_ac, running):
+    """Every standing attacker hits the first standing defender in each running fight."""
+    n = att_hp.shape[0]
+    rows = np.arange(n)
+    for j, profile in enumerate(attackers):
+        for _ in range(profile['attacks']):
+            alive = def_hp > 0
+            has_target = alive.any(axis=1)
+            acting = running & (att_hp[:, j] > 0) & has_target
+            if not acting.any():
+                break
+            target = alive.argmax(axis=1)
+            d20 = rng.integers(1, 21, size=n)
+            crit = d20 == 20
+            hit = acting & (d20 != 1) & (crit | (d20 + profile['attack_bonus'] >= def_ac[target]))
+            damage = _roll_damage_np(rng, profile['dice'], profile['modifier'], crit, n)
+            def_hp[rows, target] -= np.where(hit, damage, 0)
+
+
+def _death_saves_np(rng, hp, saves, fails, stable, running):
+    """Roll death saves for downed party members who aren't yet stable or dead."""
+    mask = running[:, None] & (hp <= 0) & ~stable & (fails < 3)
+    if not mask.any():
+        return
+    d20 = rng.integers(1, 21, size=hp.shape)
+    revived = mask & (d20 == 20)
+    hp[revived] = 1
+    saves[revived] = 0
+    fails[revived] = 0
+    saves += (mask & (d20 >= 10) & (d20 < 20)).astype(saves.dtype)
+    fails += (mask & (d20 < 10)).astype(fails.dtype) + (mask & (d20 == 1)).astype(fails.dtype)
+    stable |= saves >= 3
+
+
+def _simulate_numpy(party, monsters, simulations, seed):
+    rng = np.random.default_rng(seed)
+    n = simulations
+
+    party_hp = np.tile(np.array([p['hp'] for p in party], dtype=np.int32), (n, 1))
+    start_hp = party_hp.copy()
+    party_ac = np.array([p['ac'] for p in party], dtype=np.int32)
+    mon_hp = np.tile(np.array([m['hp'] for m in monsters], dtype=np.int32), (n, 1))
+    mon_ac = np.array([m['ac'] for m in monsters], dtype=np.int32)
+
+    saves = np.zeros_like(party_hp)
+    fails = np.zeros_like(party_hp)
+    stable = np.zeros(party_hp.shape, dtype=bool)
+
+    # Side initiative: whoever has the best single roll goes first
+    party_init = rng.integers(1, 21, size=(n, len(party))).max(axis=1)
+    mon_init = rng.integers(1, 21, size=(n, len(monsters))).max(axis=1)
+    party_first = party_init >= mon_init
+
+    running = np.ones(n, dtype=bool)
+    rounds = np.full(n, MAX_ROUNDS, dtype=np.int32)
+
+    for rnd in range(1, MAX_ROUNDS + 1):
+        first = running & party_first
+        second = running & ~party_first
+        _attack_side_np(rng, party, party_hp, monsters, mon_hp, mon_ac, first)
+        _attack_side_np(rng, monsters, mon_hp, party, party_hp, party_ac, running)
+        _attack_side_np(rng, party, party_hp, monsters, mon_hp, mon_ac, second)
+        _death_saves_np(rng, party_hp, saves, fails, stable, running)
+
+        finished = running & (((mon_hp > 0).sum(axis=1) == 0) | ((party_hp > 0).sum(axis=1) == 0))
+        rounds[finished] = rnd
+        running &= ~finished
+        if not running.any():
+            break
+
+    party_win = ((mon_hp > 0).sum(axis=1) == 0) & ((party_hp > 0).sum(axis=1) > 0)
+    hp_loss = (start_hp - np.maximum(party_hp, 0)).clip(min=0).sum(axis=1)
+    deaths = (fails >= 3).any(axis=1)
+    return {
+        'wins': int(party_win.sum()),
+        'rounds': float(rounds.mean()),
+        'hp_loss': float(hp_loss.mean()),
+        'deaths': int(deaths.sum()),
+    }
+
+
+# =============================================================================
+# PURE PYTHON FALLBACK
+# =============================================================================
+
+def _roll_damage_py(rng, dice, modifier, crit):
+    total = modifier
+    for num, sides in dice:
+        rolls = num * (2 if crit else 1)
+        total += sum(rng.randint(1, sides) for _ in range(rolls))
+    return max(total, 0)
+
+
+def _attack_side_py(rng, attackers, att_hp, defenders, def_hp):
+    for j, profile in enumerate(attackers):
+        if att_hp[j] <= 0:
+            continue
+        for _ in range(profile['attacks']):
+            target = next((i for i, hp in enumerate(def_hp) if hp > 0), None)
+            if target is None:
+                return
+            d20 = rng.randint(1, 20)
+            crit = d20 == 20
+            if d20 != 1 and (crit or d20 + profile['attack_bonus'] >= defenders[target]['ac']):
+                def_hp[target] -= _roll_damage_py(rng, profile['dice'], profile['modifier'], crit)
+
+
+def _simulate_python(party, monsters, simulations, seed):
+    rng = random.Random(seed)
+    wins = deaths = 0
+    total_rounds = total_loss = 0.0
+    for _ in range(simulations):
+        party_hp = [p['hp'] for p in party]
+        mon_hp = [m['hp'] for m in monsters]
+        saves = [0] * len(party)
+        fails = [0] * len(party)
+        party_first = max(rng.randint(1, 20) for _ in party) >= max(rng.randint(1, 20) for _ in monsters)
+        rounds = MAX_ROUNDS
+        for rnd in range(1, MAX_ROUNDS + 1):
+            if party_first:
+                _attack_side_py(rng, party, party_hp, monsters, mon_hp)
+            _attack_side_py(rng, monsters, mon_hp, party, party_hp)
+            if not party_first:
+                _attack_side_py(rng, party, party_hp, monsters, mon_hp)
+            for i, hp in enumerate(party_hp):
+                if hp <= 0 and saves[i] < 3 and fails[i] < 3:
+                    d20 = rng.randint(1, 20)
+                    if d20 == 20:
+                        party_hp[i], saves[i], fails[i] = 1, 0, 0
+                    elif d20 >= 10:
+                        saves[i] += 1
+                    else:
+                        fails[i] += 2 if d20 == 1 else 1
+            if all(hp <= 0 for hp in mon_hp) or all(hp <= 0 for hp in party_hp):
+                rounds = rnd
+                break
+        if all(hp <= 0 for hp in mon_hp) and any(hp > 0 for hp in party_hp):
+            wins += 1
+        if any(f >= 3 for f in fails):
+            deaths += 1
+        total_rounds += rounds
+        total_loss += sum(max(0, p['hp'] - max(hp, 0)) for p, hp in zip(party, party_hp))
+    return {
+        'wins': wins,
+        'rounds': total_rounds / simulations,
+        'hp_loss': total_loss / simulations,
+        'deaths': deaths,
+    }
+
+
+# =============================================================================
+# PUBLIC API
+# =============================================================================
+
+def expand_monster_names(spec: str) -> List[str]:
+    """Parse 'goblin*3, dire wolf' (comma separated) into a list of names."""
+    names = []
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        count = 1
+        if '*' in part:
+            part, qty = part.split('*', 1)
+            try:
+                count = max(1, int(qty))
+            except ValueError:
+                count = 1
+        names.extend([part.strip()] * count)
+    return names
+
+
+def simulate_encounter(party: List[Dict], monster_names: List[str],
+                       simulations: int = DEFAULT_SIMULATIONS, seed=None) -> Dict:
+    """
+    Simulate many fights between ``party`` (character dicts) and the named monsters.
+
+    Returns a dict with win_probability, expected_rounds, expected_party_hp_loss,
+    expected_hp_loss_pct, death_probability, unknown (monster names not in the
+    database), simulations and elapsed (seconds), or {'error': ...}.
+    """
+    party_profiles = [character_profile(c) for c in party if c]
+    monster_profiles = []
+    unknown = []
+    for name in monster_names:
+        profile = monster_profile(name)
+        if profile:
+            monster_profiles.append(profile)
+        else:
+            unknown.append(name)
+
+    if not party_profiles:
+        return {'error': 'No party members to simulate'}
+    if not monster_profiles:
+        return {'error': 'No known monsters to simulate', 'unknown': unknown}
+
+    simulations = max(1, int(simulations))
+    start = time.perf_counter()
+    if NUMPY_AVAILABLE:
+        raw = _simulate_numpy(party_profiles, monster_profiles, simulations, seed)
+    else:
+        raw = _simulate_python(party_profiles, monster_profiles, simulations, seed)
+    elapsed = time.perf_counter() - start
+
+    party_hp = sum(p['hp'] for p in party_profiles) or 1
+    return {
+        'simulations': simulations,
+        'win_probability': raw['wins'] / simulations,
+        'expected_rounds': raw['rounds'],
+        'expected_party_hp_loss': raw['hp_loss'],
+        'expected_hp_loss_pct': raw['hp_loss'] / party_hp,
+        'death_probability': raw['deaths'] / simulations,
+        'party': [p['name'] for p in party_profiles],
+        'monsters': [m['name'] for m in monster_profiles],
+        'unknown': unknown,
+        'elapsed': elapsed,
+        'vectorized': NUMPY_AVAILABLE,
+    }
+
+
+def format_simulation(result: Dict) -> str:
+    """Format a simulate_encounter result for Discord."""
+    if result.get('error'):
+        msg = f"❌ {result['error']}"
+        if result.get('unknown'):
+            msg += f" (unknown: {', '.join(result['unknown'])})"
+        return msg
+
+    win = result['win_probability']
+    verdict = "🟢 Favourable" if win >= 0.9 else "🟡 Risky" if win >= 0.6 else "🔴 Deadly"
+    lines = [
+        f"🎲 **Encounter Simulation** ({result['simulations']:,} fights)",
+        "───────────────────────",
+        f"**Party:** {', '.join(result['party'])}",
+        f"**Enemies:** {', '.join(result['monsters'])}",
+        "",
+        f"🏆 **Party wins:** {win:.1%} — {verdict}",
+        f"⏱️ **Expected length:** {result['expected_rounds']:.1f} rounds",
+        f"💔 **Expected HP lost:** {result['expected_party_hp_loss']:.0f} ({result['expected_hp_loss_pct']:.0%} of party HP)",
+        f"💀 **Chance someone dies:** {result['death_probability']:.1%}",
+    ]
+    if result.get('unknown'):
+        lines.append(f"⚠️ Not in monster database (skipped): {', '.join(result['unknown'])}")
+    return "\n".join(lines)
@@ -1,18 +1,135 @@
+"""
+Session Logger
+Markdown session logs in ``logs/<session>.md``, written in the background.
+
+``log_message`` only puts the entry on an in-memory queue; a writer thread
+drains the queue every FLUSH_INTERVAL seconds, or as soon as FLUSH_COUNT
+entries are waiting, and appends each session's batch with one write. A log
+that grows past ROTATE_BYTES is renamed to ``<session>.<n>.md`` and a fresh
+one started; ``get_log_file`` zips the rotated parts together with the
+current log for export. With ``LOG_TO_DATABASE`` set, each batch is also
+inserted into the ``session_logs`` table in a single transaction.
+"""
+
+import atexit
+import glob
 import os
-from datetime import datetime
+import re
+import zipfile
+from datetime import datetime, timezone
+
+from utils.background_writer import BackgroundWriter
 
 LOGS_DIR = os.path.join(os.path.dirname(__file__), '..', 'logs')
 os.makedirs(LOGS_DIR, exist_ok=True)
 
+FLUSH_INTERVAL = 1.0          # seconds between background flushes
+FLUSH_COUNT = 50              # queued entries that trigger an early flush
+ROTATE_BYTES = 5 * 1024 * 1024
+LOG_TO_DATABASE = os.getenv('LOG_TO_DATABASE', '').lower() in ('1', 'true', 'yes')
+
+_db_ready = False
+
+
 def get_log_path(session_id):
     return os.path.join(LOGS_DIR, f'{session_id}.md')
 
+
+def _rotate(path):
+    """Move a full log aside as ``<session>.<n>.md`` with the next free number."""
+    base = path[:-3]
+    n = 1
+    while os.path.exists(f'{base}.{n}.md'):
+        n += 1
+    os.replace(path, f'{base}.{n}.md')
+
+
+def _write_batch(entries):
+    by_session = {}
+    for session_id, timestamp, speaker, message in entries:
+        by_session.setdefault(session_id, []).append(
+            f'[{timestamp.astimezone().strftime("%Y-%m-%d %H:%M:%S")}] **{speaker}:** {message}\n\n'
+        )
+    for session_id, lines in by_session.items():
+        path = get_log_path(session_id)
+        try:
+            if os.path.exists(path) and os.path.getsize(path) >= ROTATE_BYTES:
+                _rotate(path)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(''.join(lines))
+        except OSError as e:
+            print(f"Session log write failed for {session_id}: {e}")
+
+
+def _write_database(entries):
+    global _db_ready
+    try:
+        from utils.database import init_database, db_log_messages
+        if not _db_ready:
+            init_database()
+            _db_ready = True
+        # UTC, matching the column's CURRENT_TIMESTAMP default
+        db_log_messages([
+            (str(session_id), speaker, message, timestamp.strftime('%Y-%m-%d %H:%M:%S'))
+            for session_id, timestamp, speaker, message in entries
+        ])
+    except Exception as e:
+        print(f"Session log database write failed: {e}")
+
+
+def _write_entries(entries):
+    """Write a batch of queued (session_id, UTC timestamp, speaker, message) entries."""
+    _write_batch(entries)
+    if LOG_TO_DATABASE:
+        _write_database(entries)
+
+
+_writer = BackgroundWriter(_write_entries, 'session-log-writer',
+                           flush_interval=FLUSH_INTERVAL, flush_count=FLUSH_COUNT)
+
+
 def log_message(session_id, speaker, message):
-    path = get_log_path(session_id)
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    with open(path, 'a', encoding='utf-8') as f:
-        f.write(f'[{timestamp}] **{speaker}:** {message}\n\n')
+    """Queue a line for the session log; it is written in the background."""
+    _writer.put((session_id, datetime.now(timezone.utc), speaker, message))
+
+
+def flush_logs():
+    """Write any queued log lines now."""
+    _writer.flush()
+
+
+atexit.register(flush_logs)
+
+
+def get_log_parts(session_id):
+    """A session's log files, oldest first: rotated ``<session>.<n>.md`` parts, then the current log."""
+    base = get_log_path(session_id)[:-3]
+    numbered = []
+    for path in glob.glob(f'{glob.escape(base)}.*.md'):
+        match = re.fullmatch(r'\.(\d+)\.md', path[len(base):])
+        if match:
+            numbered.append((int(match.group(1)), path))
+    parts = [path for _, path in sorted(numbered)]
+    current = get_log_path(session_id)
+    if os.path.exists(current):
+        parts.append(current)
+    return parts
+
 
 def get_log_file(session_id):
-    path = get_log_path(session_id)
-    return path if os.path.exists(path) else None
+    """
+    File to export for a session's log.
+
+    Returns:
+        The log itself, a ``<session>.zip`` of every part when it has been
+        rotated, or None if nothing was logged
+    """
+    flush_logs()
+    parts = get_log_parts(session_id)
+    if len(parts) <= 1:
+        return parts[0] if parts else None
+    archive = os.path.join(LOGS_DIR, f'{session_id}.zip')
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for path in parts:
+            zf.write(path, os.path.basename(path))
+    return archive
@@ -7,6 +7,8 @@ import random
 from typing import Dict, List, Optional, Tuple
 from enum import Enum
 
+from utils.dice_service import get_block_rng
+
 # =============================================================================
 # LOOT RARITY
 # =============================================================================
@@ -30,39 +32,41 @@ RARITY_COLORS = {
 # CURRENCY
 # =============================================================================
 
-def roll_currency(cr: int) -> Dict[str, int]:
+def roll_currency(cr: int, rng=None) -> Dict[str, int]:
     """
     Roll random currency based on Challenge Rating.
     
     Args:
         cr: Challenge Rating of the encounter
+        rng: Random source (defaults to the random module)
         
     Returns:
         Dict with cp, sp, ep, gp, pp amounts
     """
+    rng = rng or random
     currency = {'cp': 0, 'sp': 0, 'ep': 0, 'gp': 0, 'pp': 0}
     
     if cr < 1:
         # Very low CR - copper and silver
-        currency['cp'] = random.randint(1, 6) * 10
-        currency['sp'] = random.randint(0, 3) * 5
+        currency['cp'] = rng.randint(1, 6) * 10
+        currency['sp'] = rng.randint(0, 3) * 5
     elif cr <= 4:
         # Low CR - silver and gold
-        currency['sp'] = random.randint(2, 12) * 10
-        currency['gp'] = random.randint(1, 6) * 5
+        currency['sp'] = rng.randint(2, 12) * 10
+        currency['gp'] = rng.randint(1, 6) * 5
     elif cr <= 10:
         # Medium CR - gold focus
-        currency['gp'] = random.randint(4, 24) * 10
-        if random.random() < 0.3:
-            currency['pp'] = random.randint(1, 6)
+        currency['gp'] = rng.randint(4, 24) * 10
+        if rng.random() < 0.3:
+            currency['pp'] = rng.randint(1, 6)
     elif cr <= 16:
         # High CR - gold and platinum
-        currency['gp'] = random.randint(6, 36) * 50
-        currency['pp'] = random.randint(2, 12) * 5
+        currency['gp'] = rng.randint(6, 36) * 50
+        currency['pp'] = rng.randint(2, 12) * 5
     else:
         # Very high CR - massive wealth
-        currency['gp'] = random.randint(10, 60) * 100
-        currency['pp'] = random.randint(5, 30) * 10
+        currency['gp'] = rng.randint(10, 60) * 100
+        currency['pp'] = rng.randint(5, 30) * 10
     
     return currency
 
@@ -232,39 +236,43 @@ MAGIC_ITEMS = {
 # LOOT GENERATION FUNCTIONS
 # =============================================================================
 
-def roll_mundane_loot(count: int = 1, category: str = None) -> List[str]:
+def roll_mundane_loot(count: int = 1, category: str = None, rng=None) -> List[str]:
     """
     Roll random mundane loot items.
     
     Args:
         count: Number of items to generate
         category: Specific category or None for random
+        rng: Random source (defaults to the random module)
         
     Returns:
         List of item names
     """
+    rng = rng or random
     items = []
     categories = list(MUNDANE_LOOT.keys())
     
     for _ in range(count):
-        cat = category if category and category in MUNDANE_LOOT else random.choice(categories)
-        item = random.choice(MUNDANE_LOOT[cat])
+        cat = category if category and category in MUNDANE_LOOT else rng.choice(categories)
+        item = rng.choice(MUNDANE_LOOT[cat])
         items.append(item)
     
     return items
 
 
-def roll_gems(cr: int, count: int = None) -> List[Tuple[str, int]]:
+def roll_gems(cr: int, count: int = None, rng=None) -> List[Tuple[str, int]]:
     """
     Roll random gems based on CR.
     
     Args:
         cr: Challenge Rating
         count: Number of gems (default based on CR)
+        rng: Random source (defaults to the random module)
         
     Returns:
         List of (gem_name, value_gp) tuples
     """
+    rng = rng or random
     # Determine gem tier based on CR
     if cr <= 4:
         values = [10, 50]
@@ -276,28 +284,30 @@ def roll_gems(cr: int, count: int = None) -> List[Tuple[str, int]]:
         values = [500, 1000, 5000]
     
     if count is None:
-        count = random.randint(1, max(1, cr // 2))
+        count = rng.randint(1, max(1, cr // 2))
     
     gems = []
     for _ in range(count):
-        value = random.choice(values)
-        gem_name = random.choice(GEMS[value])
+        value = rng.choice(values)
+        gem_name = rng.choice(GEMS[value])
         gems.append((gem_name, value))
     
     return gems
 
 
-def roll_art_objects(cr: int, count: int = None) -> List[Tuple[str, int]]:
+def roll_art_objects(cr: int, count: int = None, rng=None) -> List[Tuple[str, int]]:
     """
     Roll random art objects based on CR.
     
     Args:
         cr: Challenge Rating
         count: Number of items (default based on CR)
+        rng: Random source (defaults to the random module)
         
     Returns:
         List of (object_name, value_gp) tuples
     """
+    rng = rng or random
     # Determine value tier based on CR
     if cr <= 4:
         values = [25]
@@ -309,27 +319,29 @@ def roll_art_objects(cr: int, count: int = None) -> List[Tuple[str, int]]:
         values = [750, 2500, 7500]
     
     if count is None:
-        count = random.randint(1, max(1, cr // 3))
+        count = rng.randint(1, max(1, cr // 3))
     
     objects = []
     for _ in range(count):
-        value = random.choice(values)
-        obj_name = random.choice(ART_OBJECTS[value])
+        value = rng.choice(values)
+        obj_name = rng.choice(ART_OBJECTS[value])
         objects.append((obj_name, value))
     
     return objects
 
 
-def roll_magic_item(max_rarity: Rarity = Rarity.RARE) -> Optional[Dict]:
+def roll_magic_item(max_rarity: Rarity = Rarity.RARE, rng=None) -> Optional[Dict]:
     """
     Roll a random magic item up to a maximum rarity.
     
     Args:
         max_rarity: Maximum rarity to roll
+        rng: Random source (defaults to the random module)
         
     Returns:
         Magic item dict or None
     """
+    rng = rng or random
     # Rarity weights (more common items more likely)
     rarity_weights = {
         Rarity.COMMON: 50,
@@ -346,7 +358,7 @@ def roll_magic_item(max_rarity: Rarity = Rarity.RARE) -> Optional[Dict]:
     
     # Weighted random selection
     total_weight = sum(rarity_weights[r] for r in available)
-    roll = random.randint(1, total_weight)
+    roll = rng.randint(1, total_weight)
     
     cumulative = 0
     selected_rarity = available[0]
@@ -360,25 +372,29 @@ def roll_magic_item(max_rarity: Rarity = Rarity.RARE) -> Optional[Dict]:
     if not items:
         return None
     
-    item = random.choice(items).copy()
+    item = rng.choice(items).copy()
     item['rarity'] = selected_rarity.value
     item['rarity_icon'] = RARITY_COLORS[selected_rarity]
     return item
 
 
-def generate_treasure_hoard(cr: int, include_magic: bool = True) -> Dict:
+def generate_treasure_hoard(cr: int, include_magic: bool = True, channel_id=None, rng=None) -> Dict:
     """
     Generate a complete treasure hoard based on CR.
     
     Args:
         cr: Challenge Rating of the encounter
         include_magic: Whether to include magic items
+        channel_id: Channel whose dice stream to draw from (optional)
+        rng: Random source to use instead (optional)
         
     Returns:
         Dict with all treasure components
     """
+    # Draw the whole hoard's randomness from the channel's stream in one go
+    rng = rng or get_block_rng(channel_id, 64, 'loot')
     hoard = {
-        'currency': roll_currency(cr),
+        'currency': roll_currency(cr, rng=rng),
         'gems': [],
         'art_objects': [],
         'magic_items': [],
@@ -386,15 +402,15 @@ def generate_treasure_hoard(cr: int, include_magic: bool = True) -> Dict:
     }
     
     # Add gems (chance based on CR)
-    if random.random() < min(0.8, 0.3 + cr * 0.05):
-        hoard['gems'] = roll_gems(cr)
+    if rng.random() < min(0.8, 0.3 + cr * 0.05):
+        hoard['gems'] = roll_gems(cr, rng=rng)
     
     # Add art objects (chance based on CR)
-    if random.random() < min(0.6, 0.2 + cr * 0.04):
-        hoard['art_objects'] = roll_art_objects(cr)
+    if rng.random() < min(0.6, 0.2 + cr * 0.04):
+        hoard['art_objects'] = roll_art_objects(cr, rng=rng)
     
     # Add magic items (chance based on CR)
-    if include_magic and random.random() < min(0.5, 0.1 + cr * 0.03):
+    if include_magic and rng.random() < min(0.5, 0.1 + cr * 0.03):
         # Determine max rarity based on CR
         if cr <= 4:
             max_rarity = Rarity.UNCOMMON
@@ -405,29 +421,33 @@ def generate_treasure_hoard(cr: int, include_magic: bool = True) -> Dict:
         else:
             max_rarity = Rarity.LEGENDARY
         
-        num_items = 1 if cr < 10 else random.randint(1, 2)
+        num_items = 1 if cr < 10 else rng.randint(1, 2)
         for _ in range(num_items):
-            item = roll_magic_item(max_rarity)
+            item = roll_magic_item(max_rarity, rng=rng)
             if item:
                 hoard['magic_items'].append(item)
     
     # Add mundane loot
-    hoard['mundane'] = roll_mundane_loot(random.randint(1, 3))
+    hoard['mundane'] = roll_mundane_loot(rng.randint(1, 3), rng=rng)
     
     return hoard
 
 
-def generate_enemy_loot(enemy_name: str, cr: int = 1) -> Dict:
+def generate_enemy_loot(enemy_name: str, cr: int = 1, channel_id=None, rng=None) -> Dict:
     """
     Generate loot dropped by a defeated enemy.
     
     Args:
         enemy_name: Name of the defeated enemy
         cr: Challenge Rating of the enemy
+        channel_id: Channel whose dice stream to draw from (optional)
+        rng: Random source to use instead (optional)
         
     Returns:
         Dict with loot items
     """
+    # Draw the whole hoard's randomness from the channel's stream in one go
+    rng = rng or get_block_rng(channel_id, 64, 'loot')
     loot = {
         'enemy': enemy_name,
         'currency': {},
@@ -435,21 +455,21 @@ def generate_enemy_loot(enemy_name: str, cr: int = 1) -> Dict:
     }
     
     # Currency (most enemies have some coins)
-    if random.random() < 0.7:
-        loot['currency'] = roll_currency(max(0, cr - 1))
+    if rng.random() < 0.7:
+        loot['currency'] = roll_currency(max(0, cr - 1), rng=rng)
     
     # Mundane loot
-    if random.random() < 0.5:
-        loot['items'].extend(roll_mundane_loot(1))
+    if rng.random() < 0.5:
+        loot['items'].extend(roll_mundane_loot(1, rng=rng))
     
     # Small chance of something valuable
-    if random.random() < 0.1 + cr * 0.02:
-        if random.random() < 0.5:
-            gems = roll_gems(cr, 1)
+    if rng.random() < 0.1 + cr * 0.02:
+        if rng.random() < 0.5:
+            gems = roll_gems(cr, 1, rng=rng)
             for gem, value in gems:
                 loot['items'].append(f"{gem} ({value} gp)")
         else:
-            item = roll_magic_item(Rarity.UNCOMMON if cr < 5 else Rarity.RARE)
+            item = roll_magic_item(Rarity.UNCOMMON if cr < 5 else Rarity.RARE, rng=rng)
             if item:
                 loot['items'].append(f"{item['rarity_icon']} {item['name']}")
     
@@ -0,0 +1,302 @@
+"""
+Map Image Renderer
+Draws a TacticalMap as a PNG so maps too wide for a Discord code block can
+still be shown.
+
+Terrain tiles and token discs are drawn once per tile size into an in-memory
+atlas. A render is then just copies out of the atlas: with NumPy the whole
+terrain layer is one fancy-indexing gather over the terrain codes, otherwise
+tiles are pasted square by square. Finished PNGs are cached per map by
+version, viewport and fog, so showing an unchanged map again costs nothing.
+
+``render_png_async`` is for the bot: it checks the cache on the event loop
+and, on a miss, renders a snapshot of the map in a worker thread, so commands
+that move or remove tokens meanwhile can't change the map mid-render.
+"""
+
+import asyncio
+import io
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Tuple
+from weakref import WeakKeyDictionary
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from utils.map_manager import TERRAIN_CODES, TacticalMap, Token
+
+TILE_SIZE = 24
+VIEWPORT_RADIUS = 12   # squares shown around a focused token
+CACHE_PER_MAP = 8      # PNGs kept per map (different viewports / fog views)
+
+# Fill and accent colours per terrain type
+TERRAIN_COLORS = {
+    "floor": ((196, 184, 160), None),
+    "wall": ((70, 66, 62), (50, 47, 44)),
+    "water": ((72, 128, 196), (110, 160, 220)),
+    "difficult": ((170, 150, 110), (130, 112, 80)),
+    "pit": ((40, 34, 30), (20, 16, 14)),
+    "door": ((150, 100, 50), (100, 64, 30)),
+    "door_locked": ((120, 60, 40), (200, 180, 60)),
+    "stairs_up": ((196, 184, 160), (120, 110, 96)),
+    "stairs_down": ((196, 184, 160), (90, 82, 70)),
+    "rubble": ((160, 150, 130), (110, 100, 86)),
+    "pillar": ((196, 184, 160), (100, 96, 92)),
+    "tree": ((96, 140, 70), (40, 90, 40)),
+    "bush": ((120, 160, 90), (70, 120, 60)),
+    "lava": ((200, 70, 30), (250, 170, 40)),
+    "ice": ((200, 226, 240), (160, 200, 225)),
+}
+DEFAULT_TERRAIN_COLOR = ((196, 184, 160), None)
+GRID_COLOR = (120, 112, 100)
+
+TOKEN_COLORS = {
+    "player": (40, 100, 220),
+    "enemy": (210, 40, 40),
+    "npc": (40, 160, 70),
+    "object": (200, 200, 200),
+    "boss": (140, 50, 190),
+}
+
+UNSEEN_COLOR = (12, 12, 14)
+EXPLORED_DIM = 0.45    # brightness of squares seen before but not now
+HIGHLIGHT_COLOR = (255, 215, 0)
+
+
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the fixed bitmap font
+        return ImageFont.load_default()
+
+
+def _terrain_tile(name: str, tile: int):
+    fill, accent = TERRAIN_COLORS.get(name, DEFAULT_TERRAIN_COLOR)
+    img = Image.new("RGB", (tile, tile), fill)
+    draw = ImageDraw.Draw(img)
+    q = max(2, tile // 4)
+    if accent:
+        if name in ("water", "ice"):
+            for y in (q, 2 * q, 3 * q):
+                draw.line([(q // 2, y), (tile - q // 2, y)], fill=accent, width=max(1, tile // 16))
+        elif name in ("difficult", "rubble"):
+            for x, y in ((q, q), (3 * q, 2 * q), (2 * q, 3 * q)):
+                draw.ellipse([x - 2, y - 2, x + 2, y + 2], fill=accent)
+        elif name in ("pillar", "pit"):
+            draw.ellipse([q, q, tile - q, tile - q], fill=accent)
+        elif name in ("tree", "bush"):
+            draw.ellipse([q // 2, q // 2, tile - q // 2, tile - q // 2], fill=accent)
+        elif name.startswith("stairs"):
+            for i in range(1, 4):
+                draw.line([(q // 2, i * q), (tile - q // 2, i * q)], fill=accent, width=max(1, tile // 12))
+        elif name.startswith("door"):
+            draw.rectangle([q, q // 2, tile - q, tile - q // 2], outline=accent, width=max(1, tile // 12))
+        elif name == "lava":
+            draw.ellipse([q, q, 2 * q, 2 * q], fill=accent)
+            draw.ellipse([2 * q, 2 * q, 3 * q, 3 * q], fill=accent)
+        else:
+            draw.rectangle([1, 1, tile - 2, tile - 2], outline=accent)
+    draw.rectangle([0, 0, tile - 1, tile - 1], outline=GRID_COLOR)
+    return img
+
+
+@lru_cache(maxsize=4)
+def get_atlas(tile: int = TILE_SIZE):
+    """
+    One image holding a tile for every terrain code (left to right in code
+    order), plus the tiles as a (codes, tile, tile, 3) array when NumPy is
+    available.
+    """
+    atlas = Image.new("RGB", (tile * len(TERRAIN_CODES), tile))
+    for code, name in enumerate(TERRAIN_CODES):
+        atlas.paste(_terrain_tile(name, tile), (code * tile, 0))
+    tiles = None
+    if NUMPY_AVAILABLE:
+        strip = np.asarray(atlas)
+        tiles = strip.reshape(tile, len(TERRAIN_CODES), tile, 3).transpose(1, 0, 2, 3).copy()
+    return atlas, tiles
+
+
+@lru_cache(maxsize=256)
+def token_sprite(token_type: str, letter: str, size: int, tile: int = TILE_SIZE, highlight: bool = False):
+    """Disc with the token's initial, covering its whole footprint."""
+    span = tile * max(1, size)
+    img = Image.new("RGBA", (span, span), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    pad = max(2, span // 10)
+    color = TOKEN_COLORS.get(token_type, TOKEN_COLORS["player"])
+    outline = HIGHLIGHT_COLOR if highlight else (255, 255, 255)
+    draw.ellipse([pad, pad, span - pad - 1, span - pad - 1], fill=color + (255,),
+                 outline=outline, width=max(2, span // 12))
+    font = _font(int(span * 0.5))
+    draw.text((span / 2, span / 2), letter, fill=(255, 255, 255), font=font, anchor="mm")
+    return img
+
+
+def viewport_around(tactical_map: TacticalMap, token: Token,
+                    radius: int = VIEWPORT_RADIUS) -> Tuple[int, int, int, int]:
+    """Squares (x1, y1, x2, y2) within ``radius`` of a token, shifted to stay on the map."""
+    size = max(1, token.size)
+    span_w = min(tactical_map.width, 2 * radius + size)
+    span_h = min(tactical_map.height, 2 * radius + size)
+    x1 = min(max(0, token.x - radius), tactical_map.width - span_w)
+    y1 = min(max(0, token.y - radius), tactical_map.height - span_h)
+    return x1, y1, x1 + span_w - 1, y1 + span_h - 1
+
+
+def _terrain_layer(tactical_map: TacticalMap, box, tile: int):
+    x1, y1, x2, y2 = box
+    cols, rows = x2 - x1 + 1, y2 - y1 + 1
+    atlas, tiles = get_atlas(tile)
+    arr = tactical_map.array
+    if tiles is not None and arr is not None:
+        codes = np.minimum(arr[y1:y2 + 1, x1:x2 + 1], len(TERRAIN_CODES) - 1)
+        pixels = tiles[codes]  # (rows, cols, tile, tile, 3)
+        pixels = pixels.transpose(0, 2, 1, 3, 4).reshape(rows * tile, cols * tile, 3)
+        return Image.fromarray(np.ascontiguousarray(pixels), "RGB")
+
+    img = Image.new("RGB", (cols * tile, rows * tile))
+    crops = [atlas.crop((c * tile, 0, (c + 1) * tile, tile)) for c in range(len(TERRAIN_CODES))]
+    for y in range(y1, y2 + 1):
+        for x in range(x1, x2 + 1):
+            code = min(tactical_map.terrain_code(x, y), len(TERRAIN_CODES) - 1)
+            img.paste(crops[code], ((x - x1) * tile, (y - y1) * tile))
+    return img
+
+
+def _apply_fog(img, fog: bytes, tactical_map: TacticalMap, box, tile: int):
+    """Black out unseen squares and dim squares that are remembered but not in view."""
+    x1, y1, x2, y2 = box
+    cols, rows = x2 - x1 + 1, y2 - y1 + 1
+    w = tactical_map.width
+    # One pixel per square, scaled up to tile size as the blend mask
+    levels = bytes(
+        fog[y * w + x] for y in range(y1, y2 + 1) for x in range(x1, x2 + 1)
+    )
+    small = Image.frombytes("L", (cols, rows), levels.translate(
+        bytes([0, int(255 * EXPLORED_DIM), 255]) + bytes(253)))
+    mask = small.resize((cols * tile, rows * tile), Image.NEAREST)
+    dark = Image.new("RGB", img.size, UNSEEN_COLOR)
+    return Image.composite(img, dark, mask)
+
+
+def _labels(img, box, tile: int):
+    """Add a coordinate ruler (every 5 squares) along the top and left edges."""
+    x1, y1, x2, y2 = box
+    margin = max(14, tile)
+    framed = Image.new("RGB", (img.width + margin, img.height + margin), (30, 30, 34))
+    framed.paste(img, (margin, margin))
+    draw = ImageDraw.Draw(framed)
+    font = _font(max(9, int(margin * 0.5)))
+    for x in range(x1, x2 + 1):
+        if x % 5 == 0:
+            draw.text((margin + (x - x1) * tile + tile / 2, margin / 2), str(x),
+                      fill=(230, 230, 230), font=font, anchor="mm")
+    for y in range(y1, y2 + 1):
+        if y % 5 == 0:
+            draw.text((margin / 2, margin + (y - y1) * tile + tile / 2), str(y),
+                      fill=(230, 230, 230), font=font, anchor="mm")
+    return framed
+
+
+_png_cache = WeakKeyDictionary()  # TacticalMap -> OrderedDict(key -> png bytes)
+
+
+def render_png(tactical_map: TacticalMap, viewport: Optional[Tuple[int, int, int, int]] = None,
+               fog: Optional[bytes] = None, highlight: Optional[str] = None,
+               tile: int = TILE_SIZE) -> Optional[bytes]:
+    """
+    Render the map (or the ``viewport`` box of squares) as PNG bytes.
+
+    Args:
+        tactical_map: Map to draw
+        viewport: (x1, y1, x2, y2) inclusive squares, whole map if None
+        fog: Fog levels from utils.visibility.fog_view (no fog if None)
+        highlight: Token name to ring in gold (e.g. the active combatant)
+        tile: Pixel size of one square
+
+    Returns:
+        PNG bytes, or None if Pillow isn't installed
+    """
+    if not PIL_AVAILABLE:
+        return None
+    key = _cache_key(tactical_map, viewport, fog, highlight, tile)
+    png = _cached(tactical_map, key)
+    if png is None:
+        png = _draw(tactical_map, key[1], fog, highlight, tile)
+        _store(tactical_map, key, png)
+    return png
+
+
+async def render_png_async(tactical_map: TacticalMap, viewport: Optional[Tuple[int, int, int, int]] = None,
+                           fog: Optional[bytes] = None, highlight: Optional[str] = None,
+                           tile: int = TILE_SIZE) -> Optional[bytes]:
+    """
+    ``render_png`` for the event loop: cache hits return straight away, misses
+    draw a copy of the map (taken here, on the loop) in a worker thread.
+    """
+    if not PIL_AVAILABLE:
+        return None
+    key = _cache_key(tactical_map, viewport, fog, highlight, tile)
+    png = _cached(tactical_map, key)
+    if png is None:
+        snapshot = TacticalMap.from_dict(tactical_map.to_dict())
+        png = await asyncio.to_thread(_draw, snapshot, key[1], fog, highlight, tile)
+        _store(tactical_map, key, png)
+    return png
+
+
+def _cache_key(tactical_map: TacticalMap, viewport, fog, highlight, tile):
+    box = viewport or (0, 0, tactical_map.width - 1, tactical_map.height - 1)
+    box = (max(0, box[0]), max(0, box[1]),
+           min(tactical_map.width - 1, box[2]), min(tactical_map.height - 1, box[3]))
+    return (tactical_map.version, box, fog, (highlight or "").lower(), tile)
+
+
+def _cached(tactical_map: TacticalMap, key) -> Optional[bytes]:
+    cache = _png_cache.get(tactical_map)
+    png = cache.get(key) if cache is not None else None
+    if png is not None:
+        cache.move_to_end(key)
+    return png
+
+
+def _store(tactical_map: TacticalMap, key, png: bytes):
+    cache = _png_cache.get(tactical_map)
+    if cache is None:
+        cache = _png_cache[tactical_map] = OrderedDict()
+    cache[key] = png
+    while len(cache) > CACHE_PER_MAP:
+        cache.popitem(last=False)
+
+
+def _draw(tactical_map: TacticalMap, box, fog: Optional[bytes], highlight: Optional[str],
+          tile: int) -> bytes:
+    img = _terrain_layer(tactical_map, box, tile)
+    if fog is not None:
+        img = _apply_fog(img, fog, tactical_map, box, tile)
+
+    x1, y1, x2, y2 = box
+    highlight = (highlight or "").lower()
+    for token in tactical_map.get_tokens_in_rect(x1, y1, x2, y2):
+        if fog is not None and fog[token.y * tactical_map.width + token.x] < 2:
+            continue
+        sprite = token_sprite(token.token_type, token.name[0].upper(), token.size, tile,
+                              token.name.lower() == highlight)
+        img.paste(sprite, ((token.x - x1) * tile, (token.y - y1) * tile), sprite)
+
+    img = _labels(img, box, tile)
+    out = io.BytesIO()
+    img.save(out, format="PNG", optimize=False, compress_level=6)
+    return out.getvalue()
@@ -1,17 +1,36 @@
 """
 Tactical Map Manager - Grid-based combat maps with token positions
+
+Terrain is stored as one byte per square (an index into TERRAIN_CODES) in a
+row-major bytearray. With NumPy installed ``TacticalMap.array`` is a zero-copy
+(height, width) uint8 view of it, so region fills and whole-map queries are
+vectorized. On disk the grid is zlib-compressed and base64-encoded, which keeps
+even 200x200 maps to a few kilobytes.
 """
 
 import os
 import json
+import zlib
+import base64
+import logging
+from types import MappingProxyType
 from typing import Optional, List, Dict, Any, Tuple
 from threading import Lock
 from dataclasses import dataclass, asdict
 
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
 MAPS_DIR = os.path.join(os.path.dirname(__file__), '..', 'maps')
 os.makedirs(MAPS_DIR, exist_ok=True)
 
 _map_locks = {}
+_maps = {}  # channel_id -> (file mtime_ns, TacticalMap) for maps already in memory
 
 
 # ============ DATA CLASSES ============
@@ -66,6 +85,39 @@ TERRAIN_TYPES = {
     "ice": {"symbol": "=", "passable": True, "difficult": True, "name": "Ice"},
 }
 
+# Terrain code = index in this tuple; code 0 (floor) is the default fill.
+# Saved maps store these codes, so the table is append-only: never reorder or
+# remove an entry, add new terrain types at the end.
+TERRAIN_CODES = (
+    "floor", "wall", "water", "difficult", "pit", "door", "door_locked",
+    "stairs_up", "stairs_down", "rubble", "pillar", "tree", "bush", "lava", "ice",
+)
+assert set(TERRAIN_CODES) == set(TERRAIN_TYPES), "every terrain type needs a code in TERRAIN_CODES"
+TERRAIN_INDEX = {name: code for code, name in enumerate(TERRAIN_CODES)}
+
+# bytes.translate() table from terrain code to its ASCII map symbol
+_SYMBOL_TABLE = bytes(
+    ord(TERRAIN_TYPES[TERRAIN_CODES[code]]["symbol"]) if code < len(TERRAIN_CODES) else ord("?")
+    for code in range(256)
+)
+
+# Old maps stored symbols; "O" is shared by pit and pillar and reads back as the first (pit)
+_SYMBOL_TO_CODE = {}
+for _code, _name in enumerate(TERRAIN_CODES):
+    _SYMBOL_TO_CODE.setdefault(TERRAIN_TYPES[_name]["symbol"], _code)
+
+GRID_ENCODING = "zlib+base64"
+
+
+def encode_grid(cells: bytes) -> str:
+    """Compress raw terrain codes for JSON storage."""
+    return base64.b64encode(zlib.compress(bytes(cells), 9)).decode("ascii")
+
+
+def decode_grid(data: str) -> bytearray:
+    return bytearray(zlib.decompress(base64.b64decode(data)))
+
+
 TOKEN_SYMBOLS = {
     "player": {"symbol": "●", "color": "🔵"},
     "enemy": {"symbol": "◆", "color": "🔴"},
@@ -82,6 +134,86 @@ SIZE_NAMES = {
 }
 
 
+# ============ SPATIAL INDEX ============
+
+def footprint_gap(a: Token, b: Token) -> int:
+    """Squares between two token footprints (Chebyshev; 0 = overlapping, 1 = adjacent)."""
+    dx = max(0, a.x - (b.x + b.size - 1), b.x - (a.x + a.size - 1))
+    dy = max(0, a.y - (b.y + b.size - 1), b.y - (a.y + a.size - 1))
+    return max(dx, dy)
+
+
+class SpatialIndex:
+    """
+    Token lookup by occupied square.
+
+    ``cells`` maps every square a token's footprint covers to the token keys
+    there, for exact lookups. ``buckets`` groups the same keys into coarse
+    BUCKET-sized blocks so range and rectangle queries only look at tokens in
+    the nearby blocks instead of every token on the map.
+    """
+
+    BUCKET = 8
+
+    def __init__(self):
+        self.cells: Dict[Tuple[int, int], List[str]] = {}
+        self.buckets: Dict[Tuple[int, int], set] = {}
+        self._footprints: Dict[str, List[Tuple[int, int]]] = {}
+
+    @staticmethod
+    def footprint(token: Token) -> List[Tuple[int, int]]:
+        size = max(1, token.size)
+        return [(token.x + dx, token.y + dy) for dy in range(size) for dx in range(size)]
+
+    def insert(self, key: str, token: Token):
+        self.remove(key)
+        cells = self.footprint(token)
+        self._footprints[key] = cells
+        b = self.BUCKET
+        for cell in cells:
+            self.cells.setdefault(cell, []).append(key)
+            self.buckets.setdefault((cell[0] // b, cell[1] // b), set()).add(key)
+
+    def remove(self, key: str):
+        cells = self._footprints.pop(key, None)
+        if not cells:
+            return
+        b = self.BUCKET
+        for cell in cells:
+            keys = self.cells.get(cell)
+            if keys and key in keys:
+                keys.remove(key)
+                if not keys:
+                    del self.cells[cell]
+            bucket = (cell[0] // b, cell[1] // b)
+            members = self.buckets.get(bucket)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del self.buckets[bucket]
+
+    def at(self, x: int, y: int) -> List[str]:
+        return self.cells.get((x, y), [])
+
+    def in_rect(self, x1: int, y1: int, x2: int, y2: int) -> set:
+        """Keys of tokens whose footprint touches the rectangle (inclusive corners)."""
+        b = self.BUCKET
+        found = set()
+        for by in range(y1 // b, y2 // b + 1):
+            for bx in range(x1 // b, x2 // b + 1):
+                for key in self.buckets.get((bx, by), ()):
+                    if key in found:
+                        continue
+                    if any(x1 <= cx <= x2 and y1 <= cy <= y2 for cx, cy in self._footprints[key]):
+                        found.add(key)
+        return found
+
+    def clear(self):
+        self.cells.clear()
+        self.buckets.clear()
+        self._footprints.clear()
+
+
 # ============ MAP CLASS ============
 
 class TacticalMap:
@@ -91,46 +223,152 @@ class TacticalMap:
         self.name = name
         self.width = width
         self.height = height
-        self.grid: List[List[str]] = [["." for _ in range(width)] for _ in range(height)]
+        self.cells = bytearray(width * height)  # terrain codes, row-major
         self.tokens: Dict[str, Token] = {}  # name -> Token
         self.notes: str = ""
         self.scale: int = 5  # 5 feet per square
+        self.diagonal_rule: str = "standard"  # or "5-10-5" (DMG variant)
+        self.terrain_version: int = 0  # bumped on every terrain edit
+        # Fog of war per player token (see utils.visibility)
+        self.explored: Dict[str, bytearray] = {}  # token key -> squares seen so far
+        self.fog_origin: Dict[str, Tuple[int, int, int]] = {}  # token key -> (x, y, size) last cast from
+        self.fog_version: int = 0  # terrain_version the fog was last cast against
+        self.version: int = 0  # bumped on any change that affects rendering
+        self._index = SpatialIndex()
+        self._rows: List[Optional[str]] = [None] * height  # memoized rendered rows
+        self._rendered: Dict[Any, Tuple[Any, str]] = {}  # render variant -> (version key, text)
     
     def to_dict(self) -> dict:
         return {
             "name": self.name,
             "width": self.width,
             "height": self.height,
-            "grid": self.grid,
+            "terrain": {"encoding": GRID_ENCODING, "data": encode_grid(self.cells)},
             "tokens": {name: t.to_dict() for name, t in self.tokens.items()},
             "notes": self.notes,
             "scale": self.scale,
+            "version": self.version,
+            "diagonal_rule": self.diagonal_rule,
+            "fog": {
+                key: {"at": list(self.fog_origin.get(key, ())), "seen": encode_grid(mask)}
+                for key, mask in self.explored.items()
+            },
         }
     
     @classmethod
     def from_dict(cls, data: dict) -> 'TacticalMap':
+        """Rebuild a saved map. Raises ValueError if the terrain doesn't match its size."""
         map_obj = cls(
             width=data.get("width", 20),
             height=data.get("height", 15),
             name=data.get("name", "Battle Map")
         )
-        map_obj.grid = data.get("grid", map_obj.grid)
+        terrain = data.get("terrain")
+        if terrain and terrain.get("encoding") == GRID_ENCODING:
+            cells = decode_grid(terrain["data"])
+            if len(cells) != len(map_obj.cells):
+                raise ValueError(
+                    f"terrain has {len(cells)} squares, expected "
+                    f"{map_obj.width}x{map_obj.height}"
+                )
+            map_obj.cells = cells
+        elif "grid" in data:
+            # Older saves: nested lists of symbols
+            map_obj._load_symbol_rows(data["grid"])
         map_obj.tokens = {
             name: Token.from_dict(t) for name, t in data.get("tokens", {}).items()
         }
+        map_obj.reindex()
         map_obj.notes = data.get("notes", "")
         map_obj.scale = data.get("scale", 5)
+        map_obj.diagonal_rule = data.get("diagonal_rule", "standard")
+        map_obj.version = data.get("version", 0)
+        for key, fog in data.get("fog", {}).items():
+            mask = decode_grid(fog["seen"])
+            if len(mask) == len(map_obj.cells):
+                map_obj.explored[key] = mask
+                if len(fog.get("at", ())) == 3:
+                    map_obj.fog_origin[key] = tuple(fog["at"])
         return map_obj
     
+    def _load_symbol_rows(self, rows):
+        for y, row in enumerate(rows[:self.height]):
+            codes = bytes(_SYMBOL_TO_CODE.get(symbol, 0) for symbol in row[:self.width])
+            start = y * self.width
+            self.cells[start:start + len(codes)] = codes
+        self.terrain_version += 1
+        self._touch()
+    
+    # ---- terrain access ----
+    
+    @property
+    def array(self):
+        """(height, width) uint8 NumPy view of the terrain codes (None without NumPy)."""
+        if not NUMPY_AVAILABLE:
+            return None
+        return np.frombuffer(self.cells, dtype=np.uint8).reshape(self.height, self.width)
+    
+    @property
+    def grid(self) -> List[List[str]]:
+        """Terrain symbols as nested lists (read-only snapshot, for older callers)."""
+        return [list(self.row_symbols(y)) for y in range(self.height)]
+    
+    def terrain_code(self, x: int, y: int) -> int:
+        return self.cells[y * self.width + x]
+    
+    def get_terrain(self, x: int, y: int) -> Optional[str]:
+        """Terrain name at a position, or None out of bounds."""
+        if not self._in_bounds(x, y):
+            return None
+        return TERRAIN_CODES[self.cells[y * self.width + x]]
+    
+    def row_symbols(self, y: int) -> str:
+        """ASCII symbols for one row of terrain."""
+        start = y * self.width
+        return self.cells[start:start + self.width].translate(_SYMBOL_TABLE).decode("ascii")
+    
     def set_terrain(self, x: int, y: int, terrain: str) -> bool:
         """Set terrain at a position."""
         if not self._in_bounds(x, y):
             return False
         
-        terrain_data = TERRAIN_TYPES.get(terrain, TERRAIN_TYPES["floor"])
-        self.grid[y][x] = terrain_data["symbol"]
+        self.cells[y * self.width + x] = TERRAIN_INDEX.get(terrain, 0)
+        self.terrain_version += 1
+        self._touch(y, y)
         return True
     
+    def fill_terrain(self, x1: int, y1: int, x2: int, y2: int, terrain: str) -> int:
+        """
+        Set terrain for every square in the rectangle between two corners
+        (inclusive, clipped to the map). Returns the number of squares changed.
+        """
+        x1, x2 = sorted((x1, x2))
+        y1, y2 = sorted((y1, y2))
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, self.width - 1), min(y2, self.height - 1)
+        if x1 > x2 or y1 > y2:
+            return 0
+        
+        code = TERRAIN_INDEX.get(terrain, 0)
+        arr = self.array
+        if arr is not None:
+            arr[y1:y2 + 1, x1:x2 + 1] = code
+        else:
+            row = bytes([code]) * (x2 - x1 + 1)
+            for y in range(y1, y2 + 1):
+                start = y * self.width + x1
+                self.cells[start:start + len(row)] = row
+        self.terrain_version += 1
+        self._touch(y1, y2)
+        return (x2 - x1 + 1) * (y2 - y1 + 1)
+    
+    def fill_border(self, terrain: str = "wall"):
+        """Set the outermost ring of squares (e.g. room walls)."""
+        self.fill_terrain(0, 0, self.width - 1, 0, terrain)
+        self.fill_terrain(0, self.height - 1, self.width - 1, self.height - 1, terrain)
+        self.fill_terrain(0, 0, 0, self.height - 1, terrain)
+        self.fill_terrain(self.width - 1, 0, self.width - 1, self.height - 1, terrain)
+    
     def add_token(self, name: str, x: int, y: int, token_type: str = "player", size: int = 1) -> Optional[Token]:
         """Add a token to the map."""
         if not self._in_bounds(x, y):
@@ -145,17 +383,30 @@ class TacticalMap:
             symbol=symbol_data["symbol"],
             size=size
         )
+        replaced = self.tokens.get(name.lower())
+        if replaced:
+            self._touch_token(replaced)
         self.tokens[name.lower()] = token
+        self._index.insert(name.lower(), token)
+        self._touch_token(token)
         return token
     
     def remove_token(self, name: str) -> bool:
         """Remove a token from the map."""
         name_lower = name.lower()
         if name_lower in self.tokens:
-            del self.tokens[name_lower]
+            self._touch_token(self.tokens.pop(name_lower))
+            self._index.remove(name_lower)
             return True
         return False
     
+    def reindex(self):
+        """Rebuild the spatial index (after replacing or editing ``tokens`` directly)."""
+        self._index.clear()
+        for key, token in self.tokens.items():
+            self._index.insert(key, token)
+        self._touch()
+    
     def move_token(self, name: str, x: int, y: int) -> Optional[Tuple[int, int]]:
         """Move a token to a new position. Returns old position or None."""
         name_lower = name.lower()
@@ -167,8 +418,11 @@ class TacticalMap:
         
         token = self.tokens[name_lower]
         old_pos = (token.x, token.y)
+        self._touch_token(token)
         token.x = x
         token.y = y
+        self._index.insert(name_lower, token)
+        self._touch_token(token)
         return old_pos
     
     def get_token(self, name: str) -> Optional[Token]:
@@ -176,11 +430,20 @@ class TacticalMap:
         return self.tokens.get(name.lower())
     
     def get_token_at(self, x: int, y: int) -> Optional[Token]:
-        """Get the token at a position."""
-        for token in self.tokens.values():
-            if token.x == x and token.y == y:
-                return token
-        return None
+        """Get the token occupying a position (any square of its footprint)."""
+        keys = self._index.at(x, y)
+        return self.tokens[keys[-1]] if keys else None
+    
+    def get_tokens_in_rect(self, x1: int, y1: int, x2: int, y2: int) -> List[Token]:
+        """Tokens whose footprint touches the rectangle between two corners."""
+        x1, x2 = sorted((x1, x2))
+        y1, y2 = sorted((y1, y2))
+        return [self.tokens[k] for k in self._index.in_rect(x1, y1, x2, y2)]
+    
+    @property
+    def occupied_squares(self):
+        """Read-only live view of (x, y) -> keys of the tokens covering that square."""
+        return MappingProxyType(self._index.cells)
     
     def get_distance(self, name1: str, name2: str) -> Optional[int]:
         """Get distance in feet between two tokens (D&D diagonal = 5ft)."""
@@ -190,96 +453,135 @@ class TacticalMap:
         if not t1 or not t2:
             return None
         
-        # D&D uses "every second diagonal costs 10ft" but simplified here
-        dx = abs(t1.x - t2.x)
-        dy = abs(t1.y - t2.y)
-        
-        # Use diagonal distance (Chebyshev distance for simplicity)
-        squares = max(dx, dy)
-        return squares * self.scale
+        # Chebyshev distance between the nearest squares of each footprint
+        return footprint_gap(t1, t2) * self.scale
     
-    def get_tokens_in_range(self, name: str, range_feet: int) -> List[Token]:
-        """Get all tokens within range of a token."""
+    def get_tokens_in_range(self, name: str, range_feet: int, visible_only: bool = False) -> List[Token]:
+        """Get all tokens within range of a token (optionally only those it can see)."""
         center = self.get_token(name)
         if not center:
             return []
         
-        range_squares = range_feet // self.scale
-        in_range = []
-        
-        for token in self.tokens.values():
-            if token.name.lower() == name.lower():
-                continue
-            
-            dx = abs(token.x - center.x)
-            dy = abs(token.y - center.y)
-            distance = max(dx, dy)
-            
-            if distance <= range_squares:
-                in_range.append(token)
+        r = range_feet // self.scale
+        size = max(1, center.size)
+        candidates = self._index.in_rect(center.x - r, center.y - r, center.x + size - 1 + r, center.y + size - 1 + r)
         
+        key = name.lower()
+        in_range = [
+            self.tokens[k] for k in candidates
+            if k != key and footprint_gap(center, self.tokens[k]) <= r
+        ]
+        if visible_only:
+            from utils.visibility import has_line_of_sight
+            in_range = [t for t in in_range if has_line_of_sight(self, center, t)]
         return in_range
     
-    def render(self, show_coordinates: bool = True) -> str:
-        """Render the map as ASCII art."""
-        lines = []
+    def get_adjacent_tokens(self, name: str) -> List[Token]:
+        """Tokens within 5 feet (touching squares, including diagonals)."""
+        return self.get_tokens_in_range(name, self.scale)
+    
+    # ---- rendering ----
+    
+    def _touch(self, y1: int = 0, y2: Optional[int] = None):
+        """Bump the map version and drop cached rows y1..y2 (all rows by default)."""
+        self.version += 1
+        last = self.height - 1 if y2 is None else min(y2, self.height - 1)
+        for y in range(max(y1, 0), last + 1):
+            self._rows[y] = None
+    
+    def _touch_token(self, token: Token):
+        self._touch(token.y, token.y + max(1, token.size) - 1)
+    
+    def _row(self, y: int) -> str:
+        """Terrain symbols for one row with token letters drawn in (memoized until the row changes)."""
+        row = self._rows[y]
+        if row is None:
+            chars = list(self.row_symbols(y))
+            for key in self._index.in_rect(0, y, self.width - 1, y):
+                token = self.tokens[key]
+                for x in range(token.x, min(token.x + max(1, token.size), self.width)):
+                    # Overlapping footprints show the most recently placed token
+                    top = self.tokens[self._index.at(x, y)[-1]]
+                    chars[x] = top.name[0].upper()
+            row = self._rows[y] = "".join(chars)
+        return row
+    
+    def _fogged_row(self, y: int, overlay: Optional[Dict[Tuple[int, int], str]],
+                    fog: Optional[bytes]) -> str:
+        occupied = self._index.cells
+        start = y * self.width
+        chars = []
+        for x, symbol in enumerate(self.row_symbols(y)):
+            level = fog[start + x] if fog is not None else 2
+            keys = occupied.get((x, y)) if level == 2 else None
+            if not level:
+                chars.append(" ")
+            elif keys:
+                chars.append(self.tokens[keys[-1]].name[0].upper())
+            elif overlay and (x, y) in overlay:
+                chars.append(overlay[(x, y)])
+            else:
+                chars.append(symbol)
+        return "".join(chars)
+    
+    def render(self, show_coordinates: bool = True,
+               overlay: Optional[Dict[Tuple[int, int], str]] = None,
+               fog: Optional[bytes] = None) -> str:
+        """
+        Render the map as ASCII art, optionally drawing ``overlay`` symbols on
+        empty squares. With ``fog`` (levels from utils.visibility.fog_view)
+        unseen squares are blank and tokens only show where currently visible.
         
-        # Header with column numbers
-        if show_coordinates:
-            header = "   "
-            for x in range(self.width):
-                header += str(x % 10)
-            lines.append(header)
-            lines.append("  +" + "-" * self.width + "+")
+        Plain renders are cached until the map version changes, and rows are
+        memoized individually so a token move only rebuilds the rows it touched.
+        """
+        plain = overlay is None and fog is None
+        if plain:
+            cached = self._rendered.get(show_coordinates)
+            if cached and cached[0] == self.version:
+                return cached[1]
+            rows = [self._row(y) for y in range(self.height)]
         else:
-            lines.append("+" + "-" * self.width + "+")
+            rows = [self._fogged_row(y, overlay, fog) for y in range(self.height)]
         
-        # Build token position lookup
-        token_positions = {}
-        for token in self.tokens.values():
-            token_positions[(token.x, token.y)] = token
-        
-        # Render each row
-        for y in range(self.height):
-            if show_coordinates:
-                row = f"{y:2d}|"
-            else:
-                row = "|"
-            
-            for x in range(self.width):
-                if (x, y) in token_positions:
-                    token = token_positions[(x, y)]
-                    # Use first letter of name or symbol
-                    row += token.name[0].upper()
-                else:
-                    row += self.grid[y][x]
-            
-            row += "|"
-            lines.append(row)
-        
-        # Footer
+        border = "+" + "-" * self.width + "+"
         if show_coordinates:
-            lines.append("  +" + "-" * self.width + "+")
+            digits = "0123456789" * (self.width // 10 + 1)
+            lines = ["   " + digits[:self.width], "  " + border]
+            lines.extend(f"{y:2d}|{row}|" for y, row in enumerate(rows))
+            lines.append("  " + border)
         else:
-            lines.append("+" + "-" * self.width + "+")
+            lines = [border]
+            lines.extend(f"|{row}|" for row in rows)
+            lines.append(border)
+        text = "\n".join(lines)
         
-        return "\n".join(lines)
+        if plain:
+            self._rendered[show_coordinates] = (self.version, text)
+        return text
     
     def render_discord(self) -> str:
         """Render map with Discord-friendly formatting."""
-        output = f"**🗺️ {self.name}** ({self.width}x{self.height}, {self.scale}ft/square)\n"
-        output += "```\n"
-        output += self.render(show_coordinates=True)
-        output += "\n```\n"
+        key = (self.version, self.name, self.scale)
+        cached = self._rendered.get("discord")
+        if cached and cached[0] == key:
+            return cached[1]
+        
+        parts = [
+            f"**🗺️ {self.name}** ({self.width}x{self.height}, {self.scale}ft/square)\n",
+            "```\n", self.render(show_coordinates=True), "\n```\n",
+        ]
         
         # Token legend
         if self.tokens:
-            output += "**Tokens:**\n"
+            parts.append("**Tokens:**\n")
             for token in self.tokens.values():
-                emoji = TOKEN_SYMBOLS.get(token.type, TOKEN_SYMBOLS["player"])["color"]
+                emoji = TOKEN_SYMBOLS.get(token.token_type, TOKEN_SYMBOLS["player"])["color"]
                 size_str = f" ({SIZE_NAMES.get(token.size, 'Medium')})" if token.size > 1 else ""
-                output += f"{emoji} **{token.name[0].upper()}** = {token.name} at ({token.x},{token.y}){size_str}\n"
+                parts.append(f"{emoji} **{token.name[0].upper()}** = {token.name} at ({token.x},{token.y}){size_str}\n")
         
+        output = "".join(parts)
+        self._rendered["discord"] = (key, output)
         return output
     
     def _in_bounds(self, x: int, y: int) -> bool:
@@ -294,17 +596,30 @@ def _get_map_path(channel_id: str) -> str:
 
 
 def load_map(channel_id: str) -> Optional[TacticalMap]:
-    """Load the tactical map for a channel."""
+    """
+    Load the tactical map for a channel. The parsed map stays in memory (with
+    its render and pathing caches) until the file changes on disk.
+    """
     path = _get_map_path(channel_id)
-    if not os.path.exists(path):
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        _maps.pop(channel_id, None)
         return None
     
+    cached = _maps.get(channel_id)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    
     try:
         with open(path, 'r', encoding='utf-8') as f:
             data = json.load(f)
-            return TacticalMap.from_dict(data)
-    except:
+            map_obj = TacticalMap.from_dict(data)
+    except Exception as e:
+        logger.error(f"Failed to load map for {channel_id}: {e}")
         return None
+    _maps[channel_id] = (mtime, map_obj)
+    return map_obj
 
 
 def save_map(channel_id: str, map_obj: TacticalMap):
@@ -312,14 +627,20 @@ def save_map(channel_id: str, map_obj: TacticalMap):
     path = _get_map_path(channel_id)
     lock = _map_locks.setdefault(channel_id, Lock())
     
+    # Record what player tokens can see from where they now stand
+    from utils.visibility import update_fog
+    update_fog(map_obj)
+    
     with lock:
         with open(path, 'w', encoding='utf-8') as f:
             json.dump(map_obj.to_dict(), f, indent=2)
+        _maps[channel_id] = (os.stat(path).st_mtime_ns, map_obj)
 
 
 def delete_map(channel_id: str) -> bool:
     """Delete the map for a channel."""
     path = _get_map_path(channel_id)
+    _maps.pop(channel_id, None)
     if os.path.exists(path):
         os.remove(path)
         return True
@@ -333,16 +654,10 @@ def create_dungeon_room(width: int = 15, height: int = 10, name: str = "Dungeon
     map_obj = TacticalMap(width, height, name)
     
     # Walls around the edges
-    for x in range(width):
-        map_obj.grid[0][x] = "#"
-        map_obj.grid[height-1][x] = "#"
-    
-    for y in range(height):
-        map_obj.grid[y][0] = "#"
-        map_obj.grid[y][width-1] = "#"
+    map_obj.fill_border("wall")
     
     # Door in the middle of the south wall
-    map_obj.grid[height-1][width//2] = "+"
+    map_obj.set_terrain(width//2, height-1, "door")
     
     return map_obj
 
@@ -355,21 +670,21 @@ def create_forest_clearing(width: int = 20, height: int = 15, name: str = "Fores
     import random
     for x in range(width):
         if random.random() < 0.3:
-            map_obj.grid[0][x] = "T"
+            map_obj.set_terrain(x, 0, "tree")
         if random.random() < 0.3:
-            map_obj.grid[height-1][x] = "T"
+            map_obj.set_terrain(x, height-1, "tree")
     
     for y in range(1, height-1):
         if random.random() < 0.3:
-            map_obj.grid[y][0] = "T"
+            map_obj.set_terrain(0, y, "tree")
         if random.random() < 0.3:
-            map_obj.grid[y][width-1] = "T"
+            map_obj.set_terrain(width-1, y, "tree")
     
     # A few bushes scattered around
     for _ in range(5):
         x = random.randint(3, width-4)
         y = random.randint(3, height-4)
-        map_obj.grid[y][x] = "*"
+        map_obj.set_terrain(x, y, "bush")
     
     return map_obj
 
@@ -379,29 +694,23 @@ def create_tavern(width: int = 20, height: int = 15, name: str = "Tavern") -> Ta
     map_obj = TacticalMap(width, height, name)
     
     # Walls
-    for x in range(width):
-        map_obj.grid[0][x] = "#"
-        map_obj.grid[height-1][x] = "#"
-    for y in range(height):
-        map_obj.grid[y][0] = "#"
-        map_obj.grid[y][width-1] = "#"
+    map_obj.fill_border("wall")
     
     # Door at bottom
-    map_obj.grid[height-1][width//2] = "+"
+    map_obj.set_terrain(width//2, height-1, "door")
     
     # Bar counter (represented as pillars)
     bar_y = 3
-    for x in range(3, 10):
-        map_obj.grid[bar_y][x] = "O"
+    map_obj.fill_terrain(3, bar_y, min(9, width-2), bar_y, "pillar")
     
     # Some tables (pillars)
     tables = [(5, 8), (10, 8), (15, 8), (5, 11), (10, 11), (15, 11)]
     for tx, ty in tables:
         if 0 < tx < width-1 and 0 < ty < height-1:
-            map_obj.grid[ty][tx] = "O"
+            map_obj.set_terrain(tx, ty, "pillar")
     
     # Stairs up in corner
-    map_obj.grid[1][width-2] = "<"
+    map_obj.set_terrain(width-2, 1, "stairs_up")
     
     return map_obj
 
@@ -411,9 +720,7 @@ def create_cave(width: int = 25, height: int = 18, name: str = "Cave") -> Tactic
     map_obj = TacticalMap(width, height, name)
     
     # Fill with walls
-    for y in range(height):
-        for x in range(width):
-            map_obj.grid[y][x] = "#"
+    map_obj.fill_terrain(0, 0, width-1, height-1, "wall")
     
     # Carve out irregular cave shape
     import random
@@ -426,24 +733,23 @@ def create_cave(width: int = 25, height: int = 18, name: str = "Cave") -> Tactic
             dy = abs(y - center_y)
             # Irregular ellipse
             if (dx / (width/3))**2 + (dy / (height/3))**2 < 1 + random.random() * 0.3:
-                map_obj.grid[y][x] = "."
+                map_obj.set_terrain(x, y, "floor")
     
     # Entrance tunnel
-    for y in range(height-3, height):
-        map_obj.grid[y][center_x] = "."
+    map_obj.fill_terrain(center_x, height-3, center_x, height-1, "floor")
     
     # Some rubble
     for _ in range(8):
         x = random.randint(4, width-5)
         y = random.randint(4, height-5)
-        if map_obj.grid[y][x] == ".":
-            map_obj.grid[y][x] = "^"
+        if map_obj.get_terrain(x, y) == "floor":
+            map_obj.set_terrain(x, y, "rubble")
     
     # A pit
     pit_x = random.randint(5, width-6)
     pit_y = random.randint(5, height-6)
-    if map_obj.grid[pit_y][pit_x] == ".":
-        map_obj.grid[pit_y][pit_x] = "O"
+    if map_obj.get_terrain(pit_x, pit_y) == "floor":
+        map_obj.set_terrain(pit_x, pit_y, "pit")
     
     return map_obj
 
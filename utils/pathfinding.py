@@ -0,0 +1,307 @@
+"""
+Pathfinding
+Movement costs, shortest paths and reachable squares on a TacticalMap.
+
+Searches run over flat square indices. Whether a terrain code can be walked on, and whether it is difficult terrain, comes from byte
+tables built once from ``TERRAIN_TYPES``; each map gets a passability bitmap
+per creature size (a Large creature needs all four squares of its footprint
+clear) that is reused until the map's terrain changes.
+
+Diagonal movement follows the PHB rule (every square costs 5 ft) unless the
+map uses the DMG variant, where every second diagonal costs 10 ft. Entering
+difficult terrain costs double.
+"""
+
+import heapq
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from weakref import WeakKeyDictionary
+
+from utils.map_manager import TERRAIN_CODES, TERRAIN_TYPES, TacticalMap, Token, SpatialIndex
+
+DIAGONAL_STANDARD = "standard"   # PHB: diagonals cost the same as straight moves
+DIAGONAL_ALTERNATE = "5-10-5"    # DMG variant: every second diagonal costs double
+DIAGONAL_RULES = (DIAGONAL_STANDARD, DIAGONAL_ALTERNATE)
+
+
+def _terrain_table(flag: str) -> bytes:
+    return bytes(
+        1 if code < len(TERRAIN_CODES) and TERRAIN_TYPES[TERRAIN_CODES[code]].get(flag) else 0
+        for code in range(256)
+    )
+
+
+# bytes.translate() tables from terrain code to 0/1
+PASSABLE_TABLE = _terrain_table("passable")
+DIFFICULT_TABLE = _terrain_table("difficult")
+
+# (dx, dy) for the eight neighbouring squares, straight moves first
+STEPS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+
+# Token types that stand in each other's way; objects block everyone
+SIDES = {"player": "party", "npc": "party", "enemy": "hostile", "boss": "hostile"}
+
+
+class Path(NamedTuple):
+    squares: List[Tuple[int, int]]  # start to goal, inclusive
+    cost: int                       # feet
+
+    @property
+    def steps(self) -> int:
+        return len(self.squares) - 1
+
+
+class MoveGrid:
+    """
+    Passability and difficult-terrain bitmaps for one creature size.
+
+    The bitmaps carry a one-square closed border (row stride ``width + 2``) so
+    neighbour lookups never need a bounds check; ``index``/``square`` convert
+    between map coordinates and bitmap indices.
+    """
+
+    __slots__ = ('width', 'height', 'size', 'stride', 'open', 'difficult', 'steps')
+
+    def __init__(self, tactical_map: TacticalMap, size: int = 1):
+        self.width = w = tactical_map.width
+        self.height = h = tactical_map.height
+        self.size = size = max(1, size)
+        self.stride = stride = w + 2
+        passable = tactical_map.cells.translate(PASSABLE_TABLE)
+        difficult = tactical_map.cells.translate(DIFFICULT_TABLE)
+        if size > 1:
+            passable = _footprint_bytes(passable, w, size, all_of=True)
+            difficult = _footprint_bytes(difficult, w, size, all_of=False)
+
+        is_open = bytearray(stride * (h + 2))
+        is_difficult = bytearray(stride * (h + 2))
+        fit = w - size + 1  # columns where the footprint stays on the map
+        for y in range(h - size + 1):
+            row = (y + 1) * stride + 1
+            is_open[row:row + fit] = passable[y * w:y * w + fit]
+            is_difficult[row:row + fit] = difficult[y * w:y * w + fit]
+        self.open = bytes(is_open)
+        self.difficult = bytes(is_difficult)
+        # (index offset, is diagonal, straight-neighbour offsets) per step
+        self.steps = tuple(
+            (dy * stride + dx, bool(dx and dy), dx, dy * stride) for dx, dy in STEPS
+        )
+
+    def index(self, x: int, y: int) -> int:
+        return (y + 1) * self.stride + x + 1
+
+    def square(self, index: int) -> Tuple[int, int]:
+        return index % self.stride - 1, index // self.stride - 1
+
+    def contains(self, x: int, y: int) -> bool:
+        return 0 <= x < self.width and 0 <= y < self.height
+
+
+def _footprint_bytes(cells: bytes, width: int, size: int, all_of: bool) -> bytes:
+    """
+    For 0/1 cells, whether all (or any) of the ``size`` x ``size`` block
+    starting at each square is 1. The grid is packed into one integer (a byte
+    per square) so each shift-and-combine covers the whole map at once;
+    results for blocks that run off the right or bottom edge are meaningless
+    and ignored by the caller.
+    """
+    combine = int.__and__ if all_of else int.__or__
+    acc = packed = int.from_bytes(cells, 'little')
+    for dx in range(1, size):
+        acc = combine(acc, packed >> (8 * dx))
+    rows = acc
+    for dy in range(1, size):
+        acc = combine(acc, rows >> (8 * width * dy))
+    return acc.to_bytes(len(cells), 'little')
+
+
+_grids = WeakKeyDictionary()  # TacticalMap -> (terrain_version, {size: MoveGrid})
+
+
+def get_move_grid(tactical_map: TacticalMap, size: int = 1) -> MoveGrid:
+    """The cached MoveGrid for a map and creature size, rebuilt after terrain edits."""
+    version, by_size = _grids.get(tactical_map, (None, None))
+    if version != tactical_map.terrain_version:
+        by_size = {}
+        _grids[tactical_map] = (tactical_map.terrain_version, by_size)
+    grid = by_size.get(size)
+    if grid is None:
+        grid = by_size[size] = MoveGrid(tactical_map, size)
+    return grid
+
+
+def _footprint_starts(token: Token, size: int) -> Iterable[Tuple[int, int]]:
+    """Top-left squares from which a ``size`` creature would overlap ``token``."""
+    for cx, cy in SpatialIndex.footprint(token):
+        for dy in range(size):
+            for dx in range(size):
+                yield cx - dx, cy - dy
+
+
+def token_obstacles(tactical_map: TacticalMap, mover: Token) -> Tuple[Set[Tuple[int, int]], Set[Tuple[int, int]]]:
+    """
+    Squares the mover can't enter (hostile creatures and objects) and squares
+    it may pass through but not stop on (allies), as top-left squares for the
+    mover's size.
+    """
+    size = max(1, mover.size)
+    side = SIDES.get(mover.token_type)
+    blocked, occupied = set(), set()
+    for token in tactical_map.tokens.values():
+        if token is mover:
+            continue
+        other = SIDES.get(token.token_type)
+        target = occupied if side and other == side else blocked
+        target.update(_footprint_starts(token, size))
+    return blocked, occupied
+
+
+def _search(grid: MoveGrid, start: int, goal: Optional[int], budget: Optional[int],
+            blocked: Set[int], rule: str):
+    """
+    A* towards ``goal`` (or Dijkstra out to ``budget`` when goal is None).
+    Costs are in squares of movement. States are ``index * 2 + parity`` so the
+    5-10-5 rule can track whether the next diagonal costs double.
+    Returns (best cost per state, parent links, goal state).
+    """
+    stride = grid.stride
+    is_open, difficult, steps = grid.open, grid.difficult, grid.steps
+    alternate = rule == DIAGONAL_ALTERNATE
+    gx, gy = (goal % stride, goal // stride) if goal is not None else (0, 0)
+
+    start_state = start * 2
+    best = {start_state: 0}
+    parent = {start_state: None}
+    # Ties on f go to the larger g (closer to the goal), which keeps A* on
+    # open ground from fanning out across every equally good square
+    heap = [(0, 0, start_state)]
+    push, pop = heapq.heappush, heapq.heappop
+    while heap:
+        _, neg_g, state = pop(heap)
+        g = -neg_g
+        if g > best[state]:
+            continue
+        idx, parity = state >> 1, state & 1
+        if idx == goal:
+            return best, parent, state
+        for offset, diagonal, ox, oy in steps:
+            nidx = idx + offset
+            if not is_open[nidx] or nidx in blocked:
+                continue
+            cost = 1
+            new_parity = parity
+            if diagonal:
+                # No squeezing diagonally between two walls
+                if not is_open[idx + ox] and not is_open[idx + oy]:
+                    continue
+                if alternate:
+                    cost += parity
+                    new_parity = parity ^ 1
+            if difficult[nidx]:
+                cost *= 2
+            ng = g + cost
+            if budget is not None and ng > budget:
+                continue
+            nstate = nidx * 2 + new_parity
+            old = best.get(nstate)
+            if old is None or ng < old:
+                best[nstate] = ng
+                parent[nstate] = state
+                if goal is None:
+                    push(heap, (ng, -ng, nstate))
+                else:
+                    dx = abs(gx - nidx % stride)
+                    dy = abs(gy - nidx // stride)
+                    hcost = dx if dx > dy else dy
+                    if alternate:
+                        hcost += (dy if dx > dy else dx) // 2
+                    push(heap, (ng + hcost, -ng, nstate))
+    return best, parent, None
+
+
+def find_path(tactical_map: TacticalMap, start: Tuple[int, int], goal: Tuple[int, int],
+              size: int = 1, blocked: Iterable[Tuple[int, int]] = (),
+              no_stop: Iterable[Tuple[int, int]] = (),
+              diagonal_rule: Optional[str] = None) -> Optional[Path]:
+    """
+    Cheapest route between two squares (top-left squares for large creatures).
+
+    Args:
+        tactical_map: Map to search
+        start: (x, y) starting square
+        goal: (x, y) destination square
+        size: Creature size in squares (1 = Medium, 2 = Large, ...)
+        blocked: Squares that can't be entered
+        no_stop: Squares that can be crossed but not ended on
+        diagonal_rule: DIAGONAL_STANDARD or DIAGONAL_ALTERNATE (map default if None)
+
+    Returns:
+        Path with the squares walked and cost in feet, or None if unreachable
+    """
+    grid = get_move_grid(tactical_map, size)
+    goal = tuple(goal)
+    if not grid.contains(*goal) or not grid.contains(*start):
+        return None
+    blocked = set(blocked)
+    goal_idx = grid.index(*goal)
+    if not grid.open[goal_idx] or goal in blocked or goal in set(no_stop):
+        return None
+
+    rule = diagonal_rule or tactical_map.diagonal_rule
+    blocked_idx = {grid.index(x, y) for x, y in blocked if grid.contains(x, y)}
+    best, parent, end = _search(grid, grid.index(*start), goal_idx, None, blocked_idx, rule)
+    if end is None:
+        return None
+
+    squares = []
+    state = end
+    while state is not None:
+        squares.append(grid.square(state >> 1))
+        state = parent[state]
+    squares.reverse()
+    return Path(squares, best[end] * tactical_map.scale)
+
+
+def reachable(tactical_map: TacticalMap, start: Tuple[int, int], feet: int, size: int = 1,
+              blocked: Iterable[Tuple[int, int]] = (), no_stop: Iterable[Tuple[int, int]] = (),
+              diagonal_rule: Optional[str] = None) -> Dict[Tuple[int, int], int]:
+    """Every square a creature can end its move on within ``feet``, with the cost in feet."""
+    grid = get_move_grid(tactical_map, size)
+    if not grid.contains(*start):
+        return {}
+    budget = max(0, feet) // tactical_map.scale
+    rule = diagonal_rule or tactical_map.diagonal_rule
+    blocked_idx = {grid.index(x, y) for x, y in blocked if grid.contains(x, y)}
+    best, _, _ = _search(grid, grid.index(*start), None, budget, blocked_idx, rule)
+
+    no_stop = set(no_stop)
+    squares = {}
+    for state, cost in best.items():
+        square = grid.square(state >> 1)
+        if square in no_stop:
+            continue
+        feet_used = cost * tactical_map.scale
+        if feet_used < squares.get(square, feet_used + 1):
+            squares[square] = feet_used
+    return squares
+
+
+def token_path(tactical_map: TacticalMap, name: str, x: int, y: int,
+               diagonal_rule: Optional[str] = None) -> Optional[Path]:
+    """Route for a token to (x, y), walking around walls and hostile creatures."""
+    token = tactical_map.get_token(name)
+    if not token:
+        return None
+    blocked, no_stop = token_obstacles(tactical_map, token)
+    return find_path(tactical_map, (token.x, token.y), (x, y), token.size,
+                     blocked, no_stop, diagonal_rule)
+
+
+def token_reach(tactical_map: TacticalMap, name: str, feet: int,
+                diagonal_rule: Optional[str] = None) -> Dict[Tuple[int, int], int]:
+    """Squares a token can move to with ``feet`` of movement."""
+    token = tactical_map.get_token(name)
+    if not token:
+        return {}
+    blocked, no_stop = token_obstacles(tactical_map, token)
+    return reachable(tactical_map, (token.x, token.y), feet, token.size,
+                     blocked, no_stop, diagonal_rule)
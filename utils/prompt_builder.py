@@ -1,36 +1,34 @@
-"""Prompt builder utilities for the Discord bot."""
+"""Prompt builder utilities for the Discord bot.
 
+The system prompt is split into two parts:
 
-def build_system_prompt(state: dict) -> str:
-    """Return a system prompt describing the current campaign state."""
-    title = state.get("campaign_title", "")
-    realm = state.get("realm", "")
-    location = state.get("location", "")
-    plot = state.get("plot_hook", "")
-    difficulty = state.get("difficulty", "normal")
-    recent_actions = state.get("prompt_history", [])[-3:]
-    party_comp = analyze_party_composition(state.get("players", []))
-    actions_text = summarize_actions(recent_actions)
+- ``STATIC_SYSTEM_PROMPT`` - DM rules, difficulty guide, skill-check table and
+  response style. This text never changes between requests, so it forms a
+  byte-stable prefix that the provider can cache.
+- ``build_dynamic_context(state)`` - campaign details, party status and recent events.
+  This changes every turn and is sent after the conversation history.
 
-    # Difficulty affects DC and encounter severity
-    difficulty_guide = {
-        "easy": "Be generous with successes and provide helpful hints. Most DCs are 10-12.",
-        "normal": "Use standard D&D 5e difficulty. DCs range from 10-18 based on task.",
-        "hard": "Be challenging. Enemies are tougher, DCs range 15-22, and consequences are real."
-    }
+Party details are served from a per-channel snapshot cache so building a prompt
+does not re-read every character file on every turn.
+"""
+from threading import Lock
 
-    system_prompt = f"""You are the Dungeon Master for a Discord-based D&D 5e campaign. Your role is to narrate the story, control NPCs, and respond to player actions with immersive descriptions.
+_party_snapshots = {}  # channel key -> snapshot dict
+_party_lock = Lock()
 
-**Campaign Details:**
-- Title: {title}
-- Realm: {realm}
-- Current Location: {location}
-- Plot: {plot}
-- Difficulty: {difficulty} - {difficulty_guide.get(difficulty, difficulty_guide['normal'])}
+# Difficulty affects DC and encounter severity
+DIFFICULTY_GUIDE = {
+    "easy": "Be generous with successes and provide helpful hints. Most DCs are 10-12.",
+    "normal": "Use standard D&D 5e difficulty. DCs range from 10-18 based on task.",
+    "hard": "Be challenging. Enemies are tougher, DCs range 15-22, and consequences are real."
+}
 
-**Party:** {party_comp if party_comp else 'Unknown adventurers'}
+STATIC_SYSTEM_PROMPT = f"""You are the Dungeon Master for a Discord-based D&D 5e campaign. Your role is to narrate the story, control NPCs, and respond to player actions with immersive descriptions.
 
-**Recent Events:** {actions_text if actions_text else 'The adventure begins...'}
+The current campaign details, party and recent events are provided in a later CURRENT SCENE message. Always follow the difficulty named there:
+- easy: {DIFFICULTY_GUIDE['easy']}
+- normal: {DIFFICULTY_GUIDE['normal']}
+- hard: {DIFFICULTY_GUIDE['hard']}
 
 **Your Response Style:**
 1. Describe the scene and NPC reactions vividly (2-3 sentences)
@@ -63,18 +61,108 @@ Format: "Roll [Skill], DC [number]." Then STOP and wait for the result before na
 2. [Action option]
 3. [Action option]
 """
-    return system_prompt
+
+
+def build_dynamic_context(state: dict, channel_id=None) -> str:
+    """Return the per-turn scene description (campaign, party, recent events)."""
+    title = state.get("campaign_title", "")
+    realm = state.get("realm", "")
+    location = state.get("location", "")
+    plot = state.get("plot_hook", "")
+    difficulty = state.get("difficulty", "normal")
+    if difficulty not in DIFFICULTY_GUIDE:
+        difficulty = "normal"
+    recent_actions = state.get("prompt_history", [])[-3:]
+    party = get_party_snapshot(state.get("players", []), channel_id)
+    actions_text = summarize_actions(recent_actions)
+
+    return f"""CURRENT SCENE
+
+**Campaign Details:**
+- Title: {title}
+- Realm: {realm}
+- Current Location: {location}
+- Plot: {plot}
+- Difficulty: {difficulty}
+
+**Party:** {party['summary'] if party['summary'] else 'Unknown adventurers'}
+
+**Characters:**
+{party['status'] if party['status'] else 'None recorded'}
+
+**Recent Events:** {actions_text if actions_text else 'The adventure begins...'}
+"""
+
+
+def build_prompt_sections(state: dict, channel_id=None) -> tuple:
+    """Return ``(static_prefix, dynamic_context)`` for ``get_dm_response``."""
+    return STATIC_SYSTEM_PROMPT, build_dynamic_context(state, channel_id)
+
+
+def build_system_prompt(state: dict, channel_id=None) -> str:
+    """Return a single system prompt: the static prefix followed by the scene."""
+    return STATIC_SYSTEM_PROMPT + "\n" + build_dynamic_context(state, channel_id)
 
 
 def summarize_actions(actions):
     return "; ".join(a.get("content", "") for a in actions if a.get("role") == "user")
 
 
-def analyze_party_composition(players):
-    from utils.character_manager import load_character
-    parts = []
-    for pid in players:
-        char = load_character(pid)
-        if char:
-            parts.append(f"{char.get('name')} (Lv {char.get('level',1)} {char.get('class','')})")
-    return ", ".join(parts)
+def _render_member(pid, char):
+    """Pre-render the prompt fragments for one party member."""
+    name = char.get('name')
+    level = char.get('level', 1)
+    char_class = char.get('class', '')
+    return {
+        'id': pid,
+        'name': name,
+        'summary': f"{name} (Lv {level} {char_class})",
+        'status': f"{name} (Level {level} {char_class}, HP: {char.get('hp', '?')}/{char.get('max_hp', '?')})",
+    }
+
+
+def get_party_snapshot(players, channel_id=None):
+    """
+    Return a cached snapshot of the party for prompt building.
+
+    The snapshot is keyed by channel (or by the player list when no channel is
+    given) and holds pre-rendered fragments per member plus the joined
+    ``summary`` line and per-member HP ``status`` lines. Only members whose
+    character version changed since the last call are re-loaded, so a save
+    (e.g. after damage) is picked up without any explicit invalidation.
+    """
+    from utils.character_manager import load_character, get_character_version
+
+    players = [str(p) for p in players]
+    key = str(channel_id) if channel_id is not None else tuple(players)
+    versions = {pid: get_character_version(pid) for pid in players}
+
+    with _party_lock:
+        snapshot = _party_snapshots.get(key)
+        if snapshot and snapshot['versions'] == versions and snapshot['players'] == players:
+            return snapshot
+
+        cached = snapshot['members'] if snapshot else {}
+        old_versions = snapshot['versions'] if snapshot else {}
+        members = {}
+        for pid in players:
+            if pid in cached and old_versions.get(pid) == versions[pid]:
+                members[pid] = cached[pid]
+                continue
+            char = load_character(pid)
+            if char:
+                members[pid] = _render_member(pid, char)
+
+        snapshot = {
+            'players': players,
+            'versions': versions,
+            'members': members,
+            'summary': ", ".join(members[pid]['summary'] for pid in players if pid in members),
+            'status': "\n".join(members[pid]['status'] for pid in players if pid in members),
+        }
+        _party_snapshots[key] = snapshot
+        return snapshot
+
+
+def analyze_party_composition(players, channel_id=None):
+    return get_party_snapshot(players, channel_id)['summary']
@@ -7,7 +7,10 @@ import os
 import json
 from typing import Dict, List, Optional, Tuple
 from enum import Enum
-from utils.combat_manager import load_combat, save_combat
+from utils.combat_manager import load_combat, save_combat, find_combatant
+from utils.combat_log import combat_event
+from utils.map_manager import Token, footprint_gap, load_map
+from utils.pathfinding import SIDES, find_path, token_obstacles
 from utils.dice_roller import roll_dice
 
 # =============================================================================
@@ -125,13 +128,14 @@ def has_reaction_available(channel_id: str, combatant_name: str) -> bool:
     if not combat:
         return False
     
-    combatant = next((c for c in combat['combatants'] if c['name'].lower() == combatant_name.lower()), None)
+    combatant = find_combatant(combat, combatant_name)
     if not combatant:
         return False
     
     return not combatant.get('reaction_used', False)
 
 
+@combat_event('reaction')
 def use_reaction(channel_id: str, combatant_name: str, reaction_type: ReactionType) -> Dict:
     """
     Use a combatant's reaction.
@@ -148,7 +152,7 @@ def use_reaction(channel_id: str, combatant_name: str, reaction_type: ReactionTy
     if not combat or not combat.get('active'):
         return {'error': 'No active combat'}
     
-    combatant = next((c for c in combat['combatants'] if c['name'].lower() == combatant_name.lower()), None)
+    combatant = find_combatant(combat, combatant_name)
     if not combatant:
         return {'error': f'{combatant_name} not found in combat'}
     
@@ -172,6 +176,7 @@ def use_reaction(channel_id: str, combatant_name: str, reaction_type: ReactionTy
     }
 
 
+@combat_event('turn')
 def reset_reactions(channel_id: str, combatant_name: str = None):
     """
     Reset reactions at the start of a combatant's turn.
@@ -184,9 +189,13 @@ def reset_reactions(channel_id: str, combatant_name: str = None):
     if not combat:
         return
     
-    for combatant in combat['combatants']:
-        if combatant_name is None or combatant['name'].lower() == combatant_name.lower():
-            combatant['reaction_used'] = False
+    if combatant_name is None:
+        targets = combat['combatants']
+    else:
+        combatant = find_combatant(combat, combatant_name)
+        targets = [combatant] if combatant else []
+    for combatant in targets:
+        combatant['reaction_used'] = False
     
     save_combat(channel_id, combat)
 
@@ -200,43 +209,96 @@ def reset_all_reactions_new_round(channel_id: str):
 # OPPORTUNITY ATTACK
 # =============================================================================
 
+DEFAULT_REACH = 5  # feet
+
+
+def _line_squares(start: Tuple[int, int], end: Tuple[int, int]) -> List[Tuple[int, int]]:
+    """Squares stepped through moving straight (diagonals first) from start to end."""
+    x, y = start
+    squares = [(x, y)]
+    while (x, y) != tuple(end):
+        x += (end[0] > x) - (end[0] < x)
+        y += (end[1] > y) - (end[1] < y)
+        squares.append((x, y))
+    return squares
+
+
 def check_opportunity_attack(
     channel_id: str, 
     moving_combatant: str, 
-    from_pos: Tuple[int, int], 
-    to_pos: Tuple[int, int]
+    from_pos: Optional[Tuple[int, int]] = None, 
+    to_pos: Optional[Tuple[int, int]] = None,
+    path: Optional[List[Tuple[int, int]]] = None,
+    tactical_map=None
 ) -> List[Dict]:
     """
     Check if any combatants can make an opportunity attack.
     
+    Positions come from the channel's tactical map. The move is followed
+    square by square, so a creature triggers as soon as the mover steps out
+    of its reach anywhere along the way, not only by comparing the two ends.
+    Only tokens near the path (found through the map's spatial index) are
+    checked.
+    
     Args:
         channel_id: The channel ID
         moving_combatant: Name of the combatant moving
-        from_pos: Starting position (x, y)
-        to_pos: Ending position (x, y)
+        from_pos: Starting square (x, y), the token's current square if None
+        to_pos: Destination square (x, y)
+        path: Squares walked from start to destination, e.g. ``Path.squares``
+            (the walking route from ``from_pos`` to ``to_pos`` if None)
+        tactical_map: Map to use instead of loading the channel's map
         
     Returns:
-        List of combatants who can make opportunity attacks
+        List of combatants who can make opportunity attacks, with the square
+        the mover was leaving (``'at'``)
     """
     combat = load_combat(channel_id)
     if not combat or not combat.get('active'):
         return []
     
-    mover = next((c for c in combat['combatants'] if c['name'].lower() == moving_combatant.lower()), None)
-    if not mover:
+    mover = find_combatant(combat, moving_combatant)
+    if not mover or 'disengaged' in mover.get('status', []):
+        return []
+    
+    tactical_map = tactical_map or load_map(channel_id)
+    token = tactical_map.get_token(moving_combatant) if tactical_map else None
+    if not token:
         return []
     
-    # Get mover's team
-    mover_type = mover.get('type', 'player')
+    size = max(1, token.size)
+    if not path:
+        start = tuple(from_pos) if from_pos else (token.x, token.y)
+        end = tuple(to_pos) if to_pos else start
+        blocked, no_stop = token_obstacles(tactical_map, token)
+        route = find_path(tactical_map, start, end, size, blocked, no_stop)
+        path = route.squares if route else _line_squares(start, end)
+    if len(path) < 2:
+        return []
+    
+    scale = tactical_map.scale
+    mover_side = SIDES.get(mover.get('type', 'player'), mover.get('type'))
+    
+    # Tokens within the longest reach in play of any square on the path
+    max_reach = max(DEFAULT_REACH, *(c.get('reach', DEFAULT_REACH) for c in combat['combatants'])) // scale
+    nearby = {}
+    for x, y in path:
+        for other in tactical_map.get_tokens_in_rect(x - max_reach, y - max_reach,
+                                                     x + size - 1 + max_reach, y + size - 1 + max_reach):
+            nearby[other.name.lower()] = other
+    nearby.pop(token.name.lower(), None)
+    
+    # The mover's footprint as it steps along the path
+    steps = [Token(token.name, x, y, size=size) for x, y in path]
     
     can_attack = []
-    for combatant in combat['combatants']:
-        # Skip self
-        if combatant['name'].lower() == moving_combatant.lower():
+    for key, other in sorted(nearby.items()):
+        combatant = find_combatant(combat, key)
+        if not combatant:
             continue
         
-        # Skip allies (same type)
-        if combatant.get('type') == mover_type:
+        # Skip allies
+        if SIDES.get(combatant.get('type'), combatant.get('type')) == mover_side:
             continue
         
         # Skip if reaction already used
@@ -247,22 +309,25 @@ def check_opportunity_attack(
         if combatant.get('hp', 1) <= 0 or 'unconscious' in combatant.get('status', []):
             continue
         
-        # Check if combatant was in melee range (5 feet) of starting position
-        combatant_pos = combatant.get('position', (0, 0))
-        distance_from_start = abs(combatant_pos[0] - from_pos[0]) + abs(combatant_pos[1] - from_pos[1])
-        distance_from_end = abs(combatant_pos[0] - to_pos[0]) + abs(combatant_pos[1] - to_pos[1])
-        
-        # If was within 1 square (5 ft) and is now further away
-        if distance_from_start <= 1 and distance_from_end > 1:
-            can_attack.append({
-                'combatant': combatant['name'],
-                'reaction_type': ReactionType.OPPORTUNITY_ATTACK,
-                'target': moving_combatant,
-            })
+        # First step that goes from inside this combatant's reach to outside it
+        reach = combatant.get('reach', DEFAULT_REACH) // scale
+        inside = footprint_gap(steps[0], other) <= reach
+        for prev, step in zip(path, steps[1:]):
+            now_inside = footprint_gap(step, other) <= reach
+            if inside and not now_inside:
+                can_attack.append({
+                    'combatant': combatant['name'],
+                    'reaction_type': ReactionType.OPPORTUNITY_ATTACK,
+                    'target': moving_combatant,
+                    'at': prev,
+                })
+                break
+            inside = now_inside
     
     return can_attack
 
 
+@combat_event('reaction')
 def resolve_opportunity_attack(
     channel_id: str,
     attacker_name: str,
@@ -289,13 +354,13 @@ def resolve_opportunity_attack(
         return reaction_result
     
     combat = load_combat(channel_id)
-    target = next((c for c in combat['combatants'] if c['name'].lower() == target_name.lower()), None)
+    target = find_combatant(combat, target_name)
     
     if not target:
         return {'error': f'{target_name} not found'}
     
     # Roll attack
-    attack_roll = roll_dice('1d20')[0]
+    attack_roll = roll_dice('1d20', channel_id)[0]
     is_crit = attack_roll == 20
     is_fumble = attack_roll == 1
     total_attack = attack_roll + attack_bonus
@@ -303,7 +368,7 @@ def resolve_opportunity_attack(
     
     damage = 0
     if hit:
-        damage = roll_dice(damage_dice)[0]
+        damage = roll_dice(damage_dice, channel_id)[0]
         if is_crit:
             damage *= 2
         target['hp'] = max(0, target.get('hp', 0) - damage)
@@ -331,6 +396,7 @@ def resolve_opportunity_attack(
 # SHIELD SPELL
 # =============================================================================
 
+@combat_event('reaction')
 def cast_shield(channel_id: str, caster_name: str) -> Dict:
     """
     Cast Shield as a reaction.
@@ -347,7 +413,7 @@ def cast_shield(channel_id: str, caster_name: str) -> Dict:
         return reaction_result
     
     combat = load_combat(channel_id)
-    caster = next((c for c in combat['combatants'] if c['name'].lower() == caster_name.lower()), None)
+    caster = find_combatant(combat, caster_name)
     
     if not caster:
         return {'error': f'{caster_name} not found'}
@@ -375,6 +441,7 @@ def cast_shield(channel_id: str, caster_name: str) -> Dict:
 # COUNTERSPELL
 # =============================================================================
 
+@combat_event('reaction')
 def cast_counterspell(
     channel_id: str, 
     caster_name: str, 
@@ -405,7 +472,7 @@ def cast_counterspell(
     else:
         # Need to make ability check (DC = 10 + spell level)
         dc = 10 + target_spell_level
-        check_roll = roll_dice('1d20')[0]
+        check_roll = roll_dice('1d20', channel_id)[0]
         # Assume +4 spellcasting modifier for simplicity
         total = check_roll + 4
         success = total >= dc
@@ -425,6 +492,7 @@ def cast_counterspell(
 # UNCANNY DODGE
 # =============================================================================
 
+@combat_event('reaction')
 def use_uncanny_dodge(channel_id: str, user_name: str, damage: int) -> Dict:
     """
     Use Uncanny Dodge to halve attack damage.
@@ -476,8 +544,8 @@ def check_sentinel_trigger(
     if not combat or not combat.get('active'):
         return []
     
-    attacker = next((c for c in combat['combatants'] if c['name'].lower() == attacker_name.lower()), None)
-    target = next((c for c in combat['combatants'] if c['name'].lower() == target_name.lower()), None)
+    attacker = find_combatant(combat, attacker_name)
+    target = find_combatant(combat, target_name)
     
     if not attacker or not target:
         return []
@@ -531,7 +599,7 @@ def get_available_reactions(channel_id: str, combatant_name: str) -> List[Reacti
     if not combat:
         return []
     
-    combatant = next((c for c in combat['combatants'] if c['name'].lower() == combatant_name.lower()), None)
+    combatant = find_combatant(combat, combatant_name)
     if not combatant:
         return []
     
@@ -1,21 +1,379 @@
+"""
+Session Recorder
+Durable, append-only recordings of play sessions for replay.
+
+Events are written as JSON lines to an active segment file under
+``logs/sessions/<session>/``. When the segment passes SEGMENT_BYTES it is
+compressed (zstd when the ``zstandard`` package is installed, gzip otherwise)
+and a new one is started. ``index.json`` lists the closed segments with the
+event numbers and timestamps they cover, so ``iter_events(since=...)`` can
+skip straight to the segment it needs and stream from there.
+
+``record_event`` only numbers the event and queues the line; a writer thread
+(utils.background_writer, shared with utils.logger) appends queued lines
+every FLUSH_INTERVAL seconds, or once FLUSH_COUNT are waiting, and does any
+rotation and compression there, off the bot's event loop.
+
+``replay_session`` feeds a recorded session's player inputs back through
+``get_dm_response`` with a ``StubLLM`` standing in for the OpenAI client, to
+check that skill-check and combat detection still give the same results and
+to time the prompt pipeline without network calls.
+"""
+
+import atexit
+import gzip
+import io
+import json
+import os
+import time
+from collections import deque
 from datetime import datetime
+from threading import Lock
+from types import SimpleNamespace
+from typing import Dict, Iterable, Iterator, Optional, Union
+
+from utils.background_writer import BackgroundWriter
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+SESSIONS_DIR = os.path.join(os.path.dirname(__file__), '..', 'logs', 'sessions')
+SEGMENT_BYTES = 1 << 20   # uncompressed size before a segment is rotated
+ACTIVE_SEGMENT = 'active.jsonl'
+INDEX_FILE = 'index.json'
+FLUSH_INTERVAL = 1.0      # seconds between background writes
+FLUSH_COUNT = 50          # queued events that trigger an early write
+
+_recorders = {}  # session_id -> SessionRecorder
+_recorders_lock = Lock()
+
+
+def _open_segment(path: str):
+    """Text reader for a segment file, whatever its compression."""
+    if path.endswith('.zst'):
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError(f"{os.path.basename(path)} needs the zstandard package")
+        raw = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.TextIOWrapper(raw, encoding='utf-8')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def _compress(src: str, dest_base: str) -> str:
+    """Compress a finished segment next to it and return the new file name."""
+    if ZSTD_AVAILABLE:
+        dest = dest_base + '.zst'
+        with open(src, 'rb') as fin, open(dest, 'wb') as fout:
+            zstandard.ZstdCompressor(level=10).copy_stream(fin, fout)
+    else:
+        dest = dest_base + '.gz'
+        with open(src, 'rb') as fin, gzip.open(dest, 'wb', compresslevel=6) as fout:
+            while True:
+                chunk = fin.read(1 << 16)
+                if not chunk:
+                    break
+                fout.write(chunk)
+    return os.path.basename(dest)
+
 
 class SessionRecorder:
-    """Simple session recorder for replaying games."""
+    """Append-only event recording for one session, split into compressed segments."""
+
+    def __init__(self, session_id: str, directory: Optional[str] = None,
+                 segment_bytes: int = SEGMENT_BYTES):
+        self.session_id = str(session_id)
+        self.directory = directory or os.path.join(SESSIONS_DIR, self.session_id)
+        self.segment_bytes = segment_bytes
+        self._lock = Lock()       # event numbering and queueing
+        self._io_lock = Lock()    # segment files and index
+        self._file = None
+        os.makedirs(self.directory, exist_ok=True)
+        self.index = self._load_index()
+        # Resume numbering after the closed segments and whatever is in the active one
+        self.seq = self.index['segments'][-1]['last'] if self.index['segments'] else 0
+        self._active_first = self.seq + 1
+        for event in self._read(self._active_path):
+            self.seq = event['seq']
+        self._written = self.seq  # last event on disk
+
+    # ---------- files ----------
 
-    def __init__(self, session_id: str):
-        self.session_id = session_id
-        self.events = []
+    @property
+    def _active_path(self) -> str:
+        return os.path.join(self.directory, ACTIVE_SEGMENT)
 
-    def record_event(self, event_type: str, data):
-        self.events.append({
-            'timestamp': datetime.now().isoformat(),
-            'type': event_type,
-            'data': data,
+    def _load_index(self) -> Dict:
+        path = os.path.join(self.directory, INDEX_FILE)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {'session_id': self.session_id, 'segments': []}
+
+    def _save_index(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _read(path: str) -> Iterator[Dict]:
+        if not os.path.exists(path):
+            return
+        with _open_segment(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    # ---------- writing ----------
+
+    def record_event(self, event_type: str, data) -> int:
+        """Queue an event for the background writer and return its sequence number."""
+        with self._lock:
+            self.seq += 1
+            event = {
+                'seq': self.seq,
+                'timestamp': datetime.now().isoformat(),
+                'type': event_type,
+                'data': data,
+            }
+            line = json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n'
+            # Queued under the lock so lines reach the writer in seq order
+            _writer.put((self, self.seq, line))
+        return event['seq']
+
+    def _write(self, lines, last_seq: int):
+        """Append queued lines to the active segment, rotating it when full."""
+        with self._io_lock:
+            if self._file is None:
+                self._file = open(self._active_path, 'a', encoding='utf-8')
+            self._file.write(''.join(lines))
+            self._file.flush()
+            self._written = last_seq
+            if self._file.tell() >= self.segment_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        """Compress the active segment into the index and start a new one."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not os.path.exists(self._active_path) or self._written < self._active_first:
+            return
+        first_ts = last_ts = None
+        count = 0
+        for event in self._read(self._active_path):
+            first_ts = first_ts or event['timestamp']
+            last_ts = event['timestamp']
+            count += 1
+        name = _compress(self._active_path, os.path.join(
+            self.directory, f'{self._active_first:08d}-{self._written:08d}.jsonl'))
+        self.index['segments'].append({
+            'file': name, 'first': self._active_first, 'last': self._written,
+            'start': first_ts, 'end': last_ts, 'count': count,
         })
+        self._save_index()
+        os.remove(self._active_path)
+        self._active_first = self._written + 1
+
+    def close(self):
+        """Write anything queued and compress whatever is in the active segment."""
+        flush_recorders()
+        with self._io_lock:
+            self._rotate()
+
+    # ---------- reading ----------
+
+    def iter_events(self, since: Union[int, str, datetime, None] = None,
+                    event_type: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Stream events in order, starting after event number ``since`` (or
+        after a timestamp when given an ISO string or datetime).
+
+        Segments that end before ``since`` are skipped using the index, so
+        reading the tail of a long session doesn't decompress all of it.
+        """
+        if isinstance(since, datetime):
+            since = since.isoformat()
+        by_time = isinstance(since, str)
+        flush_recorders()
+        with self._io_lock:
+            segments = list(self.index['segments'])
+
+        paths = []
+        for seg in segments:
+            if since is not None and (seg['end'] <= since if by_time else seg['last'] <= since):
+                continue
+            paths.append(os.path.join(self.directory, seg['file']))
+        paths.append(self._active_path)
+
+        for path in paths:
+            for event in self._read(path):
+                if since is not None and (event['timestamp'] <= since if by_time else event['seq'] <= since):
+                    continue
+                if event_type and event['type'] != event_type:
+                    continue
+                yield event
+
+    @property
+    def events(self):
+        return list(self.iter_events())
 
     def export_replay(self):
         return {
             'session_id': self.session_id,
-            'events': list(self.events),
+            'events': list(self.iter_events()),
         }
+
+
+# =============================================================================
+# BACKGROUND WRITER
+# =============================================================================
+
+def _write_events(events):
+    """Write a batch of queued (recorder, seq, line) events, grouped by recorder."""
+    lines = {}
+    last_seq = {}
+    for recorder, seq, line in events:
+        lines.setdefault(recorder, []).append(line)
+        last_seq[recorder] = seq
+    for recorder, batch in lines.items():
+        try:
+            recorder._write(batch, last_seq[recorder])
+        except OSError as e:
+            print(f"Session recording write failed for {recorder.session_id}: {e}")
+
+
+_writer = BackgroundWriter(_write_events, 'session-recorder-writer',
+                           flush_interval=FLUSH_INTERVAL, flush_count=FLUSH_COUNT)
+
+
+def flush_recorders():
+    """Write any queued events now."""
+    _writer.flush()
+
+
+def get_recorder(session_id) -> SessionRecorder:
+    """The shared recorder for a session (usually a channel ID)."""
+    session_id = str(session_id)
+    with _recorders_lock:
+        recorder = _recorders.get(session_id)
+        if recorder is None:
+            recorder = _recorders[session_id] = SessionRecorder(session_id)
+        return recorder
+
+
+def close_recorders():
+    with _recorders_lock:
+        recorders = list(_recorders.values())
+    for recorder in recorders:
+        recorder.close()
+
+
+atexit.register(close_recorders)
+
+
+def record_dm_turn(session_id, user_input: str, reply: str, state: Dict, player_id=None) -> int:
+    """Record one player input and the DM reply, with what was detected from it."""
+    pending = state.get('pending_roll') or {}
+    return get_recorder(session_id).record_event('dm_turn', {
+        'player_id': player_id,
+        'input': user_input,
+        'reply': reply,
+        'skill': pending.get('skill'),
+        'dc': pending.get('dc'),
+        'combat': bool((state.get('pending_combat') or {}).get('trigger')),
+    })
+
+
+# =============================================================================
+# REPLAY
+# =============================================================================
+
+class StubLLM:
+    """
+    Stand-in for the OpenAI client: ``chat.completions.create`` answers with
+    the queued replies in order (then ``default``) and keeps the requests.
+    """
+
+    def __init__(self, replies: Iterable[str] = (), default: str = "[Voice: Narrator] Nothing happens."):
+        self.replies = deque(replies)
+        self.default = default
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.calls.append(kwargs)
+        content = self.replies.popleft() if self.replies else self.default
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def replay_session(session_id, state: Optional[Dict] = None, llm=None,
+                   directory: Optional[str] = None) -> Dict:
+    """
+    Re-run a recorded session's DM turns through ``get_dm_response``.
+
+    Args:
+        session_id: Recorded session (channel ID)
+        state: Starting session state (empty if None)
+        llm: Client to answer with (a StubLLM serving the recorded replies if None)
+        directory: Recording folder, if not the default one for the session
+
+    Returns:
+        Dict with turn count, timings and the turns whose detected skill
+        check or combat trigger differ from the recording
+    """
+    from services import openai_service
+
+    recorder = SessionRecorder(session_id, directory) if directory else get_recorder(session_id)
+    turns = [e for e in recorder.iter_events(event_type='dm_turn')]
+    llm = llm or StubLLM(t['data']['reply'] for t in turns)
+    state = state if state is not None else {}
+
+    mismatches = []
+    timings = []
+    original = openai_service.client
+    openai_service.client = llm
+    try:
+        for turn in turns:
+            data = turn['data']
+            start = time.perf_counter()
+            # No player ID so replays can't award XP to real characters
+            reply, state = openai_service.get_dm_response(data['input'], state, None)
+            timings.append(time.perf_counter() - start)
+            pending = state.get('pending_roll') or {}
+            got = {
+                'skill': pending.get('skill'),
+                'dc': pending.get('dc'),
+                'combat': bool((state.get('pending_combat') or {}).get('trigger')),
+            }
+            expected = {k: data.get(k) for k in got}
+            if got != expected:
+                mismatches.append({'seq': turn['seq'], 'expected': expected, 'got': got})
+    finally:
+        openai_service.client = original
+
+    total = sum(timings)
+    return {
+        'session_id': str(session_id),
+        'turns': len(turns),
+        'mismatches': mismatches,
+        'total_ms': total * 1000,
+        'mean_ms': total * 1000 / len(timings) if timings else 0.0,
+        'max_ms': max(timings) * 1000 if timings else 0.0,
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Replay a recorded session against the stub LLM")
+    parser.add_argument('session_id')
+    parser.add_argument('--dir', help="Recording folder (default logs/sessions/<session_id>)")
+    args = parser.parse_args()
+    result = replay_session(args.session_id, directory=args.dir)
+    print(json.dumps(result, indent=2))
+    raise SystemExit(1 if result['mismatches'] else 0)
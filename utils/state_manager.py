@@ -62,6 +62,12 @@ def save_state(session_id, state):
     path = _get_state_path(session_id)
     lock = _state_locks.setdefault(session_id, Lock())
     
+    # Record where the channel's dice stream is, for replay/audit
+    from utils.dice_service import stream_state
+    rng = stream_state(session_id)
+    if rng is not None:
+        state['rng'] = rng
+    
     try:
         with lock:
             # Create backup before saving
@@ -0,0 +1,305 @@
+"""
+Visibility
+Line of sight, cover and fog of war on a TacticalMap.
+
+Walls and locked doors block sight; terrain with a ``cover`` entry in
+TERRAIN_TYPES (rubble, pillars, trees, bushes) and other creatures only
+obstruct it. Cover follows the DMG grid rule: pick the attacker corner that
+sees the target best, trace lines to the four corners of one of the target's
+squares, and count how many lines pass through an obstruction (1-2 = half,
+3-4 = three-quarters, every line through a wall = total).
+
+Fields of view use recursive shadowcasting. Each player token keeps an
+"explored" mask on the map; ``update_fog`` only recasts for tokens that moved
+(or everyone after a terrain edit), so keeping fog current costs one field of
+view per moved player rather than a rescan of the map.
+"""
+
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+from utils.map_manager import TERRAIN_CODES, TERRAIN_TYPES, SpatialIndex, TacticalMap, Token
+
+COVER_NONE = "none"
+COVER_HALF = "half"
+COVER_THREE_QUARTERS = "three-quarters"
+COVER_TOTAL = "total"
+
+# AC and Dexterity save bonus for each grade (total cover can't be targeted)
+COVER_BONUS = {COVER_NONE: 0, COVER_HALF: 2, COVER_THREE_QUARTERS: 5, COVER_TOTAL: None}
+
+# Fog levels returned by fog_view()
+FOG_UNSEEN = 0
+FOG_EXPLORED = 1
+FOG_VISIBLE = 2
+
+FOV_CACHE_SIZE = 256
+
+
+def _blocks_sight(info: dict) -> bool:
+    return info.get("opaque", not info.get("passable", True) and "cover" not in info)
+
+
+# bytes.translate() tables from terrain code to 0/1
+OPAQUE_TABLE = bytes(
+    1 if code < len(TERRAIN_CODES) and _blocks_sight(TERRAIN_TYPES[TERRAIN_CODES[code]]) else 0
+    for code in range(256)
+)
+COVER_TABLE = bytes(
+    1 if code < len(TERRAIN_CODES) and TERRAIN_TYPES[TERRAIN_CODES[code]].get("cover") else 0
+    for code in range(256)
+)
+
+_masks = WeakKeyDictionary()  # TacticalMap -> (terrain_version, opaque, cover)
+
+
+def _terrain_masks(tactical_map: TacticalMap) -> Tuple[bytes, bytes]:
+    """(opaque, cover) bitmaps for a map, rebuilt after terrain edits."""
+    cached = _masks.get(tactical_map)
+    if cached is None or cached[0] != tactical_map.terrain_version:
+        cells = bytes(tactical_map.cells)
+        cached = (tactical_map.terrain_version, cells.translate(OPAQUE_TABLE), cells.translate(COVER_TABLE))
+        _masks[tactical_map] = cached
+    return cached[1], cached[2]
+
+
+# ============ LINES ============
+
+@lru_cache(maxsize=4096)
+def segment_squares(dx: int, dy: int) -> Tuple[Tuple[Tuple[int, int], ...], ...]:
+    """
+    What the segment from grid corner (0, 0) to corner (dx, dy) passes
+    through, relative to the square whose top-left corner is (0, 0).
+
+    Each entry is a group of squares and the line is obstructed at that point
+    only if every square in the group is: a single square for a piece of the
+    line inside it, both neighbours where the line runs along a grid edge,
+    and the two squares it squeezes between where it crosses a grid corner.
+    """
+    if dx == 0 and dy == 0:
+        return ()
+    if dx == 0:
+        rows = range(dy, 0) if dy < 0 else range(dy)
+        return tuple(((-1, y), (0, y)) for y in rows)
+    if dy == 0:
+        cols = range(dx, 0) if dx < 0 else range(dx)
+        return tuple(((x, -1), (x, 0)) for x in cols)
+
+    adx, ady = abs(dx), abs(dy)
+    span = adx * ady
+    # Crossings of vertical and horizontal grid lines, as t * span
+    x_stops = set(range(0, span + 1, ady))
+    y_stops = set(range(0, span + 1, adx))
+    stops = sorted(x_stops | y_stops)
+    groups = []
+    for a, b in zip(stops, stops[1:]):
+        if a in x_stops and a in y_stops and a:
+            # Passing exactly through a grid corner
+            px, py = dx * a // span, dy * a // span
+            if (dx > 0) == (dy > 0):
+                groups.append(((px, py - 1), (px - 1, py)))
+            else:
+                groups.append(((px - 1, py - 1), (px, py)))
+        # Midpoint of each piece lies strictly inside one square
+        mid2 = a + b  # 2 * t * span
+        groups.append((((dx * mid2) // (2 * span), (dy * mid2) // (2 * span)),))
+    return tuple(groups)
+
+
+def _corners(x: int, y: int, size: int = 1) -> List[Tuple[int, int]]:
+    return [(x, y), (x + size, y), (x, y + size), (x + size, y + size)]
+
+
+def cover_between(tactical_map: TacticalMap, attacker: Token, target: Token) -> str:
+    """
+    Cover the target has against the attacker: COVER_NONE, COVER_HALF,
+    COVER_THREE_QUARTERS or COVER_TOTAL (no line of sight).
+    """
+    opaque, cover = _terrain_masks(tactical_map)
+    w, h = tactical_map.width, tactical_map.height
+    occupied = tactical_map.occupied_squares
+    mine = set(SpatialIndex.footprint(attacker)) | set(SpatialIndex.footprint(target))
+
+    best = None
+    for ax, ay in _corners(attacker.x, attacker.y, max(1, attacker.size)):
+        for tx, ty in SpatialIndex.footprint(target):
+            blocked = walled = 0
+            for cx, cy in _corners(tx, ty):
+                hit_wall = hit_cover = False
+                for group in segment_squares(cx - ax, cy - ay):
+                    walls = obstructions = 0
+                    for sx, sy in group:
+                        x, y = ax + sx, ay + sy
+                        if not (0 <= x < w and 0 <= y < h) or opaque[y * w + x]:
+                            walls += 1
+                        elif cover[y * w + x] or ((x, y) in occupied and (x, y) not in mine):
+                            obstructions += 1
+                    if walls == len(group):
+                        hit_wall = True
+                        break
+                    if walls + obstructions == len(group):
+                        hit_cover = True
+                if hit_wall:
+                    walled += 1
+                if hit_wall or hit_cover:
+                    blocked += 1
+            if walled < 4 and (best is None or blocked < best):
+                best = blocked
+                if best == 0:
+                    return COVER_NONE
+    if best is None:
+        return COVER_TOTAL
+    return COVER_HALF if best <= 2 else COVER_THREE_QUARTERS
+
+
+def has_line_of_sight(tactical_map: TacticalMap, viewer: Token, target: Token) -> bool:
+    """True unless walls block every line between the two tokens."""
+    return cover_between(tactical_map, viewer, target) != COVER_TOTAL
+
+
+def token_cover(tactical_map: TacticalMap, attacker_name: str, target_name: str) -> Optional[str]:
+    """cover_between() by token name, or None if either token isn't on the map."""
+    attacker = tactical_map.get_token(attacker_name)
+    target = tactical_map.get_token(target_name)
+    if not attacker or not target:
+        return None
+    return cover_between(tactical_map, attacker, target)
+
+
+# ============ FIELD OF VIEW ============
+
+# Octant transforms (xx, xy, yx, yy)
+_OCTANTS = (
+    (1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+    (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1),
+)
+
+
+def _cast(opaque, w, h, cx, cy, row, start, end, radius, xx, xy, yx, yy, seen):
+    """Recursive shadowcasting for one octant (slopes run from ``start`` down to ``end``)."""
+    if start < end:
+        return
+    radius_sq = radius * radius
+    new_start = start
+    for j in range(row, radius + 1):
+        dx, dy = -j - 1, -j
+        blocked = False
+        while dx <= 0:
+            dx += 1
+            x, y = cx + dx * xx + dy * xy, cy + dx * yx + dy * yy
+            l_slope = (dx - 0.5) / (dy + 0.5)
+            r_slope = (dx + 0.5) / (dy - 0.5)
+            if start < r_slope:
+                continue
+            if end > l_slope:
+                break
+            inside = 0 <= x < w and 0 <= y < h
+            if inside and dx * dx + dy * dy <= radius_sq:
+                seen[y * w + x] = 1
+            wall = not inside or opaque[y * w + x]
+            if blocked:
+                if wall:
+                    new_start = r_slope
+                else:
+                    blocked = False
+                    start = new_start
+            elif wall and j < radius:
+                blocked = True
+                _cast(opaque, w, h, cx, cy, j + 1, start, l_slope, radius, xx, xy, yx, yy, seen)
+                new_start = r_slope
+        if blocked:
+            break
+
+
+@lru_cache(maxsize=FOV_CACHE_SIZE)
+def _field_of_view(opaque: bytes, w: int, h: int, squares: Tuple[Tuple[int, int], ...],
+                   radius: int) -> bytes:
+    seen = bytearray(w * h)
+    for cx, cy in squares:
+        if not (0 <= cx < w and 0 <= cy < h):
+            continue
+        seen[cy * w + cx] = 1
+        for xx, xy, yx, yy in _OCTANTS:
+            _cast(opaque, w, h, cx, cy, 1, 1.0, 0.0, radius, xx, xy, yx, yy, seen)
+    return bytes(seen)
+
+
+def field_of_view(tactical_map: TacticalMap, token: Token, radius: Optional[int] = None) -> bytes:
+    """
+    Visibility mask (one 0/1 byte per square, row-major) for what a token can
+    see, out to ``radius`` squares (the whole map if None).
+    """
+    opaque, _ = _terrain_masks(tactical_map)
+    if radius is None:
+        radius = max(tactical_map.width, tactical_map.height)
+    return _field_of_view(opaque, tactical_map.width, tactical_map.height,
+                          tuple(SpatialIndex.footprint(token)), radius)
+
+
+def visible_from(tactical_map: TacticalMap, x: int, y: int, radius: Optional[int] = None) -> bytes:
+    """Visibility mask from a single square (e.g. the point an area effect spreads from)."""
+    opaque, _ = _terrain_masks(tactical_map)
+    if radius is None:
+        radius = max(tactical_map.width, tactical_map.height)
+    x = min(max(x, 0), tactical_map.width - 1)
+    y = min(max(y, 0), tactical_map.height - 1)
+    return _field_of_view(opaque, tactical_map.width, tactical_map.height, ((x, y),), radius)
+
+
+# ============ FOG OF WAR ============
+
+def _or_masks(a, b) -> bytearray:
+    """Square-by-square OR of two 0/1 masks of the same length."""
+    return bytearray((int.from_bytes(a, 'little') | int.from_bytes(b, 'little')).to_bytes(len(a), 'little'))
+
+
+def update_fog(tactical_map: TacticalMap, radius: Optional[int] = None) -> List[str]:
+    """
+    Add what each player token can currently see to its explored mask.
+    Only tokens that moved since the last update are recast, unless the
+    terrain changed. Returns the keys of the tokens that were updated.
+    """
+    terrain_changed = tactical_map.fog_version != tactical_map.terrain_version
+    updated = []
+    for key, token in tactical_map.tokens.items():
+        if token.token_type != "player":
+            continue
+        at = (token.x, token.y, token.size)
+        explored = tactical_map.explored.get(key)
+        if not terrain_changed and explored is not None and tactical_map.fog_origin.get(key) == at:
+            continue
+        visible = field_of_view(tactical_map, token, radius)
+        tactical_map.explored[key] = _or_masks(explored, visible) if explored is not None else bytearray(visible)
+        tactical_map.fog_origin[key] = at
+        updated.append(key)
+    tactical_map.fog_version = tactical_map.terrain_version
+    return updated
+
+
+def fog_view(tactical_map: TacticalMap, viewer: Optional[str] = None,
+             radius: Optional[int] = None) -> Optional[bytes]:
+    """
+    Fog levels per square (FOG_UNSEEN / FOG_EXPLORED / FOG_VISIBLE) for one
+    player token, or for the whole party when ``viewer`` is None.
+    Returns None if there is no such player token on the map.
+    """
+    update_fog(tactical_map, radius)
+    if viewer is not None:
+        token = tactical_map.get_token(viewer)
+        tokens = [token] if token else []
+    else:
+        tokens = [t for t in tactical_map.tokens.values() if t.token_type == "player"]
+    if not tokens:
+        return None
+
+    size = tactical_map.width * tactical_map.height
+    explored = bytes(size)
+    visible = bytes(size)
+    for token in tokens:
+        key = token.name.lower()
+        explored = _or_masks(explored, tactical_map.explored.get(key, bytes(size)))
+        visible = _or_masks(visible, field_of_view(tactical_map, token, radius))
+    explored = _or_masks(explored, visible)
+    levels = int.from_bytes(explored, 'little') + int.from_bytes(visible, 'little')
+    return levels.to_bytes(size, 'little')
@@ -6,7 +6,7 @@ Handles XP awards, level-up detection, and progression tracking.
 import os
 import json
 from typing import Dict, List, Optional, Tuple
-from utils.character_manager import load_character, save_character, level_up as do_level_up
+from utils.character_manager import load_character, save_character, character_batch, load_characters, level_up as do_level_up
 
 # Import XP thresholds from D&D data
 try:
@@ -172,9 +172,12 @@ def award_party_xp(player_ids: List[str], total_xp: int, equal_split: bool = Tru
     xp_per_player = total_xp // len(player_ids) if equal_split else total_xp
     
     results = []
-    for pid in player_ids:
-        result = award_xp(pid, xp_per_player)
-        results.append(result)
+    # Load the whole party in one go and write everyone once at the end
+    with character_batch():
+        load_characters(player_ids)
+        for pid in player_ids:
+            result = award_xp(pid, xp_per_player)
+            results.append(result)
     
     return results
 
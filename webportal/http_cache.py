@@ -0,0 +1,97 @@
+"""
+Conditional responses and compression for the portal.
+
+Pages and API responses carry a weak ETag built from what they are rendered
+from (file mtimes and sizes, or a summary index version) plus an ID for this
+server run, so a template change after a restart is never answered with a
+stale 304. A request whose ``If-None-Match``/``If-Modified-Since`` still
+matches gets an empty 304 without loading or rendering anything. Responses
+are gzipped when the client accepts it.
+"""
+
+import gzip
+import hashlib
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional, Tuple
+
+from flask import make_response, request, session
+
+BOOT_ID = format(time.time_ns(), 'x')
+GZIP_MIN_BYTES = 512
+GZIP_LEVEL = 6
+
+Validators = Tuple[str, Optional[datetime]]
+
+
+def _tag(*parts) -> str:
+    return hashlib.sha1('|'.join(map(str, (BOOT_ID,) + parts)).encode()).hexdigest()[:24]
+
+
+def file_validators(*paths: str) -> Optional[Validators]:
+    """ETag and Last-Modified for a response built from these files (None if one is missing)."""
+    parts = []
+    latest = 0.0
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        parts.append(f'{st.st_mtime_ns:x}-{st.st_size:x}')
+        latest = max(latest, st.st_mtime)
+    return _tag(*parts), datetime.fromtimestamp(int(latest), timezone.utc)
+
+
+def version_validators(*parts) -> Validators:
+    """ETag for a response built from versioned data (e.g. a summary index version)."""
+    return _tag(*parts), None
+
+
+def _not_modified(etag: str, modified: Optional[datetime]):
+    response = make_response('', 304)
+    response.set_etag(etag, weak=True)
+    if modified is not None:
+        response.last_modified = modified
+    return response
+
+
+def conditional(validators: Optional[Validators], build: Callable):
+    """
+    Answer 304 when the client's cached copy is still current, otherwise
+    build the response and attach the validators.
+
+    Skipped when a flash message is waiting, since the cached page wouldn't
+    show it.
+    """
+    if validators is None or session.get('_flashes'):
+        return build()
+    etag, modified = validators
+    if request.if_none_match:
+        if request.if_none_match.contains_weak(etag):
+            return _not_modified(etag, modified)
+    elif modified is not None and request.if_modified_since and modified <= request.if_modified_since:
+        return _not_modified(etag, modified)
+
+    response = make_response(build())
+    if response.status_code == 200:
+        response.set_etag(etag, weak=True)
+        if modified is not None:
+            response.last_modified = modified
+        response.cache_control.no_cache = True
+    return response
+
+
+def gzip_response(response):
+    """Compress a finished response body if the client accepts gzip."""
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.headers.get('Accept-Encoding', '').lower()):
+        return response
+    body = response.get_data()
+    if len(body) < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
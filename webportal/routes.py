@@ -10,6 +10,8 @@ from utils.character_manager import (
 )
 from utils.state_manager import load_state, get_context_summary
 from config import Config
+from webportal.summary_index import character_index, campaign_index, PER_PAGE
+from webportal.http_cache import conditional, file_validators, version_validators, gzip_response
 
 # Try to import D&D 5e data
 try:
@@ -22,28 +24,39 @@ except ImportError:
     DND_DATA_AVAILABLE = False
 
 def list_all_characters():
-    """Return a list of all stored characters with full details."""
-    files = [f for f in os.listdir(Config.CHARACTERS_DIR) if f.endswith('.json')]
-    characters = []
-    for f in files:
-        char_id = f[:-5]
-        data = load_character(char_id)
-        if data:
-            characters.append({
-                'id': char_id,
-                'name': data.get('name', char_id),
-                'race': data.get('race', ''),
-                'char_class': data.get('class', ''),
-                'level': data.get('level', 1),
-            })
-    return characters
+    """Return id, name, race, class and level for every stored character."""
+    return character_index.all()
+
+
+def _listing_args():
+    """Page, page size, sort field and direction from the query string."""
+    page = request.args.get('page', 1, type=int) or 1
+    per_page = request.args.get('per_page', PER_PAGE, type=int) or PER_PAGE
+    return {
+        'page': page,
+        'per_page': per_page,
+        'sort': request.args.get('sort'),
+        'descending': request.args.get('order', 'asc') == 'desc',
+    }
+
+def _character_path(char_id: str) -> str:
+    return os.path.join(Config.CHARACTERS_DIR, f'{char_id}.json')
+
+
+def _state_path(session_id: str) -> str:
+    return os.path.join(Config.STATE_DIR, f'{session_id}.json')
 
 portal_bp = Blueprint('portal', __name__, template_folder='templates')
 
+
+@portal_bp.after_request
+def compress_response(response):
+    return gzip_response(response)
+
 @portal_bp.route('/')
 def list_characters():
-    characters = list_all_characters()
-    return render_template('character_list.html', characters=characters)
+    listing = character_index.page(**_listing_args())
+    return render_template('character_list.html', characters=listing['items'], listing=listing)
 
 
 @portal_bp.route('/character/new', methods=['GET'])
@@ -98,24 +111,29 @@ def create_character_submit():
         char['inventory'] = [item.strip() for item in inventory_str.split(',') if item.strip()]
     
     save_character(char_id, char)
+    character_index.invalidate()
     flash('Character created successfully!', 'success')
     return redirect(url_for('portal.character_detail', char_id=char_id))
 
 
 @portal_bp.route('/character/<char_id>')
 def character_detail(char_id: str):
-    data = load_character(char_id)
-    if not data:
-        abort(404)
-    return render_template('character_detail.html', char=data, char_id=char_id)
+    def build():
+        data = load_character(char_id)
+        if not data:
+            abort(404)
+        return render_template('character_detail.html', char=data, char_id=char_id)
+    return conditional(file_validators(_character_path(char_id)), build)
 
 
 @portal_bp.route('/character/<char_id>/edit', methods=['GET'])
 def edit_character(char_id: str):
-    data = load_character(char_id)
-    if not data:
-        abort(404)
-    return render_template('character_edit.html', char=data, char_id=char_id)
+    def build():
+        data = load_character(char_id)
+        if not data:
+            abort(404)
+        return render_template('character_edit.html', char=data, char_id=char_id)
+    return conditional(file_validators(_character_path(char_id)), build)
 
 
 @portal_bp.route('/character/<char_id>/save', methods=['POST'])
@@ -159,31 +177,24 @@ def save_character_route(char_id: str):
     char['proficiencies'] = proficiencies
     
     save_character(char_id, char)
+    character_index.invalidate()
     flash('Character saved successfully!', 'success')
     return redirect(url_for('portal.character_detail', char_id=char_id))
 
 
 @portal_bp.route('/campaign/<session_id>')
 def campaign_summary(session_id: str):
-    state = load_state(session_id)
-    context = get_context_summary(state)
-    return render_template('campaign_summary.html', state=state, session_id=session_id, context=context)
+    def build():
+        state = load_state(session_id)
+        context = get_context_summary(state)
+        return render_template('campaign_summary.html', state=state, session_id=session_id, context=context)
+    return conditional(file_validators(_state_path(session_id)), build)
 
 
 @portal_bp.route('/dm')
 def dm_dashboard():
-    sessions = []
-    for f in os.listdir(Config.STATE_DIR):
-        if f.endswith('.json'):
-            session_id = f[:-5]
-            state = load_state(session_id)
-            sessions.append({
-                'id': session_id,
-                'title': state.get('campaign_title', 'Untitled Campaign'),
-                'realm': state.get('realm', ''),
-                'player_count': len(state.get('players', [])),
-            })
-    return render_template('dm_dashboard.html', sessions=sessions)
+    listing = campaign_index.page(**_listing_args())
+    return render_template('dm_dashboard.html', sessions=listing['items'], listing=listing)
 
 
 # ============ DELETE ROUTES ============
@@ -191,9 +202,10 @@ def dm_dashboard():
 @portal_bp.route('/character/<char_id>/delete', methods=['POST'])
 def delete_character(char_id: str):
     """Delete a character."""
-    char_path = os.path.join(Config.CHARACTERS_DIR, f'{char_id}.json')
+    char_path = _character_path(char_id)
     if os.path.exists(char_path):
         os.remove(char_path)
+        character_index.invalidate()
         flash('Character deleted successfully.', 'success')
     else:
         flash('Character not found.', 'error')
@@ -203,9 +215,10 @@ def delete_character(char_id: str):
 @portal_bp.route('/campaign/<session_id>/delete', methods=['POST'])
 def delete_campaign(session_id: str):
     """Delete a campaign/session."""
-    state_path = os.path.join(Config.STATE_DIR, f'{session_id}.json')
+    state_path = _state_path(session_id)
     if os.path.exists(state_path):
         os.remove(state_path)
+        campaign_index.invalidate()
         flash('Campaign deleted successfully.', 'success')
     else:
         flash('Campaign not found.', 'error')
@@ -254,6 +267,7 @@ def sync_character(char_id: str):
     char['hit_dice'] = f"{level}d{hit_die}"
     
     save_character(char_id, char)
+    character_index.invalidate()
     flash(f'Synced {char["name"]} with {class_name} level {level} data!', 'success')
     return redirect(url_for('portal.character_detail', char_id=char_id))
 
@@ -261,44 +275,46 @@ def sync_character(char_id: str):
 @portal_bp.route('/character/<char_id>/spells', methods=['GET'])
 def manage_spells(char_id: str):
     """Show spell management page."""
-    char = load_character(char_id)
-    if not char:
-        abort(404)
+    def build():
+        char = load_character(char_id)
+        if not char:
+            abort(404)
     
-    available_spells = []
-    available_cantrips = []
+        available_spells = []
+        available_cantrips = []
     
-    if DND_DATA_AVAILABLE:
-        class_name = char.get('class', 'Fighter')
+        if DND_DATA_AVAILABLE:
+            class_name = char.get('class', 'Fighter')
         
-        # Get spells for this class
-        for spell_name, spell_data in SPELLS.items():
-            if class_name in spell_data.get('classes', []):
-                spell_info = {
-                    'name': spell_name,
-                    'level': spell_data.get('level', 0),
-                    'school': spell_data.get('school', ''),
-                    'ritual': spell_data.get('ritual', False),
-                    'concentration': spell_data.get('concentration', False),
-                    'known': spell_name in char.get('spells_known', []),
-                    'prepared': spell_name in char.get('prepared_spells', []),
-                    'is_cantrip': spell_data.get('level', 0) == 0,
-                    'cantrip_known': spell_name in char.get('cantrips_known', [])
-                }
-                if spell_data.get('level', 0) == 0:
-                    available_cantrips.append(spell_info)
-                else:
-                    available_spells.append(spell_info)
+            # Get spells for this class
+            for spell_name, spell_data in SPELLS.items():
+                if class_name in spell_data.get('classes', []):
+                    spell_info = {
+                        'name': spell_name,
+                        'level': spell_data.get('level', 0),
+                        'school': spell_data.get('school', ''),
+                        'ritual': spell_data.get('ritual', False),
+                        'concentration': spell_data.get('concentration', False),
+                        'known': spell_name in char.get('spells_known', []),
+                        'prepared': spell_name in char.get('prepared_spells', []),
+                        'is_cantrip': spell_data.get('level', 0) == 0,
+                        'cantrip_known': spell_name in char.get('cantrips_known', [])
+                    }
+                    if spell_data.get('level', 0) == 0:
+                        available_cantrips.append(spell_info)
+                    else:
+                        available_spells.append(spell_info)
         
-        # Sort by level then name
-        available_spells.sort(key=lambda x: (x['level'], x['name']))
-        available_cantrips.sort(key=lambda x: x['name'])
+            # Sort by level then name
+            available_spells.sort(key=lambda x: (x['level'], x['name']))
+            available_cantrips.sort(key=lambda x: x['name'])
     
-    return render_template('spell_management.html', 
-                          char=char, 
-                          char_id=char_id,
-                          available_spells=available_spells,
-                          available_cantrips=available_cantrips)
+        return render_template('spell_management.html', 
+                              char=char, 
+                              char_id=char_id,
+                              available_spells=available_spells,
+                              available_cantrips=available_cantrips)
+    return conditional(file_validators(_character_path(char_id)), build)
 
 
 @portal_bp.route('/character/<char_id>/spells/learn', methods=['POST'])
@@ -364,3 +380,41 @@ def prepare_spell_route(char_id: str):
         flash(message, 'error')
     
     return redirect(url_for('portal.manage_spells', char_id=char_id))
+
+
+# ============ JSON API ============
+
+@portal_bp.route('/api/characters')
+def api_characters():
+    """Paged character summaries (same query parameters as the character list)."""
+    args = _listing_args()
+    character_index.refresh()
+    validators = version_validators('characters', character_index.version, request.query_string)
+    return conditional(validators, lambda: jsonify(character_index.page(**args)))
+
+
+@portal_bp.route('/api/campaigns/<session_id>')
+def api_campaign(session_id: str):
+    """A campaign's overview: title, setting, players, memory, NPCs and quests."""
+    path = _state_path(session_id)
+    if not os.path.exists(path):
+        return jsonify({'error': 'Campaign not found'}), 404
+
+    def build():
+        state = load_state(session_id)
+        return jsonify({
+            'id': session_id,
+            'title': state.get('campaign_title') or 'Untitled Campaign',
+            'realm': state.get('realm', ''),
+            'location': state.get('location', ''),
+            'plot_hook': state.get('plot_hook', ''),
+            'players': state.get('players', []),
+            'difficulty': state.get('difficulty', 'normal'),
+            'in_combat': state.get('in_combat', False),
+            'summary': state.get('campaign_summary', ''),
+            'context': get_context_summary(state),
+            'npcs': state.get('key_npcs', []),
+            'quests': state.get('quests', []),
+            'key_events': state.get('key_events', []),
+        })
+    return conditional(file_validators(path), build)
@@ -0,0 +1,218 @@
+"""
+Summary indexes for the portal's list pages.
+
+Listing characters or campaigns used to open and parse every JSON file on
+each request. A ``SummaryIndex`` keeps the few fields a list page shows, per
+file, in a manifest validated by file mtime: a refresh is one ``scandir`` pass
+that only re-reads files whose mtime or size changed, and it runs at most
+once every REFRESH_SECONDS (the bot writes these files from another process).
+Sorted orders are cached until something changes, so serving a page is a
+slice of a ready-made list. The manifest is saved under ``data/`` so a
+restarted portal doesn't have to parse everything again.
+"""
+
+import json
+import os
+import time
+from threading import RLock
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import Config
+
+INDEX_DIR = os.path.join(Config.BASE_DIR, 'data')
+REFRESH_SECONDS = 5.0
+PER_PAGE = 24
+MAX_PER_PAGE = 200
+
+
+class SummaryIndex:
+    """mtime-validated summaries of the ``*.json`` files in one directory."""
+
+    def __init__(self, name: str, directory: str, summarize: Callable[[str, Dict], Dict],
+                 sort_keys: Dict[str, Callable[[Dict], object]], default_sort: str):
+        self.name = name
+        self.directory = directory
+        self.summarize = summarize
+        self.sort_keys = sort_keys
+        self.default_sort = default_sort
+        self.manifest_path = os.path.join(INDEX_DIR, f'portal_{name}_index.json')
+        self.entries: Dict[str, Dict] = {}   # id -> {'mtime', 'size', 'summary'}
+        self.version = 0                     # bumped whenever a summary changes
+        self.checked_at = 0.0
+        self._orders: Dict[Tuple[str, bool], List[Dict]] = {}
+        self._lock = RLock()
+        self._load_manifest()
+
+    # ---------- manifest ----------
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = data.get('entries', {})
+            self.version = data.get('version', 0)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def _save_manifest(self):
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        tmp = self.manifest_path + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.version, 'entries': self.entries}, f)
+            os.replace(tmp, self.manifest_path)
+        except OSError as e:
+            print(f"Failed to save {self.name} index: {e}")
+
+    # ---------- refresh ----------
+
+    def _read(self, path: str) -> Optional[Dict]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def refresh(self, force: bool = False) -> bool:
+        """Pick up added, changed and removed files. Returns True if anything changed."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self.checked_at < REFRESH_SECONDS:
+                return False
+            self.checked_at = now
+
+            seen = set()
+            changed = False
+            try:
+                scan = list(os.scandir(self.directory))
+            except OSError:
+                scan = []
+            for entry in scan:
+                if not entry.name.endswith('.json') or not entry.is_file():
+                    continue
+                item_id = entry.name[:-5]
+                seen.add(item_id)
+                stat = entry.stat()
+                known = self.entries.get(item_id)
+                if known and known['mtime'] == stat.st_mtime_ns and known['size'] == stat.st_size:
+                    continue
+                data = self._read(entry.path)
+                if data is None:
+                    continue
+                self.entries[item_id] = {
+                    'mtime': stat.st_mtime_ns,
+                    'size': stat.st_size,
+                    'summary': self.summarize(item_id, data),
+                }
+                changed = True
+            for item_id in [i for i in self.entries if i not in seen]:
+                del self.entries[item_id]
+                changed = True
+
+            if changed:
+                self.version += 1
+                self._orders.clear()
+                self._save_manifest()
+            return changed
+
+    def invalidate(self):
+        """Make the next request rescan (after this process wrote or deleted a file)."""
+        with self._lock:
+            self.checked_at = 0.0
+
+    # ---------- queries ----------
+
+    def _ordered(self, sort: str, descending: bool) -> List[Dict]:
+        key = (sort, descending)
+        order = self._orders.get(key)
+        if order is None:
+            sort_key = self.sort_keys[sort]
+            name_key = self.sort_keys[self.default_sort]
+            summaries = [e['summary'] for e in self.entries.values()]
+            # Stable sorts: by name first so equal keys stay alphabetical
+            summaries.sort(key=name_key)
+            summaries.sort(key=sort_key, reverse=descending)
+            order = self._orders[key] = summaries
+        return order
+
+    def all(self) -> List[Dict]:
+        """Every summary, in default order."""
+        with self._lock:
+            self.refresh()
+            return list(self._ordered(self.default_sort, False))
+
+    def page(self, page: int = 1, per_page: int = PER_PAGE, sort: Optional[str] = None,
+             descending: bool = False) -> Dict:
+        """
+        One page of summaries.
+
+        Args:
+            page: 1-based page number (clamped to the available pages)
+            per_page: Items per page (1..MAX_PER_PAGE)
+            sort: One of ``sort_keys`` (default sort if unknown)
+            descending: Reverse the order
+
+        Returns:
+            Dict with ``items``, ``page``, ``pages``, ``total``, ``per_page``,
+            ``sort``, ``descending`` and the index ``version``
+        """
+        with self._lock:
+            self.refresh()
+            sort = sort if sort in self.sort_keys else self.default_sort
+            per_page = max(1, min(per_page, MAX_PER_PAGE))
+            order = self._ordered(sort, descending)
+            total = len(order)
+            pages = max(1, -(-total // per_page))
+            page = max(1, min(page, pages))
+            start = (page - 1) * per_page
+            return {
+                'items': order[start:start + per_page],
+                'page': page,
+                'pages': pages,
+                'total': total,
+                'per_page': per_page,
+                'sort': sort,
+                'descending': descending,
+                'version': self.version,
+            }
+
+
+def _character_summary(char_id: str, data: Dict) -> Dict:
+    return {
+        'id': char_id,
+        'name': data.get('name', char_id),
+        'race': data.get('race', ''),
+        'char_class': data.get('class', ''),
+        'level': data.get('level', 1),
+    }
+
+
+def _campaign_summary(session_id: str, data: Dict) -> Dict:
+    return {
+        'id': session_id,
+        'title': data.get('campaign_title', 'Untitled Campaign'),
+        'realm': data.get('realm', ''),
+        'player_count': len(data.get('players', [])),
+    }
+
+
+def _text(field):
+    return lambda s: str(s.get(field) or '').casefold()
+
+
+def _number(field):
+    return lambda s: s.get(field) if isinstance(s.get(field), (int, float)) else 0
+
+
+character_index = SummaryIndex(
+    'characters', Config.CHARACTERS_DIR, _character_summary,
+    {'name': _text('name'), 'level': _number('level'),
+     'class': _text('char_class'), 'race': _text('race')},
+    default_sort='name',
+)
+
+campaign_index = SummaryIndex(
+    'campaigns', Config.STATE_DIR, _campaign_summary,
+    {'title': _text('title'), 'realm': _text('realm'), 'players': _number('player_count')},
+    default_sort='title',
+)